@@ -0,0 +1,164 @@
+"""
+异步API请求引擎
+在后台事件循环中以有限并发执行API请求，供所有处理器共享
+"""
+
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Optional, Tuple
+
+from openai import AsyncOpenAI
+
+from logger import ResponseLog
+from mock_server import MockServer
+from profiler import Profiler
+from rate_limiter import RateController
+from response_cache import ResponseCache
+from token_counter import TokenCounter
+from usage import UsageTracker
+
+
+class AsyncAPIEngine:
+    """异步并发API请求引擎"""
+
+    def __init__(self, api_key: str, base_url: str, max_concurrency: int = 8, timeout: float = None,
+                 rate_controller: RateController = None, response_cache: ResponseCache = None,
+                 usage_tracker: UsageTracker = None, profiler: Profiler = None, response_log: ResponseLog = None,
+                 token_counter: TokenCounter = None):
+        """
+        初始化请求引擎
+
+        Args:
+            api_key: OpenAI API密钥
+            base_url: API地址
+            max_concurrency: 同时在途的最大请求数
+            timeout: 单次请求超时秒数
+            rate_controller: 共享的速率控制器，为空时不限速
+            response_cache: 共享的响应缓存，为空时不缓存
+            usage_tracker: 共享的用量统计器，为空时使用不带价格表的统计器
+            profiler: 共享的性能分析器，为空时不记录性能数据
+            response_log: 共享的原始响应记录，为空时不采样、不写入文件
+            token_counter: 共享的离线token计数器，为空时使用附带的BPE词表
+        """
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.rate_controller = rate_controller or RateController()
+        self.response_cache = response_cache
+        self.usage_tracker = usage_tracker or UsageTracker()
+        self.profiler = profiler or Profiler(enabled=False)
+        self.response_log = response_log or ResponseLog()
+        self.token_counter = token_counter or TokenCounter()
+        # 进程内启动的模拟服务（mock.enabled 时由 from_config 设置）
+        self.mock_server = None
+        # 重试由速率控制器统一负责，关闭客户端自带的重试
+        client_kwargs = {'api_key': api_key, 'base_url': base_url, 'max_retries': 0}
+        if timeout:
+            client_kwargs['timeout'] = timeout
+        self.client = AsyncOpenAI(**client_kwargs)
+
+        # 后台事件循环，所有请求都在该线程中执行
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="api-engine", daemon=True)
+        self._thread.start()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    @classmethod
+    def from_config(cls, config) -> "AsyncAPIEngine":
+        """根据配置创建请求引擎（启用 mock 时在进程内启动模拟服务并连接到它）"""
+        mock_server = MockServer.from_config(config)
+        base_url = mock_server.start() if mock_server else config.get('openai.base_url')
+        engine = cls(
+            api_key=config.get('openai.api_key'),
+            base_url=base_url,
+            max_concurrency=config.get('generation.max_concurrency', 8),
+            timeout=config.get('openai.timeout'),
+            rate_controller=RateController.from_config(config),
+            response_cache=ResponseCache.from_config(config),
+            usage_tracker=UsageTracker.from_config(config),
+            profiler=Profiler.from_config(config),
+            response_log=ResponseLog.from_config(config),
+            token_counter=TokenCounter.from_config(config)
+        )
+        engine.mock_server = mock_server
+        return engine
+
+    def _run_loop(self):
+        """事件循环线程入口"""
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def slot(self) -> asyncio.Semaphore:
+        """获取在途请求槽位（在协程中使用 async with）"""
+        return self._semaphore
+
+    def submit(self, coro: Awaitable):
+        """提交协程到后台事件循环，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Awaitable) -> Any:
+        """提交协程并阻塞等待结果"""
+        return self.submit(coro).result()
+
+    def imap(self, func: Callable[[Any], Awaitable], items: Iterable,
+             window: Optional[int] = None) -> Iterator[Tuple[Any, Any]]:
+        """
+        并发执行 func(item)，按输入顺序产出 (item, result)
+
+        items 按需惰性读取，最多保持 window 个未完成的任务；
+        执行失败时 result 为异常对象，不会中断后续任务
+
+        Args:
+            func: 接收单个item并返回协程的函数
+            items: 输入项（可以是惰性迭代器）
+            window: 最大未完成任务数，默认为并发数的4倍
+        """
+        if window is None:
+            window = self.max_concurrency * 4
+        window = max(1, window)
+
+        async def _safe(item):
+            try:
+                return await func(item)
+            except Exception as e:
+                return e
+
+        pending = deque()
+        iterator = iter(items)
+        exhausted = False
+
+        try:
+            while True:
+                # 补充任务直到窗口填满
+                while not exhausted and len(pending) < window:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.append((item, self.submit(_safe(item))))
+
+                if not pending:
+                    break
+
+                item, future = pending.popleft()
+                yield item, future.result()
+        finally:
+            # 提前退出时取消尚未完成的任务
+            for _, future in pending:
+                future.cancel()
+
+    def close(self):
+        """关闭客户端并停止事件循环"""
+        if not self._loop.is_running():
+            return
+        try:
+            self.run(self.client.close())
+            if self.response_cache:
+                self.response_cache.close()
+            self.profiler.close()
+            self.response_log.close()
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            if self.mock_server:
+                self.mock_server.stop()
@@ -0,0 +1,246 @@
+"""
+批处理提交模块
+将一个处理阶段的全部请求写成OpenAI Batch格式的JSONL文件，提交后轮询完成状态并取回结果
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+from response_cache import ResponseCache
+from prompts import PromptManager
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# 批处理的终止状态
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchRequestError(Exception):
+    """批处理中单条请求失败"""
+    pass
+
+
+class BatchRunner:
+    """批处理提交器"""
+
+    def __init__(self, generator):
+        """
+        初始化批处理提交器
+
+        Args:
+            generator: 数据生成器实例
+        """
+        self.generator = generator
+        self.config = generator.config
+        self.engine = generator.engine
+        self.mode = self.config.get('batch.mode', 'openai')
+        self.poll_interval = self.config.get('batch.poll_interval', 30)
+        self.completion_window = self.config.get('batch.completion_window', '24h')
+        self.max_requests = self.config.get('batch.max_requests_per_batch', 50000)
+        self.work_dir = generator.path_manager.get_output_path("batch", f"{generator.world}_{generator.role}")
+
+    def is_enabled(self, stage: str) -> bool:
+        """判断指定阶段是否使用批处理模式"""
+        if not self.config.get('batch.enabled', False):
+            return False
+        return stage in (self.config.get('batch.stages') or [])
+
+    def run(self, stage: str, requests: List[Dict]) -> List[Any]:
+        """
+        以批处理方式执行一个阶段的全部请求
+
+        Args:
+            stage: 阶段名称
+            requests: acall_openai_api 参数字典列表
+
+        Returns:
+            与requests顺序一致的结果列表，失败项为异常对象
+        """
+        results = [None] * len(requests)
+        cache = self.engine.response_cache
+        version = self.config.get('cache.prompt_version', PromptManager.PROMPT_VERSION)
+        default_model = self.config.get('models.base_model')
+
+        # 已缓存的请求不再提交
+        pending = []
+        for index, request in enumerate(requests):
+            request = dict(request)
+            request['model'] = request.get('model') or default_model
+            request.setdefault('temperature', 0.8)
+            cache_key = ResponseCache.make_key(request['model'], request['messages'], request['temperature'], version,
+                                               request.get('response_format'))
+            cached = cache.get(cache_key) if cache else None
+            if cached is not None:
+                results[index] = cached
+                self.engine.usage_tracker.record_cache_hit(self.generator.world, self.generator.role, stage)
+            else:
+                pending.append((index, request, cache_key))
+
+        if not pending:
+            return results
+
+        print(f"    [Batch] {stage}: 提交 {len(pending)} 条请求（{len(requests) - len(pending)} 条命中缓存）")
+
+        for start in range(0, len(pending), self.max_requests):
+            chunk = pending[start:start + self.max_requests]
+            outputs = self._run_chunk(stage, start // self.max_requests, chunk)
+            for index, request, cache_key in chunk:
+                result = outputs.get(f"{stage}-{index}")
+                if result is None:
+                    result = BatchRequestError(f"批处理结果缺失: {stage}-{index}")
+                elif cache and not isinstance(result, Exception):
+                    cache.set(cache_key, request['model'], result)
+                results[index] = result
+
+        return results
+
+    def _run_chunk(self, stage: str, chunk_index: int, chunk: List) -> Dict[str, Any]:
+        """提交一个批文件并等待结果"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        input_path = os.path.join(self.work_dir, f"{stage}_{chunk_index}_input.jsonl")
+        output_path = os.path.join(self.work_dir, f"{stage}_{chunk_index}_output.jsonl")
+        state_path = os.path.join(self.work_dir, f"{stage}_{chunk_index}_state.json")
+
+        digest = self.write_input(input_path, stage, chunk)
+
+        # 输入未变化且已有结果时直接读取
+        state = self._load_state(state_path)
+        if state.get('input_hash') == digest and os.path.exists(output_path):
+            return self.read_output(output_path)
+
+        if self.mode == 'local':
+            self._run_local(stage, input_path, output_path)
+        else:
+            self._run_remote(input_path, output_path, state_path, state, digest)
+            self._record_usage(stage, output_path)
+
+        self._save_state(state_path, {**self._load_state(state_path), 'input_hash': digest})
+        return self.read_output(output_path)
+
+    def write_input(self, path: str, stage: str, chunk: List) -> str:
+        """写入Batch格式的输入文件，返回文件内容哈希"""
+        digest = hashlib.sha256()
+        with open(path, 'w', encoding='utf-8') as f:
+            for index, request, _ in chunk:
+                line = json.dumps({
+                    "custom_id": f"{stage}-{index}",
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {
+                        "model": request['model'],
+                        "messages": request['messages'],
+                        "temperature": request['temperature'],
+                        **({"response_format": request['response_format']} if request.get('response_format') else {})
+                    }
+                }, ensure_ascii=False)
+                f.write(line + '\n')
+                digest.update(line.encode('utf-8'))
+        return digest.hexdigest()
+
+    def read_output(self, path: str) -> Dict[str, Any]:
+        """读取Batch格式的输出文件，返回 custom_id -> 响应内容或异常"""
+        outputs = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                custom_id = record.get("custom_id")
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    outputs[custom_id] = BatchRequestError(str(record.get("error") or response))
+                    continue
+                content = response["body"]["choices"][0]["message"].get("content")
+                outputs[custom_id] = content.strip() if content else ""
+        return outputs
+
+    def _run_remote(self, input_path: str, output_path: str, state_path: str, state: Dict, digest: str):
+        """提交到OpenAI Batch API并轮询直到完成"""
+        client = self.engine.client
+        batch_id = state.get('batch_id') if state.get('input_hash') == digest else None
+
+        if batch_id is None:
+            with open(input_path, 'rb') as f:
+                input_file = self.engine.run(client.files.create(file=f, purpose="batch"))
+            batch = self.engine.run(client.batches.create(
+                input_file_id=input_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=self.completion_window
+            ))
+            batch_id = batch.id
+            # 记录批次ID，中断后重跑时继续轮询而不是重复提交
+            self._save_state(state_path, {'batch_id': batch_id, 'input_hash': digest})
+            print(f"    [Batch] 已提交批次: {batch_id}")
+
+        while True:
+            batch = self.engine.run(client.batches.retrieve(batch_id))
+            if batch.status in FINISHED_STATUSES:
+                break
+            counts = batch.request_counts
+            if counts is not None:
+                print(f"    [Batch] {batch_id}: {batch.status} ({counts.completed}/{counts.total})")
+            time.sleep(self.poll_interval)
+
+        if batch.status != "completed" and not batch.output_file_id:
+            self._save_state(state_path, {'input_hash': None})
+            raise BatchRequestError(f"批次 {batch_id} 未完成，状态: {batch.status}")
+
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = self.engine.run(client.files.content(file_id))
+                lines.append(content.text.rstrip('\n'))
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(line for line in lines if line) + '\n')
+
+    def _record_usage(self, stage: str, output_path: str):
+        """按批处理输出文件中的usage记录用量（按Batch价格计费）"""
+        tracker = self.engine.usage_tracker
+        with open(output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                body = (json.loads(line).get("response") or {}).get("body") or {}
+                if body.get("usage"):
+                    tracker.record(self.generator.world, self.generator.role, stage, body.get("model"),
+                                   body["usage"], batch=True)
+
+    def _run_local(self, stage: str, input_path: str, output_path: str):
+        """本地替代实现：逐条读取批文件并通过请求引擎并发执行，输出同格式的结果文件"""
+        with open(input_path, 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+
+        def build_request(line):
+            body = line["body"]
+            return {"messages": body["messages"], "model": body["model"], "temperature": body["temperature"],
+                    "stage": stage, "response_format": body.get("response_format")}
+
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for line, result in self.generator.iter_openai_api(lines, build_request):
+                record = {"id": f"local-{line['custom_id']}", "custom_id": line["custom_id"]}
+                if isinstance(result, Exception):
+                    record["response"] = None
+                    record["error"] = {"code": type(result).__name__, "message": str(result)}
+                else:
+                    record["response"] = {
+                        "status_code": 200,
+                        "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": result}}]}
+                    }
+                    record["error"] = None
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def _load_state(self, path: str) -> Dict:
+        """读取批次状态文件"""
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_state(self, path: str, state: Dict):
+        """保存批次状态文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
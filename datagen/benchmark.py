@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+端到端基准测试
+生成指定规模的合成世界（Wiki段落、对话场景），连接本地模拟服务运行完整的 DataGenerator 流程，
+在不同并发设置下记录总耗时、各阶段吞吐量、请求数和内存峰值，结果保存为JSON以便在提交之间对比
+
+用法：
+    python benchmark.py --size small --concurrency 4 8 16
+    python benchmark.py --passages 200 --scenes 100 --compare benchmark_results/bench_xxx.json
+"""
+
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Optional
+
+import yaml
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from utils import save_json
+
+
+# 预设的合成世界规模
+SIZES = {
+    'tiny': {'passages': 5, 'scenes': 4, 'utterances': 6, 'statements': 3, 'keywords': 3},
+    'small': {'passages': 30, 'scenes': 20, 'utterances': 10, 'statements': 4, 'keywords': 5},
+    'medium': {'passages': 150, 'scenes': 100, 'utterances': 12, 'statements': 5, 'keywords': 6},
+    'large': {'passages': 600, 'scenes': 400, 'utterances': 16, 'statements': 6, 'keywords': 7}
+}
+
+
+def build_world(input_base: str, roleagentbench_root: str, world: str, role: str, passages: int, scenes: int,
+                utterances: int, language: str = 'zh'):
+    """
+    生成合成世界的输入文件
+
+    Args:
+        input_base: 本地输入目录（wiki/general）
+        roleagentbench_root: 数据集根目录（profiles）
+        world: 世界名称
+        role: 角色名称
+        passages: Wiki段落数
+        scenes: 对话场景数
+        utterances: 每个场景的台词数（约一半属于该角色）
+        language: 语言类型
+    """
+    zh = language == 'zh'
+    other = "路人" if zh else "Friend"
+
+    def passage(index):
+        if zh:
+            return f"{role}在第{index}段经历中去了第{index}个地方，认识了第{index}位朋友。" * 3
+        return f"In episode {index}, {role} visited place {index} and met friend {index}. " * 3
+
+    def line(scene, index):
+        if zh:
+            return f"第{scene}场第{index}句：今天的事情真是太有意思了，我们一起去看看吧。"
+        return f"Scene {scene} line {index}: What a day, let's go and have a look together."
+
+    os.makedirs(os.path.join(input_base, "wiki"), exist_ok=True)
+    os.makedirs(os.path.join(input_base, "general"), exist_ok=True)
+    with open(os.path.join(input_base, "wiki", f"wiki_{role}.txt"), 'w', encoding='utf-8') as f:
+        f.write("\n\n".join(passage(i) for i in range(1, passages + 1)))
+    with open(os.path.join(input_base, "general", f"general_{role}.txt"), 'w', encoding='utf-8') as f:
+        f.write(f"{role}是{world}中的角色，性格活泼，喜欢交朋友。" if zh
+                else f"{role} is a character in {world}, lively and friendly.")
+
+    profile_dir = os.path.join(roleagentbench_root, world, "profiles")
+    os.makedirs(profile_dir, exist_ok=True)
+    with open(os.path.join(profile_dir, f"{role}.jsonl"), 'w', encoding='utf-8') as f:
+        for scene in range(scenes):
+            for index in range(utterances):
+                speaker = role if index % 2 == 0 else other
+                f.write(json.dumps({"scene_id": scene, "role": speaker, "content": line(scene, index)},
+                                   ensure_ascii=False) + "\n")
+
+
+def set_dotted(config: Dict, key: str, value):
+    """按点号分隔的键设置嵌套配置"""
+    keys = key.split('.')
+    node = config
+    for k in keys[:-1]:
+        if not isinstance(node.get(k), dict):
+            node[k] = {}
+        node = node[k]
+    node[keys[-1]] = value
+
+
+def build_config(base: Dict, workdir: str, world: str, role: str, language: str, concurrency: int,
+                 scale: Dict, args) -> Dict:
+    """基于原有配置生成一次基准运行的配置（连接模拟服务，关闭缓存/检查点/示例模式）"""
+    config = copy.deepcopy(base)
+    output_base = os.path.join(workdir, "output")
+    config['paths'] = {
+        'roleagentbench_root': os.path.join(workdir, "RoleAgentBench"),
+        'input_base': os.path.join(workdir, "input"),
+        'output_base': output_base,
+        'process_dir': os.path.join(output_base, "process"),
+        'qa_dir': os.path.join(output_base, "qa"),
+        'all_dir': os.path.join(output_base, "all"),
+        'train_dir': os.path.join(output_base, "train"),
+        'test_dir': os.path.join(output_base, "test")
+    }
+    config['language'] = language
+    config['worlds'] = {world: [role]}
+    config['s1e1_worlds'] = []
+    overrides = {
+        'mock.enabled': True,
+        'mock.port': 0,
+        'mock.latency.distribution': args.latency,
+        'mock.latency.mean': args.latency_mean,
+        'mock.latency.std': args.latency_std,
+        'mock.latency.min': 0.0,
+        'mock.error_rate': args.error_rate,
+        'mock.rate_limit_rate': args.rate_limit_rate,
+        'mock.retry_after': 0.1,
+        'mock.responses.statements_per_passage': scale['statements'],
+        'mock.responses.keywords_per_anti': scale['keywords'],
+        'cache.enabled': False,
+        'checkpoint.enabled': False,
+        'batch.enabled': False,
+        'demo_mode.enabled': False,
+        'profiling.enabled': True,
+        'rate_limit.requests_per_minute': None,
+        'rate_limit.tokens_per_minute': None,
+        'generation.max_concurrency': concurrency,
+        'generation.sleep_interval': 0.05
+    }
+    for key, value in overrides.items():
+        set_dotted(config, key, value)
+    for item in args.set or []:
+        key, _, value = item.partition('=')
+        set_dotted(config, key, yaml.safe_load(value))
+    return config
+
+
+def run_once(config_path: str, world: str, role: str, language: str) -> Dict:
+    """在当前进程中运行一次完整流程并收集指标（由子进程调用，保证内存峰值互不影响）"""
+    from generator import DataGenerator
+
+    generator = DataGenerator(world, role, config_path, language=language)
+    engine = generator.engine
+    start_time = time.perf_counter()
+    error = None
+    try:
+        generator.run()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall_seconds = time.perf_counter() - start_time
+
+    profile = engine.profiler.summary(world, role)
+    mock_stats = engine.mock_server.get_stats() if engine.mock_server else {}
+    engine.close()
+
+    stages = {}
+    for name, info in profile.items():
+        api = info['metrics'].get('api') or {}
+        stages[name] = {
+            'seconds': info['seconds'],
+            'items': info['items'],
+            'items_per_second': info['items_per_second'],
+            'api_calls': api.get('count', 0),
+            'api_errors': api.get('errors', 0),
+            'api_p50': api.get('p50'),
+            'api_p99': api.get('p99'),
+            'peak_rss_mb': info['peak_rss_mb']
+        }
+    peaks = [info['peak_rss_mb'] for info in profile.values() if info['peak_rss_mb'] is not None]
+    return {
+        'wall_seconds': round(wall_seconds, 3),
+        'error': error,
+        'requests': mock_stats.get('requests', 0),
+        'requests_by_type': {key[len('type_'):]: count for key, count in mock_stats.items() if key.startswith('type_')},
+        'injected_errors': {key[len('status_'):]: count for key, count in mock_stats.items() if key.startswith('status_')},
+        'output_items': sum(stage['items'] for stage in stages.values()),
+        'peak_rss_mb': max(peaks) if peaks else None,
+        'stages': stages
+    }
+
+
+def get_commit() -> Optional[str]:
+    """获取当前代码的git提交，不在仓库中时返回None"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=current_dir, capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args) -> Dict:
+    """按各并发设置依次在子进程中运行基准测试"""
+    with open(args.config, 'r', encoding='utf-8') as f:
+        base = yaml.safe_load(f)
+    scale = dict(SIZES[args.size])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+
+    results = {
+        'commit': get_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'scale': scale,
+        'language': args.language,
+        'mock': {
+            'latency': args.latency,
+            'latency_mean': args.latency_mean,
+            'latency_std': args.latency_std,
+            'error_rate': args.error_rate,
+            'rate_limit_rate': args.rate_limit_rate
+        },
+        'overrides': args.set or [],
+        'runs': []
+    }
+    world, role = args.world, args.role
+
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory(prefix="datagen-bench-") as workdir:
+            build_world(os.path.join(workdir, "input"), os.path.join(workdir, "RoleAgentBench"), world, role,
+                        scale['passages'], scale['scenes'], scale['utterances'], args.language)
+            config_path = os.path.join(workdir, "config.yaml")
+            with open(config_path, 'w', encoding='utf-8') as f:
+                yaml.safe_dump(build_config(base, workdir, world, role, args.language, concurrency, scale, args),
+                               f, allow_unicode=True)
+
+            result_path = os.path.join(workdir, "result.json")
+            command = [sys.executable, os.path.abspath(__file__), "--child", config_path, "--result", result_path,
+                       "--world", world, "--role", role, "--language", args.language]
+            print(f"并发 {concurrency}: 运行中...", flush=True)
+            output = None if args.verbose else subprocess.DEVNULL
+            completed = subprocess.run(command, cwd=current_dir, stdout=output, stderr=output)
+            if completed.returncode != 0 or not os.path.exists(result_path):
+                run = {'error': f"子进程退出码 {completed.returncode}"}
+            else:
+                with open(result_path, 'r', encoding='utf-8') as f:
+                    run = json.load(f)
+        run['concurrency'] = concurrency
+        results['runs'].append(run)
+        print_run(run)
+
+    return results
+
+
+def print_run(run: Dict):
+    """输出一次运行的摘要"""
+    if 'wall_seconds' not in run:
+        print(f"  失败: {run.get('error')}")
+        return
+    rss = f", 内存峰值 {run['peak_rss_mb']} MB" if run['peak_rss_mb'] is not None else ""
+    print(f"  总耗时 {run['wall_seconds']}s, 请求 {run['requests']} 次, 产出 {run['output_items']} 条{rss}"
+          + (f", 错误: {run['error']}" if run['error'] else ""))
+    for name, stage in run['stages'].items():
+        print(f"    {name}: {stage['seconds']}s, {stage['items']} 条 ({stage['items_per_second']} 条/s), "
+              f"API {stage['api_calls']} 次, p50 {stage['api_p50']}s")
+
+
+def compare(current: Dict, baseline: Dict):
+    """按并发设置对比两次基准测试结果"""
+    def percent(new, old):
+        if not old or new is None:
+            return "-"
+        return f"{(new - old) / old:+.1%}"
+
+    print(f"\n对比基准 {baseline.get('commit')} ({baseline.get('timestamp')}) -> {current.get('commit')}")
+    if baseline.get('scale') != current.get('scale'):
+        print(f"  注意: 数据规模不同 {baseline.get('scale')} vs {current.get('scale')}")
+    old_runs = {run['concurrency']: run for run in baseline.get('runs', [])}
+    for run in current['runs']:
+        old = old_runs.get(run['concurrency'])
+        if old is None or 'wall_seconds' not in run or 'wall_seconds' not in old:
+            continue
+        print(f"  并发 {run['concurrency']}: 总耗时 {old['wall_seconds']}s -> {run['wall_seconds']}s "
+              f"({percent(run['wall_seconds'], old['wall_seconds'])}), "
+              f"请求 {old['requests']} -> {run['requests']}")
+        for name, stage in run['stages'].items():
+            old_stage = old['stages'].get(name)
+            if old_stage:
+                print(f"    {name}: {old_stage['items_per_second']} -> {stage['items_per_second']} 条/s "
+                      f"({percent(stage['items_per_second'], old_stage['items_per_second'])})")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="数据生成流程的端到端基准测试")
+    parser.add_argument("--config", "-c", default="config.yaml", help="基础配置文件（打包、流式等设置沿用其中的值）")
+    parser.add_argument("--size", "-s", choices=sorted(SIZES), default="small", help="预设的合成世界规模")
+    parser.add_argument("--passages", type=int, help="Wiki段落数")
+    parser.add_argument("--scenes", type=int, help="对话场景数")
+    parser.add_argument("--utterances", type=int, help="每个场景的台词数")
+    parser.add_argument("--statements", type=int, help="每个段落生成的陈述数")
+    parser.add_argument("--keywords", type=int, help="每个反例的关键词数")
+    parser.add_argument("--concurrency", "-n", type=int, nargs="+", default=[1, 8, 32], help="要测试的并发数")
+    parser.add_argument("--language", "-l", choices=["zh", "en"], default="zh", help="合成世界的语言")
+    parser.add_argument("--world", default="BenchWorld", help="合成世界名称")
+    parser.add_argument("--role", default="BenchRole", help="合成角色名称")
+    parser.add_argument("--latency", choices=["fixed", "uniform", "normal", "lognormal"], default="lognormal",
+                        help="模拟服务的延迟分布")
+    parser.add_argument("--latency-mean", type=float, default=0.2, help="模拟服务的平均延迟秒数")
+    parser.add_argument("--latency-std", type=float, default=0.1, help="模拟服务的延迟标准差")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入500错误的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="注入429错误的比例")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE",
+                        help="覆盖配置项，如 --set packing.enabled=true（可多次使用）")
+    parser.add_argument("--output", "-o", default="benchmark_results", help="结果输出目录")
+    parser.add_argument("--compare", help="与之前保存的结果文件对比")
+    parser.add_argument("--verbose", "-v", action="store_true", help="显示流程的完整输出")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        save_json(run_once(args.child, args.world, args.role, args.language), args.result)
+        return
+
+    results = run_suite(args)
+    path = os.path.join(args.output, f"bench_{results['commit'] or 'nocommit'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    save_json(results, path)
+    print(f"\n基准测试结果: {path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+    if any('wall_seconds' not in run or run['error'] for run in results['runs']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
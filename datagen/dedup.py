@@ -0,0 +1,293 @@
+"""
+近似重复去重模块
+合并后的问答数据中，同一个问题常以相同或略有不同的写法出现在 qa_statement、qa_summary、qa_conv、qa_chat 中，
+既浪费训练算力，又会在训练集和测试集之间泄漏。这里用MinHash签名加LSH分带索引检测近似重复的问题：
+中文按字符n-gram、英文按词n-gram切分，每条数据只与落入同一分带桶的候选比较，
+总耗时与数据量近似线性，可用于同一世界所有角色的数百万条数据。
+
+用法（对问答文件去重并输出报告，不修改原文件）：
+    python dedup.py qa.json [qa2.json ...] [--threshold 0.8]
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import struct
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# 含CJK字符的文本按字符切分
+_CJK = re.compile(r'[぀-ヿ㐀-䶿一-鿿豈-﫿]')
+_NON_WORD = re.compile(r'[\W_]+')
+
+# 每次blake2b计算产出的32位哈希值个数（64字节摘要）
+_HASHES_PER_DIGEST = 16
+
+
+def normalize_text(text: Any) -> str:
+    """归一化文本：全角转半角、统一大小写，标点视为空白"""
+    text = unicodedata.normalize('NFKC', str(text)).casefold()
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def shingles(text: str, char_ngram: int = 2, word_ngram: int = 2) -> Set[str]:
+    """
+    将归一化后的文本切分为shingle集合：含中日文字符时按字符n-gram（忽略空白），否则按词n-gram；
+    文本短于n时整段作为一个shingle
+    """
+    if _CJK.search(text):
+        chars = text.replace(" ", "")
+        if len(chars) <= char_ngram:
+            return {chars} if chars else set()
+        return {chars[i:i + char_ngram] for i in range(len(chars) - char_ngram + 1)}
+    words = text.split()
+    if len(words) <= word_ngram:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + word_ngram]) for i in range(len(words) - word_ngram + 1)}
+
+
+def optimal_bands(num_perm: int, threshold: float, false_positive_weight: float = 0.1) -> Tuple[int, int]:
+    """
+    选择LSH的分带数b和每带行数r（b*r = num_perm），使候选概率曲线 1-(1-s^r)^b 的
+    误报面积（相似度低于阈值仍成为候选）与漏报面积（高于阈值却未成为候选）的加权和最小；
+    候选还会按签名核对相似度，误报只多花比较时间，因此漏报的权重更高
+    """
+    def area(low, high, f, steps=100):
+        width = (high - low) / steps
+        return sum(f(low + (i + 0.5) * width) for i in range(steps)) * width
+
+    best, best_error = (num_perm, 1), None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        candidate = lambda s: 1 - (1 - s ** rows) ** bands
+        error = (false_positive_weight * area(0, threshold, candidate)
+                 + (1 - false_positive_weight) * area(threshold, 1, lambda s: 1 - candidate(s)))
+        if best_error is None or error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class MinHasher:
+    """MinHash签名计算（每个shingle用带不同salt的blake2b产生多个独立的32位哈希，结果跨进程稳定）"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 42):
+        """
+        Args:
+            num_perm: 签名长度，向上取整为16的倍数
+            seed: 哈希种子
+        """
+        blocks = max(1, -(-num_perm // _HASHES_PER_DIGEST))
+        self.num_perm = blocks * _HASHES_PER_DIGEST
+        self._salts = [struct.pack('<QQ', seed, block) for block in range(blocks)]
+        # shingle的哈希缓存（中文字符n-gram和常用词组合大量重复出现）
+        self._cache: Dict[str, array] = {}
+
+    # 哈希缓存的条目数上限
+    CACHE_SIZE = 500000
+
+    def _hash(self, shingle: str) -> array:
+        row = self._cache.get(shingle)
+        if row is None:
+            data = shingle.encode('utf-8')
+            row = array('I', b''.join(hashlib.blake2b(data, digest_size=64, salt=salt).digest()
+                                      for salt in self._salts))
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            self._cache[shingle] = row
+        return row
+
+    def signature(self, shingle_set: Iterable[str]) -> array:
+        """计算shingle集合的MinHash签名（空集合返回空签名）"""
+        rows = [self._hash(shingle) for shingle in shingle_set]
+        if not rows:
+            return array('I')
+        return array('I', map(min, zip(*rows)))
+
+
+class NearDuplicateIndex:
+    """
+    增量式近似重复索引（线程安全）：依次加入文本，与已加入的文本近似重复时报告重复对象，
+    否则将其签名加入LSH索引；先加入的文本被保留
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, char_ngram: int = 2,
+                 word_ngram: int = 2, seed: int = 42):
+        """
+        初始化索引
+
+        Args:
+            threshold: 估计的Jaccard相似度达到该值时视为重复
+            num_perm: MinHash签名长度
+            char_ngram: 中文字符n-gram的n
+            word_ngram: 英文词n-gram的n
+            seed: 哈希种子
+        """
+        self.threshold = threshold
+        self.char_ngram = char_ngram
+        self.word_ngram = word_ngram
+        self.hasher = MinHasher(num_perm, seed)
+        self.bands, self.rows = optimal_bands(self.hasher.num_perm, threshold)
+        self._lock = threading.Lock()
+        self._keys: List[Any] = []
+        self._signatures: List[array] = []
+        # 归一化文本 -> 序号，完全相同的文本无需计算签名
+        self._exact: Dict[str, int] = {}
+        # 每个分带一个桶：分带签名 -> 落入该桶的序号
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+
+    @classmethod
+    def from_config(cls, config) -> "NearDuplicateIndex":
+        """根据配置创建索引"""
+        return cls(
+            threshold=float(config.get('dedup.threshold', 0.8)),
+            num_perm=int(config.get('dedup.num_perm', 64)),
+            char_ngram=int(config.get('dedup.char_ngram', 2)),
+            word_ngram=int(config.get('dedup.word_ngram', 2)),
+            seed=int(config.get('generation.random_seed', 42))
+        )
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: Any, text: str) -> Optional[Tuple[Any, float]]:
+        """
+        加入一条文本
+
+        Args:
+            key: 文本的标识，作为后续重复项的重复对象返回
+            text: 用于比较的文本
+
+        Returns:
+            与已加入的文本近似重复时返回 (重复对象的key, 估计相似度)，文本不加入索引；否则返回None
+        """
+        normalized = normalize_text(text)
+        signature = self.hasher.signature(shingles(normalized, self.char_ngram, self.word_ngram))
+        band_keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+        with self._lock:
+            index = self._exact.get(normalized)
+            if index is not None:
+                return self._keys[index], 1.0
+
+            if signature:
+                best, best_score = None, self.threshold
+                seen = set()
+                for bucket, band_key in zip(self._buckets, band_keys):
+                    for candidate in bucket.get(band_key, ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        other = self._signatures[candidate]
+                        score = sum(a == b for a, b in zip(signature, other)) / len(signature)
+                        if score >= best_score and (best is None or score > best_score):
+                            best, best_score = candidate, score
+                if best is not None:
+                    return self._keys[best], round(best_score, 4)
+
+            index = len(self._keys)
+            self._keys.append(key)
+            self._signatures.append(signature)
+            self._exact[normalized] = index
+            if signature:
+                for bucket, band_key in zip(self._buckets, band_keys):
+                    bucket.setdefault(band_key, []).append(index)
+            return None
+
+
+_world_indexes: Dict[str, NearDuplicateIndex] = {}
+_world_lock = threading.Lock()
+
+
+def get_world_index(world: str, config) -> NearDuplicateIndex:
+    """获取世界共用的索引（同一进程内同一世界的各角色共用，先完成切分的角色保留重复项）"""
+    with _world_lock:
+        if world not in _world_indexes:
+            _world_indexes[world] = NearDuplicateIndex.from_config(config)
+        return _world_indexes[world]
+
+
+def dedup_items(items: Iterable[Dict], index: NearDuplicateIndex, field: str = "question",
+                label: str = "", max_examples: int = 20) -> Tuple[List[Dict], Dict]:
+    """
+    按指定字段去掉近似重复的数据（保留先出现的一条）
+
+    Args:
+        items: 问答数据
+        index: 近似重复索引
+        field: 用于比较的字段
+        label: 写入重复对象标识的前缀（如角色名，world范围去重时区分来源角色）
+        max_examples: 报告中保留的删除示例数
+
+    Returns:
+        (保留的数据, 报告)；报告按 source_type 统计总数、删除数和被哪类数据重复
+    """
+    kept = []
+    totals, removed = Counter(), Counter()
+    duplicate_of: Dict[str, Counter] = {}
+    examples = []
+    for item in items:
+        source_type = item.get("source_type", "unknown")
+        totals[source_type] += 1
+        text = item.get(field) or ""
+        match = index.add((label, source_type, text), text)
+        if match is None:
+            kept.append(item)
+            continue
+        (other_label, other_type, other_text), similarity = match
+        removed[source_type] += 1
+        duplicate_of.setdefault(source_type, Counter())[f"{other_label}/{other_type}" if other_label else other_type] += 1
+        if len(examples) < max_examples:
+            examples.append({
+                "source_type": source_type,
+                field: text,
+                "duplicate_of": {"label": other_label, "source_type": other_type, field: other_text},
+                "similarity": similarity
+            })
+
+    report = {
+        "threshold": index.threshold,
+        "num_perm": index.hasher.num_perm,
+        "bands": index.bands,
+        "rows": index.rows,
+        "total": sum(totals.values()),
+        "removed": sum(removed.values()),
+        "source_types": {
+            source_type: {
+                "total": total,
+                "removed": removed[source_type],
+                "kept": total - removed[source_type],
+                "duplicate_of": dict(duplicate_of.get(source_type, {}))
+            }
+            for source_type, total in sorted(totals.items())
+        },
+        "examples": examples
+    }
+    return kept, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对问答文件做近似重复检测")
+    parser.add_argument("files", nargs="+", help="问答JSON文件")
+    parser.add_argument("--threshold", type=float, default=0.8, help="相似度阈值")
+    parser.add_argument("--num-perm", type=int, default=64, help="MinHash签名长度")
+    parser.add_argument("--field", default="question", help="用于比较的字段")
+    args = parser.parse_args()
+
+    index = NearDuplicateIndex(threshold=args.threshold, num_perm=args.num_perm)
+    items = []
+    for path in args.files:
+        with open(path, 'r', encoding='utf-8') as f:
+            items.extend(json.load(f))
+    kept, report = dedup_items(items, index, field=args.field)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
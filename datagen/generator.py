@@ -3,13 +3,25 @@
 集成所有数据处理流程，统一接口和风格
 """
 
+import logging
 import os
+import threading
 import time
-from typing import List, Dict, Any
-from tqdm import tqdm
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 
-from utils import Config, PathManager, load_json, save_json, load_jsonl, save_jsonl, shuffle_data, split_train_test, format_filename, get_file_count
+from api_engine import AsyncAPIEngine
+from dedup import NearDuplicateIndex, dedup_items, get_world_index
+from batch_runner import BatchRunner
+from logger import LOGGER_NAME, setup_logging
+from scheduler import Stage, StageScheduler
+from streaming import ItemStream
+from token_counter import PromptTooLongError, get_context_window
+from response_cache import ResponseCache
+from role_context import RoleContext
+from scene_store import SceneStore
+from prompts import PromptManager
+from utils import Config, PathManager, load_json, save_json, split_train_test
 from processors.wiki2statement import Wiki2StatementProcessor
 from processors.statement2qa import Statement2QAProcessor
 from processors.conv2summary import Conv2SummaryProcessor
@@ -22,10 +34,21 @@ from processors.conv2style import Conv2StyleProcessor
 from processors.qa2all import QA2AllProcessor
 
 
+logger = logging.getLogger(f"{LOGGER_NAME}.api")
+
+
 class DataGenerator:
     """主数据生成器"""
     
-    def __init__(self, world: str, role: str, config_path: str = "config.yaml"):
+    # 可流式传递的阶段对：(上游阶段, 下游阶段, 产物)
+    STREAMING_PAIRS = [
+        ('wiki2statement', 'statement2qa', 'statement'),
+        ('conv2summary', 'summary2qa', 'summary'),
+        ('wiki2anti', 'anti2qa', 'anti')
+    ]
+    
+    def __init__(self, world: str, role: str, config_path: str = "config.yaml", engine: AsyncAPIEngine = None,
+                 language: str = None):
         """
         初始化数据生成器
         
@@ -33,19 +56,39 @@ class DataGenerator:
             world: 世界名称
             role: 角色名称
             config_path: 配置文件路径
+            engine: 共享的API请求引擎，为空时按配置创建
+            language: 语言类型（zh/en），为空时使用配置文件中的设置
         """
         self.world = world
         self.role = role
         
         # 初始化配置和路径管理
         self.config = Config(config_path)
+        if language:
+            # 需要在初始化处理器之前设置，处理器按语言选择prompt模板
+            self.config._config['language'] = language
         self.path_manager = PathManager(self.config)
+        setup_logging(self.config)
+        
+        # 各阶段的运行状态，用于进度汇报
+        self.stage_status = {}
+        
+        # 正在流式传递的产物：产物名 -> ItemStream
+        self.streams = {}
         
-        # 初始化OpenAI客户端
-        self.client = OpenAI(
-            api_key=self.config.get('openai.api_key'),
-            base_url=self.config.get('openai.base_url')
-        )
+        # 角色的Wiki段落和通用背景信息，首次使用时读取，各处理器共用
+        self.context = RoleContext.from_config(self.config, self.path_manager, role)
+        
+        # 角色的对话场景，首次使用时解析，各处理器共用
+        self._scene_store = None
+        self._scene_lock = threading.Lock()
+        
+        # 初始化API请求引擎（异步并发）
+        self.engine = engine or AsyncAPIEngine.from_config(self.config)
+        self.client = self.engine.client
+        
+        # 批处理提交器（用于对延迟不敏感的批量阶段）
+        self.batch_runner = BatchRunner(self)
         
         # 初始化处理器
         self._init_processors()
@@ -84,7 +127,26 @@ class DataGenerator:
                 if dir_path and isinstance(dir_path, str):  # 确保路径不为空且为字符串
                     self.path_manager.ensure_dir(dir_path)
     
-    def call_openai_api(self, messages: List[Dict], model: str = None, temperature: float = 0.8) -> str:
+    def get_scene_store(self) -> SceneStore:
+        """
+        获取角色的对话场景（profiles/{role}.jsonl），每次运行只解析一次，
+        启用 scenes.cache 时解析结果缓存到磁盘，源文件未变化时直接读取
+        
+        Returns:
+            场景存储，读取或解析失败时抛出异常
+        """
+        with self._scene_lock:
+            if self._scene_store is None:
+                cache_dir = None
+                if self.config.get('scenes.cache', True):
+                    cache_dir = self.config.get('scenes.cache_dir') or os.path.join(
+                        self.config.get('paths.output_base', 'output'), "cache", "scenes")
+                profile_path = self.path_manager.get_profile_path(self.world, self.role)
+                self._scene_store = SceneStore.load(profile_path, cache_dir)
+            return self._scene_store
+    
+    def call_openai_api(self, messages: List[Dict], model: str = None, temperature: float = 0.8,
+                        stage: str = None, response_format: Dict = None) -> str:
         """
         调用OpenAI API
         
@@ -92,79 +154,183 @@ class DataGenerator:
             messages: 消息列表
             model: 模型名称
             temperature: 温度参数
+            stage: 发起调用的阶段名称，用于用量统计
+            response_format: 结构化输出参数，为空时按普通文本请求
         
         Returns:
             API响应内容
         """
+        return self.engine.run(self.acall_openai_api(messages, model, temperature, stage, response_format))
+    
+    async def acall_openai_api(self, messages: List[Dict], model: str = None, temperature: float = 0.8,
+                               stage: str = None, response_format: Dict = None) -> str:
+        """
+        调用OpenAI API（协程版本，在请求引擎的事件循环中执行）
+        
+        Args:
+            messages: 消息列表
+            model: 模型名称
+            temperature: 温度参数
+            stage: 发起调用的阶段名称，用于用量统计
+            response_format: 结构化输出参数，为空时按普通文本请求
+        
+        Returns:
+            API响应内容
+        
+        Raises:
+            PromptTooLongError: prompt超出模型的上下文窗口（未发出请求）
+        """
         if model is None:
             model = self.config.get('models.base_model')
         
-        # 简化API调用，移除复杂的重试逻辑
+        # 先查询响应缓存，命中时直接返回
+        cache = self.engine.response_cache
+        if cache:
+            cache_key = self._make_cache_key(messages, model, temperature, response_format)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self.engine.usage_tracker.record_cache_hit(self.world, self.role, stage)
+                return cached
+        
+        # 离线检查prompt长度，超出上下文窗口的请求注定失败，不再付费发出
+        prompt_tokens = self.engine.token_counter.count_messages(messages)
+        context_window = get_context_window(self.config, model)
+        if prompt_tokens > context_window:
+            self.engine.usage_tracker.record_oversize(self.world, self.role, stage, 'rejected')
+            raise PromptTooLongError(f"prompt共 {prompt_tokens} tokens，超出模型 {model} 的上下文窗口 {context_window}")
+        
+        rate_controller = self.engine.rate_controller
+        
+        extra = {"response_format": response_format} if response_format is not None else {}
+        
+        profiler = self.engine.profiler
+        # 排队起点：首次尝试为发起调用时，重试时为上一次尝试结束时（包含退避）
+        queued_at = time.perf_counter()
+        
+        async def _request():
+            nonlocal queued_at
+            async with self.engine.slot():
+                # api 只计请求本身的耗时，限流等待和并发槽位的排队单独记为 queue
+                start_time = time.perf_counter()
+                profiler.observe(self.world, self.role, stage, 'queue', start_time - queued_at)
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        **extra
+                    )
+                except Exception:
+                    queued_at = time.perf_counter()
+                    profiler.observe(self.world, self.role, stage, 'api', queued_at - start_time, error=True)
+                    raise
+                queued_at = time.perf_counter()
+                profiler.observe(self.world, self.role, stage, 'api', queued_at - start_time)
+                return response
+        
+        # 由共享的速率控制器负责限流，遇到429/5xx时降速并重试
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature
-            )
+            response = await rate_controller.acall(_request, prompt_tokens + rate_controller.expected_output_tokens)
+            self.engine.usage_tracker.record(self.world, self.role, stage, model, response.usage)
             content = response.choices[0].message.content
-            return content.strip() if content else ""
+            content = content.strip() if content else ""
+            if cache:
+                cache.set(cache_key, model, content)
+            return content
             
         except Exception as e:
             # 直接抛出异常，不包装
-            print(f"API调用失败:")
-            print(f"错误类型: {type(e).__name__}")
-            print(f"错误信息: {str(e)}")
+            logger.warning("API调用失败: %s: %s", type(e).__name__, e,
+                           extra={'world': self.world, 'role': self.role, 'stage': stage})
             raise
     
+    def _make_cache_key(self, messages: List[Dict], model: str, temperature: float, response_format: Dict = None) -> str:
+        """计算请求的响应缓存键"""
+        version = self.config.get('cache.prompt_version', PromptManager.PROMPT_VERSION)
+        return ResponseCache.make_key(model, messages, temperature, version, response_format)
+    
+    def discard_cached_response(self, messages: List[Dict], model: str = None, temperature: float = 0.8,
+                                stage: str = None, response_format: Dict = None) -> bool:
+        """
+        删除请求的缓存响应（参数与 acall_openai_api 相同），用于未通过校验的响应，
+        使重跑和修复请求不再取回同一个无效响应
+        
+        Returns:
+            缓存中是否有该响应
+        """
+        cache = self.engine.response_cache
+        if not cache:
+            return False
+        if model is None:
+            model = self.config.get('models.base_model')
+        return cache.delete(self._make_cache_key(messages, model, temperature, response_format))
+    
+    def iter_openai_api(self, items: Iterable, build_request, window: int = None) -> Iterator[Tuple[Any, Any]]:
+        """
+        并发调用OpenAI API，按输入顺序产出结果
+        
+        Args:
+            items: 输入项（可以是惰性迭代器）
+            build_request: 将输入项转换为 acall_openai_api 参数字典的函数
+            window: 最大未完成请求数
+        
+        Returns:
+            (item, response) 迭代器，失败时 response 为异常对象
+        """
+        async def _call(item):
+            return await self.acall_openai_api(**build_request(item))
+        
+        return self.engine.imap(_call, items, window)
+    
     def generate_wiki2statement(self):
         """生成Wiki到陈述的数据"""
         print(f"  - 生成 {self.role} 的Wiki陈述...")
-        self.processors['wiki2statement'].process()
+        return self.processors['wiki2statement'].process()
     
     def generate_statement2qa(self):
         """生成陈述到问答的数据"""
         print(f"  - 生成 {self.role} 的陈述问答...")
-        self.processors['statement2qa'].process()
+        return self.processors['statement2qa'].process()
     
     def generate_conv2summary(self):
         """生成对话到摘要的数据"""
         print(f"  - 生成 {self.role} 的对话摘要...")
-        self.processors['conv2summary'].process()
+        return self.processors['conv2summary'].process()
     
     def generate_summary2qa(self):
         """生成摘要到问答的数据"""
         print(f"  - 生成 {self.role} 的摘要问答...")
-        self.processors['summary2qa'].process()
+        return self.processors['summary2qa'].process()
     
     def generate_chat2qa(self):
         """生成聊天问答数据"""
         print(f"  - 生成 {self.role} 的聊天问答...")
-        self.processors['chat2qa'].process()
+        return self.processors['chat2qa'].process()
     
     def generate_wiki2anti(self):
         """生成Wiki到反例的数据"""
         print(f"  - 生成 {self.role} 的Wiki反例...")
-        self.processors['wiki2anti'].process()
+        return self.processors['wiki2anti'].process()
     
     def generate_anti2qa(self):
         """生成反例问答数据"""
         print(f"  - 生成 {self.role} 的反例问答...")
-        self.processors['anti2qa'].process()
+        return self.processors['anti2qa'].process()
     
     def generate_conv2qa(self):
         """生成对话问答数据"""
         print(f"  - 生成 {self.role} 的对话问答...")
-        self.processors['conv2qa'].process()
+        return self.processors['conv2qa'].process()
     
     def generate_conv2style(self):
         """生成对话风格数据"""
         print(f"  - 生成 {self.role} 的风格数据...")
-        self.processors['conv2style'].process()
+        return self.processors['conv2style'].process()
     
     def generate_qa2all(self):
         """合并所有问答数据"""
         print(f"  - 合并 {self.role} 的所有问答数据...")
-        self.processors['qa2all'].process()
+        return self.processors['qa2all'].process()
     
     def split_train_test(self):
         """切分训练集和测试集"""
@@ -184,6 +350,9 @@ class DataGenerator:
         qa_file = qa_files[0]  # 使用第一个匹配的文件
         data = load_json(qa_file)
         
+        # 切分前去掉近似重复的问题，避免重复训练和训练/测试集之间的泄漏
+        data = self.dedup_qa(data)
+        
         # 按source_type分组
         from collections import defaultdict
         grouped_data = defaultdict(list)
@@ -212,25 +381,219 @@ class DataGenerator:
         print(f"    训练集: {len(train_data)} 条")
         print(f"    测试集: {len(test_data)} 条")
     
+    def dedup_qa(self, data: List[Dict]) -> List[Dict]:
+        """按问题文本的MinHash签名去掉近似重复的问答数据（保留先出现的一条），并写出去重报告"""
+        if not self.config.get('dedup.enabled', False):
+            return data
+        # world范围：同一世界的各角色共用索引，重复对象带上所属角色
+        world_scope = self.config.get('dedup.scope', 'role') == 'world'
+        index = get_world_index(self.world, self.config) if world_scope else NearDuplicateIndex.from_config(self.config)
+        
+        start_time = time.time()
+        kept, report = dedup_items(data, index, field=self.config.get('dedup.field', 'question'),
+                                   label=self.role if world_scope else "")
+        report['seconds'] = round(time.time() - start_time, 2)
+        
+        path = os.path.join(self.config.get('paths.output_base', 'output'), "reports",
+                            f"{self.world}_{self.role}_dedup.json")
+        save_json(report, path)
+        print(f"    近似重复去重: {report['total']} 条中删除 {report['removed']} 条 ({report['seconds']}s)")
+        for source_type, stats in report['source_types'].items():
+            if stats['removed']:
+                print(f"      {source_type}: 删除 {stats['removed']}/{stats['total']}")
+        return kept
+    
+    def _build_stages(self) -> List[Stage]:
+        """声明各阶段及其输入/输出产物"""
+        def stage(name, func, inputs, outputs):
+            return Stage(name, lambda: self._run_stage(name, func), inputs, outputs)
+        
+        stages = [
+            stage('wiki2statement', self.generate_wiki2statement, ['wiki', 'general'], ['statement']),
+            stage('statement2qa', self.generate_statement2qa, ['statement', 'general'], ['qa_statement']),
+            stage('conv2summary', self.generate_conv2summary, ['profile'], ['summary']),
+            stage('summary2qa', self.generate_summary2qa, ['summary', 'general'], ['qa_summary']),
+            stage('chat2qa', self.generate_chat2qa, ['general'], ['qa_chat']),
+            stage('wiki2anti', self.generate_wiki2anti, ['wiki', 'general'], ['anti']),
+            stage('anti2qa', self.generate_anti2qa, ['anti', 'general'], ['qa_anti']),
+            stage('conv2qa', self.generate_conv2qa, ['profile'], ['qa_conv']),
+            stage('conv2style', self.generate_conv2style, ['profile'], ['style']),  # style数据独立存放，不参与合并
+            stage('qa2all', self.generate_qa2all,
+                  ['qa_statement', 'qa_summary', 'qa_chat', 'qa_anti', 'qa_conv'], ['qa_all']),
+            stage('split', self.split_train_test, ['qa_all'], ['train', 'test'])
+        ]
+        
+        if self.config.get('generation.streaming', False):
+            stages = self._pair_streaming_stages(stages)
+        return stages
+    
+    def _pair_streaming_stages(self, stages: List[Stage]) -> List[Stage]:
+        """将可流式传递的上下游阶段合并为一个调度单元，两者同时启动"""
+        by_name = {s.name: s for s in stages}
+        for producer_name, consumer_name, artifact in self.STREAMING_PAIRS:
+            producer = by_name.pop(producer_name, None)
+            consumer = by_name.pop(consumer_name, None)
+            if producer is None or consumer is None:
+                continue
+            name = f"{producer_name}+{consumer_name}"
+            by_name[name] = Stage(
+                name,
+                lambda p=producer, c=consumer, a=artifact: self._run_streaming_pair(p, c, a),
+                [a for a in producer.inputs + consumer.inputs if a != artifact],
+                producer.outputs + consumer.outputs
+            )
+            # 保持在上游阶段原来的位置
+            stages = [by_name[name] if s is producer else s for s in stages if s is not consumer]
+        return stages
+    
+    def _get_artifact_path(self, artifact: str) -> str:
+        """获取流式产物对应的中间文件路径"""
+        paths = {
+            'statement': ("process", "statement", f"{self.role}_statement.json"),
+            'summary': ("process", "summary", f"{self.world}_{self.role}_summary.json"),
+            'anti': ("process", "anti", f"{self.role}_anti.json")
+        }
+        return self.path_manager.get_output_path(*paths[artifact])
+    
+    def _run_streaming_pair(self, producer: Stage, consumer: Stage, artifact: str):
+        """
+        同时运行上下游阶段，上游每产出一条数据即通过有界队列交给下游
+        
+        队列满时上游阻塞等待下游消费；上游的中间文件仍在结束时写出
+        """
+        stream = ItemStream(artifact, self.config.get('generation.stream_buffer', 64))
+        self.streams[artifact] = stream
+        
+        def produce():
+            error = None
+            try:
+                return producer.func()
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                # 上游因输出已存在而跳过时，从中间文件回放给下游
+                artifact_path = self._get_artifact_path(artifact)
+                if error is None and stream.count == 0 and os.path.exists(artifact_path):
+                    for item in load_json(artifact_path):
+                        if not stream.put(item):
+                            break
+                stream.close(error)
+        
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"stream-{artifact}") as executor:
+            future = executor.submit(produce)
+            try:
+                consumer.func()
+            finally:
+                # 下游结束（含提前结束）后不再接收，避免上游阻塞
+                stream.cancel()
+                self.streams.pop(artifact, None)
+            future.result()
+    
+    def _run_stage(self, name: str, func):
+        """执行单个阶段并记录状态和耗时"""
+        status = {'status': 'running', 'seconds': None}
+        self.stage_status[name] = status
+        start_time = time.time()
+        try:
+            with self.engine.profiler.track_stage(self.world, self.role, name):
+                result = func()
+        except Exception as e:
+            status['status'] = 'failed'
+            status['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            status['seconds'] = round(time.time() - start_time, 2)
+        # 处理器返回False表示阶段未能完成（如缺少输入文件）
+        status['status'] = 'failed' if result is False else 'done'
+        if name in self.processors:
+            self.processors[name].save_validation_report()
+        if result is not False and name in self.processors:
+            # 最终输出已写出，检查点日志不再需要
+            self.processors[name].complete_journal()
+        return result
+    
+    def save_usage_report(self) -> str:
+        """保存本角色的token用量与成本报告，并输出各阶段汇总"""
+        path = os.path.join(self.config.get('paths.output_base', 'output'), "reports",
+                            f"{self.world}_{self.role}_usage.json")
+        report = self.engine.usage_tracker.save_report(path, self.world, self.role)
+        totals = report['totals']
+        cost = f", 估算成本 ${totals['cost']:.4f}" if report['priced'] else ""
+        print(f"  token用量: 调用 {totals['calls']} 次, 输入 {totals['prompt_tokens']} "
+              f"(缓存 {totals['cached_tokens']}), 输出 {totals['completion_tokens']}{cost}")
+        for stage, usage in report['stages'].items():
+            if usage['calls'] or usage.get('oversize_prompts'):
+                per_item = usage['tokens_per_output_item']
+                print(f"    {stage}: {usage['total_tokens']} tokens / {usage['calls']} 次"
+                      + (f", 每条产出 {per_item} tokens" if per_item else ""))
+                for tier, rate in usage.get('tiers', {}).items():
+                    print(f"      {tier}: 通过 {rate['passed']}/{rate['calls']}")
+            for prompt_type, histogram in usage.get('prompt_token_histograms', {}).items():
+                print(f"      {prompt_type} prompt: {histogram['count']} 个, p50 {histogram['p50']} / "
+                      f"p90 {histogram['p90']} / max {histogram['max']} tokens")
+            completion = usage.get('completion_token_histogram')
+            if completion:
+                print(f"      输出: p50 {completion['p50']} / p99 {completion['p99']} / max {completion['max']} tokens")
+            if usage.get('oversize_prompts'):
+                print(f"      超出上下文窗口: {usage['oversize_prompts']}")
+        print(f"  用量报告: {path}")
+        return path
+    
+    def save_profile_report(self) -> Optional[str]:
+        """保存本角色各阶段的性能数据（JSON汇总和Prometheus文本）"""
+        profiler = self.engine.profiler
+        if not profiler.enabled:
+            return None
+        path = os.path.join(self.config.get('paths.output_base', 'output'), "reports",
+                            f"{self.world}_{self.role}_profile.json")
+        report = profiler.save_report(path, self.world, self.role)
+        print("  阶段性能:")
+        for stage, profile in report.items():
+            api = profile['metrics'].get('api')
+            line = f"    {stage}: {profile['seconds']}s, {profile['items']} 条"
+            if profile['items_per_second']:
+                line += f" ({profile['items_per_second']} 条/s)"
+            if api:
+                line += f", API p50 {api['p50']}s / p99 {api['p99']}s, 失败 {api['errors']} 次"
+            queue = profile['metrics'].get('queue')
+            if queue:
+                line += f", 排队 p50 {queue['p50']}s"
+            print(line)
+        print(f"  性能报告: {path}")
+        return path
+    
+    def print_cache_stats(self):
+        """输出响应缓存统计"""
+        cache = self.engine.response_cache
+        if not cache:
+            return
+        stats = cache.get_stats()
+        print(f"  响应缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+              f"命中率 {stats['hit_rate']:.1%}, 共 {stats['entries']} 条 ({stats['size_mb']} MB)")
+    
     def run(self):
         """运行完整的数据生成流程"""
         print(f"\n开始为角色 {self.role} 生成数据...")
         
         try:
-            # 执行所有处理步骤
-            self.generate_wiki2statement()
-            self.generate_statement2qa()
-            self.generate_conv2summary()
-            self.generate_summary2qa()
-            self.generate_chat2qa()
-            self.generate_wiki2anti()
-            self.generate_anti2qa()
-            self.generate_conv2qa()
-            self.generate_conv2style()  # style相关，在qa2all之前
-            self.generate_qa2all()
-            self.split_train_test()
+            # 按依赖关系调度所有处理步骤，互不依赖的阶段并发执行
+            scheduler = StageScheduler(
+                self._build_stages(),
+                max_workers=self.config.get('generation.max_parallel_stages', 4)
+            )
+            try:
+                scheduler.run()
+            finally:
+                for name, status in scheduler.status.items():
+                    if status == 'skipped':
+                        for stage_name in name.split('+'):
+                            self.stage_status[stage_name] = {'status': 'skipped', 'seconds': None}
             
             print(f"角色 {self.role} 数据生成完成！")
+            self.print_cache_stats()
+            self.save_usage_report()
+            self.save_profile_report()
             
         except Exception as e:
             print(f"角色 {self.role} 数据生成失败: {e}")
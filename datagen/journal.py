@@ -0,0 +1,120 @@
+"""
+检查点日志模块
+处理器每完成一条请求就把响应追加写入JSONL日志，中断后重跑时跳过日志中已有的条目。
+增量模式下日志在阶段完成后保留，作为 内容哈希 -> 响应 的清单，只有输入或prompt变化的条目才重新请求
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+
+class Journal:
+    """阶段级检查点日志"""
+
+    def __init__(self, path: str):
+        """
+        初始化检查点日志，已有日志会被加载
+
+        Args:
+            path: JSONL日志文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self.entries = self._load()
+        self.recovered = len(self.entries)
+        
+        # 本次运行中用到（命中或新写入）的键
+        self.used = set()
+        self.hits = 0
+        self.writes = 0
+
+    @staticmethod
+    def make_key(item: Any) -> str:
+        """计算内容哈希（默认对完整请求计算，包含输入内容和渲染后的prompt模板）"""
+        payload = json.dumps(item, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _load(self) -> Dict[str, str]:
+        """读取已有日志（忽略中断时写了一半的最后一行）"""
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries[record["key"]] = record["response"]
+        return entries
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str) -> Optional[str]:
+        """读取已记录的响应，没有时返回None"""
+        with self._lock:
+            response = self.entries.get(key)
+            if response is not None:
+                self.used.add(key)
+                self.hits += 1
+            return response
+
+    def record(self, key: str, response: str):
+        """追加一条已完成的响应并立即落盘"""
+        line = json.dumps({"key": key, "response": response}, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line + '\n')
+            self._file.flush()
+            self.entries[key] = response
+            self.used.add(key)
+            self.writes += 1
+
+    def close(self):
+        """关闭日志文件"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def compact(self) -> int:
+        """
+        只保留本次运行用到的条目（输入已变化或已删除的条目被丢弃）
+
+        Returns:
+            丢弃的条目数
+        """
+        self.close()
+        with self._lock:
+            stale = [key for key in self.entries if key not in self.used]
+            for key in stale:
+                del self.entries[key]
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for key, response in self.entries.items():
+                    f.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + '\n')
+            os.replace(temp_path, self.path)
+            return len(stale)
+
+    def remove(self):
+        """阶段完成后删除日志"""
+        self.close()
+        with self._lock:
+            self.entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
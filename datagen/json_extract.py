@@ -0,0 +1,207 @@
+"""
+JSON提取模块
+从模型响应的自由文本中提取顶层的JSON对象/数组，供各处理器的 _parse_* 方法共用
+
+从左到右只扫描一遍：在每个 { 或 [ 处用 raw_decode 增量解码，成功时跳过整个值，
+失败时从出错位置继续，不会像贪婪的 DOTALL 正则那样在长响应或残缺响应上反复回溯，
+也不会把值后面的说明文字一并截进来。响应中有 ``` 代码块时优先从代码块中提取。
+
+用法（微基准测试，对比原先的正则提取）：
+    python json_extract.py [--corpus benchmark_data/json_responses.jsonl] [--repeat 200]
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+
+_decoder = json.JSONDecoder(strict=False)  # 允许字符串中出现未转义的换行等控制字符
+
+Kind = Union[Type, Tuple[Type, ...], None]
+
+FENCE = "```"
+
+# JSON对象/数组可能的起始位置：{ 后接键或 }，[ 后接值或 ]（跳过 "{角色}" 之类的普通文本，减少无效的解码尝试）
+_CANDIDATE = re.compile(r'\{\s*["}]|\[\s*[\[\]{"\-\dtfn]')
+
+# 重新切片的间隔（字符数）
+_REBASE = 4096
+
+
+def _fenced_blocks(text: str) -> List[str]:
+    """提取 ``` 代码块的内容（去掉语言标记），未闭合的代码块取到文本末尾"""
+    parts = text.split(FENCE)
+    blocks = []
+    for part in parts[1::2]:
+        first_line, newline, rest = part.partition("\n")
+        # 首行只有语言标记（如 json）时跳过
+        if newline and not first_line.strip().startswith(("{", "[")):
+            part = rest
+        blocks.append(part)
+    return blocks
+
+
+def _scan(text: str) -> Iterator[Any]:
+    """按出现顺序产出文本中的顶层JSON对象/数组"""
+    # 解码失败时 JSONDecodeError 会统计出错位置之前的行数，耗时与位置成正比；
+    # 在当前位置之后的切片上解码，并且扫描前进超过 _REBASE 个字符才重新切片，使总耗时保持线性
+    base, view = 0, text
+    index = 0
+    while True:
+        match = _CANDIDATE.search(text, index)
+        if match is None:
+            return
+        start = match.start()
+        if start - base > _REBASE:
+            base, view = start, text[start:]
+        try:
+            value, end = _decoder.raw_decode(view, start - base)
+        except json.JSONDecodeError as e:
+            # 出错位置之前的内容属于这个残缺的值，不再作为顶层值尝试
+            index = max(base + e.pos, start + 1)
+            continue
+        except RecursionError:
+            index = start + 1
+            continue
+        yield value
+        index = base + end
+
+
+def iter_json(text: str, kind: Kind = None) -> Iterator[Any]:
+    """
+    按出现顺序产出文本中的顶层JSON对象/数组
+
+    Args:
+        text: 模型响应
+        kind: 只产出该类型的值（如 list、dict 或二者的元组），为空时产出全部
+    """
+    if not isinstance(text, str):
+        return
+    if FENCE in text:
+        found = False
+        for block in _fenced_blocks(text):
+            for value in _scan(block):
+                if kind is None or isinstance(value, kind):
+                    found = True
+                    yield value
+        if found:
+            return
+    for value in _scan(text):
+        if kind is None or isinstance(value, kind):
+            yield value
+
+
+def extract_json(text: str, kind: Kind = None, default: Any = None) -> Any:
+    """
+    提取第一个顶层JSON对象/数组
+
+    Args:
+        text: 模型响应
+        kind: 期望的类型（如 list 或 dict），跳过其他类型的值
+        default: 没有找到时的返回值
+    """
+    return next(iter_json(text, kind), default)
+
+
+def extract_all_json(text: str, kind: Kind = None) -> List[Any]:
+    """提取全部顶层JSON对象/数组"""
+    return list(iter_json(text, kind))
+
+
+def extract_json_objects(text: str) -> Optional[List[Dict]]:
+    """
+    提取第一个含有JSON对象的顶层数组，只保留其中的对象（与原先 [{...}] 正则的要求一致，
+    字符串、数字等元素不会交给调用方按字典访问）
+
+    Returns:
+        对象列表；没有含对象的数组时返回None
+    """
+    for value in iter_json(text, list):
+        objects = [item for item in value if isinstance(item, dict)]
+        if objects:
+            return objects
+    return None
+
+
+# 各处理器原先使用的正则提取方式，仅用于基准测试对比
+LEGACY_PATTERNS = {
+    "list": r'\[\s*{.*}\s*\]',
+    "dict": r'\{.*\}',
+    "str_list": r'\[\s*".*"\s*\]'
+}
+
+KINDS = {"list": list, "dict": dict, "str_list": list}
+
+
+def legacy_extract(text: str, kind: str) -> Optional[Any]:
+    """原先的提取方式：不以括号开头时用贪婪正则截取，再整体 json.loads"""
+    content = text
+    if not content.startswith("{" if kind == "dict" else "["):
+        match = re.search(LEGACY_PATTERNS[kind], content, re.DOTALL)
+        if match:
+            content = match.group(0)
+    try:
+        value = json.loads(content)
+    except ValueError:
+        return None
+    return value if isinstance(value, KINDS[kind]) else None
+
+
+def _time(func, repeat: int) -> float:
+    """多次执行取平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def run_benchmark(corpus_path: str, repeat: int = 200) -> List[dict]:
+    """
+    在响应语料上对比原正则提取和新提取方式的耗时与正确性
+
+    语料为JSONL，每行包含 name、kind（list/dict/str_list）、response 和 expected（期望提取的值，
+    无法提取时为null）
+    """
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    results = []
+    for case in cases:
+        response, kind, expected = case["response"], case["kind"], case["expected"]
+        count = max(1, repeat // 20) if len(response) > 10000 else repeat
+        results.append({
+            "name": case["name"],
+            "chars": len(response),
+            "legacy_us": round(_time(lambda: legacy_extract(response, kind), count), 1),
+            "extract_us": round(_time(lambda: extract_json(response, KINDS[kind]), count), 1),
+            "legacy_ok": legacy_extract(response, kind) == expected,
+            "extract_ok": extract_json(response, KINDS[kind]) == expected
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON提取微基准测试")
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "benchmark_data", "json_responses.jsonl"),
+                        help="响应语料路径")
+    parser.add_argument("--repeat", type=int, default=200, help="每条响应的重复次数")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.corpus, args.repeat)
+    print(f"{'name':<28}{'chars':>8}{'legacy(us)':>14}{'extract(us)':>14}  legacy/extract correct")
+    for row in results:
+        print(f"{row['name']:<28}{row['chars']:>8}{row['legacy_us']:>14}{row['extract_us']:>14}  "
+              f"{'ok' if row['legacy_ok'] else 'WRONG':>6} / {'ok' if row['extract_ok'] else 'WRONG'}")
+    legacy = sum(row['legacy_us'] for row in results)
+    extract = sum(row['extract_us'] for row in results)
+    print(f"合计: 正则 {legacy:.1f}us, raw_decode {extract:.1f}us；"
+          f"正确 {sum(row['legacy_ok'] for row in results)}/{len(results)} vs "
+          f"{sum(row['extract_ok'] for row in results)}/{len(results)}")
+
+
+if __name__ == "__main__":
+    main()
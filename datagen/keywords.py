@@ -0,0 +1,143 @@
+"""
+反例关键词聚类模块
+wiki2anti 相邻段落常产出相同或几乎相同的示例关键词（大小写、全半角、空格不同，或只差一两个字），
+anti2qa 对每个关键词单独请求会重复生成同样的问题。这里先把关键词归一化，
+再在同一幻觉类型内按字符二元组的Jaccard相似度合并近似重复项，每个簇只请求一次，
+簇内各关键词的来源（反例的 source_id 和原始关键词）保留在生成的问答数据中。
+
+聚类是增量的：关键词逐个加入，只与共享二元组的已有簇比较，可用于流式传递的反例。
+"""
+
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Set
+
+
+# CJK字符（用于去掉中文之间无意义的空格）
+_CJK = r'぀-ヿ㐀-䶿一-鿿豈-﫿'
+_CJK_SPACE = re.compile(rf'(?<=[{_CJK}])\s+|\s+(?=[{_CJK}])')
+_EDGE_PUNCTUATION = re.compile(r'^[\W_]+|[\W_]+$')
+
+
+def normalize_keyword(keyword: Any) -> str:
+    """
+    归一化关键词：全角转半角（NFKC）、统一大小写、去掉首尾标点、合并连续空白，并去掉与中文相邻的空格
+
+    例如 "ＡＩ 助手" 与 "ai助手" 归一化后相同
+    """
+    text = unicodedata.normalize('NFKC', str(keyword)).casefold()
+    text = " ".join(text.split())
+    text = _CJK_SPACE.sub('', text)
+    return _EDGE_PUNCTUATION.sub('', text)
+
+
+def keyword_grams(normalized: str) -> Set[str]:
+    """归一化关键词的字符二元组（单字关键词为其本身）"""
+    if len(normalized) < 2:
+        return {normalized}
+    return {normalized[i:i + 2] for i in range(len(normalized) - 1)}
+
+
+class KeywordCluster:
+    """同一幻觉类型下的一组重复/近似重复关键词"""
+
+    def __init__(self, anti_item: Dict, keyword: str, normalized: str):
+        self.anti_item = anti_item  # 首个关键词所属的反例，请求使用其类型和描述
+        self.keyword = keyword  # 代表关键词（首次出现的原始写法）
+        self.normalized = normalized
+        self.grams = keyword_grams(normalized)
+        # 簇内各关键词的来源，问答数据直接引用该列表（流式处理时后加入的关键词也会写出）
+        self.sources: List[Dict] = []
+
+    @property
+    def type(self) -> str:
+        return self.anti_item.get("type", "")
+
+    def add_source(self, anti_item: Dict, keyword: str):
+        self.sources.append({"source_id": anti_item.get("source_id", ""), "keyword": keyword})
+
+
+class KeywordClusterer:
+    """增量式关键词聚类器（按幻觉类型分组）"""
+
+    def __init__(self, enabled: bool = True, similarity: float = 0.8):
+        """
+        初始化聚类器
+
+        Args:
+            enabled: 为False时不合并，每个关键词单独成簇（与逐个请求相同）
+            similarity: 近似重复的Jaccard相似度阈值，1表示只合并归一化后完全相同的关键词
+        """
+        self.enabled = enabled
+        self.similarity = similarity
+        self.clusters: List[KeywordCluster] = []
+        self.keywords = 0
+        # 幻觉类型 -> 归一化关键词 -> 簇
+        self._exact: Dict[str, Dict[str, KeywordCluster]] = {}
+        # 幻觉类型 -> 二元组 -> 含该二元组的簇
+        self._index: Dict[str, Dict[str, List[KeywordCluster]]] = {}
+
+    @classmethod
+    def from_config(cls, config) -> "KeywordClusterer":
+        """根据配置创建聚类器"""
+        return cls(
+            enabled=config.get('anti2qa.keyword_dedup', False),
+            similarity=float(config.get('anti2qa.similarity', 0.8))
+        )
+
+    def add(self, anti_item: Dict, keyword: Any) -> Optional[KeywordCluster]:
+        """
+        加入一个关键词
+
+        Returns:
+            关键词新建的簇（需要为其发起请求）；并入已有簇或关键词为空时返回None
+        """
+        keyword = str(keyword).strip()
+        normalized = normalize_keyword(keyword)
+        if not normalized:
+            return None
+        self.keywords += 1
+
+        if not self.enabled:
+            cluster = KeywordCluster(anti_item, keyword, normalized)
+            cluster.add_source(anti_item, keyword)
+            self.clusters.append(cluster)
+            return cluster
+
+        question_type = anti_item.get("type", "")
+        exact = self._exact.setdefault(question_type, {})
+        cluster = exact.get(normalized) or self._find_similar(question_type, normalized)
+        if cluster is not None:
+            exact.setdefault(normalized, cluster)
+            cluster.add_source(anti_item, keyword)
+            return None
+
+        cluster = KeywordCluster(anti_item, keyword, normalized)
+        cluster.add_source(anti_item, keyword)
+        self.clusters.append(cluster)
+        exact[normalized] = cluster
+        index = self._index.setdefault(question_type, {})
+        for gram in cluster.grams:
+            index.setdefault(gram, []).append(cluster)
+        return cluster
+
+    def _find_similar(self, question_type: str, normalized: str) -> Optional[KeywordCluster]:
+        """在同一类型中查找与关键词最相似且达到阈值的簇（只比较共享二元组的簇）"""
+        if self.similarity >= 1:
+            return None
+        grams = keyword_grams(normalized)
+        index = self._index.get(question_type, {})
+        shared: Dict[int, int] = {}
+        candidates: Dict[int, KeywordCluster] = {}
+        for gram in grams:
+            for cluster in index.get(gram, ()):
+                shared[id(cluster)] = shared.get(id(cluster), 0) + 1
+                candidates[id(cluster)] = cluster
+
+        best, best_score = None, self.similarity
+        for key, count in shared.items():
+            cluster = candidates[key]
+            score = count / (len(grams) + len(cluster.grams) - count)
+            if score >= best_score and (best is None or score > best_score):
+                best, best_score = cluster, score
+        return best
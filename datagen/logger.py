@@ -0,0 +1,195 @@
+"""
+日志模块
+处理器日志经由队列交给后台线程输出，请求循环中只做入队，不在终端写入上阻塞；
+原始响应按阶段采样输出，完整响应可异步写入JSONL文件
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+try:
+    from tqdm import tqdm
+except ImportError:  # 没有tqdm时直接写入输出流
+    tqdm = None
+
+
+LOGGER_NAME = "datagen"
+
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class TqdmHandler(logging.StreamHandler):
+    """通过 tqdm.write 输出，日志不会打断进度条"""
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            message = self.format(record)
+            if tqdm is not None:
+                tqdm.write(message, file=self.stream)
+            else:
+                self.stream.write(message + self.terminator)
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """终端格式：与原先的 print 输出一致，INFO 以外的级别带级别名"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.levelno != logging.INFO:
+            message = f"{record.levelname} {message}"
+        processor = getattr(record, 'processor', None)
+        return f"    [{processor}] {message}" if processor else message
+
+
+class JsonFormatter(logging.Formatter):
+    """日志文件格式：每条记录一行JSON"""
+
+    FIELDS = ('processor', 'world', 'role', 'stage')
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(config) -> logging.Logger:
+    """
+    按配置初始化 datagen 日志（同一进程内只创建一次输出线程，之后的调用只更新级别）
+
+    配置项：
+        logging.level: 终端日志级别（DEBUG/INFO/WARNING/ERROR）
+        logging.file: 以JSONL格式额外写入的日志文件，记录全部级别
+    """
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    level = logging.getLevelName(str(config.get('logging.level', 'INFO')).upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+    with _setup_lock:
+        if _listener is None:
+            console = TqdmHandler(sys.stdout)
+            console.setFormatter(ConsoleFormatter())
+            handlers = [console]
+            log_file = config.get('logging.file')
+            if log_file:
+                os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+                file_handler = logging.FileHandler(log_file, encoding='utf-8')
+                file_handler.setFormatter(JsonFormatter())
+                file_handler.setLevel(logging.DEBUG)
+                handlers.append(file_handler)
+            records = queue.SimpleQueue()
+            logger.addHandler(QueueHandler(records))
+            logger.propagate = False
+            _listener = QueueListener(records, *handlers, respect_handler_level=True)
+            _listener.start()
+            atexit.register(_listener.stop)
+        _listener.handlers[0].setLevel(level)
+        # 低于所有输出级别的记录在入队前丢弃
+        logger.setLevel(min(handler.level for handler in _listener.handlers))
+    return logger
+
+
+class ResponseLog:
+    """
+    原始响应记录：按阶段采样输出到日志，并可将全部响应异步写入JSONL文件（线程安全，可在多个角色之间共享）
+    """
+
+    def __init__(self, sample_rate: float = 0.0, stage_rates: Dict[str, float] = None, sink: str = None,
+                 preview_chars: int = 300, seed: int = None):
+        """
+        初始化响应记录
+
+        Args:
+            sample_rate: 输出到日志的响应比例
+            stage_rates: 各阶段单独的采样比例，覆盖 sample_rate
+            sink: 完整响应的JSONL文件路径，为空时不写入
+            preview_chars: 日志中显示的响应长度，超出部分截断
+            seed: 采样的随机种子
+        """
+        self.sample_rate = sample_rate
+        self.stage_rates = stage_rates or {}
+        self.preview_chars = preview_chars
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.sink = sink
+        self._queue = None
+        self._thread = None
+        if sink:
+            os.makedirs(os.path.dirname(os.path.abspath(sink)), exist_ok=True)
+            self._queue = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._write_loop, name="response-log", daemon=True)
+            self._thread.start()
+
+    @classmethod
+    def from_config(cls, config) -> "ResponseLog":
+        """根据配置创建响应记录"""
+        return cls(
+            sample_rate=config.get('logging.responses.sample_rate', 0.0),
+            stage_rates=config.get('logging.responses.stages') or {},
+            sink=config.get('logging.responses.sink'),
+            preview_chars=config.get('logging.responses.preview_chars', 300),
+            seed=config.get('logging.responses.seed')
+        )
+
+    def sample(self, stage: str) -> bool:
+        """按阶段的采样比例决定是否将本次响应输出到日志"""
+        rate = self.stage_rates.get(stage, self.sample_rate)
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def preview(self, response) -> str:
+        """截断后的响应，用于日志显示"""
+        text = str(response)
+        if len(text) <= self.preview_chars:
+            return text
+        return f"{text[:self.preview_chars]}...（共 {len(text)} 字符）"
+
+    def write(self, world: str, role: str, stage: str, response: str, status: str = 'ok', **fields):
+        """将完整响应交给后台线程写入JSONL文件（未配置文件时直接返回）"""
+        if self._queue is None:
+            return
+        entry = {'time': round(time.time(), 3), 'world': world, 'role': role, 'stage': stage, 'status': status}
+        entry.update(fields)
+        entry['response'] = response
+        self._queue.put(entry)
+
+    def _write_loop(self):
+        """后台写入线程：队列取空时才刷新文件"""
+        with open(self.sink, 'a', encoding='utf-8') as f:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    break
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+                if self._queue.empty():
+                    f.flush()
+
+    def close(self):
+        """写完队列中剩余的响应并停止写入线程"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
@@ -32,7 +32,8 @@ def main():
     generator = DataGenerator(
         world=args.world,
         role=args.role,
-        config_path=args.config
+        config_path=args.config,
+        language='en'
     )
     
     # If API key is provided via command line, override config file setting
@@ -44,9 +45,6 @@ def main():
             config_dict = config_dict[key]
         config_dict[keys[-1]] = args.api_key
     
-    # Set language to English
-    generator.config._config['language'] = 'en'
-    
     # Execute data generation process
     try:
         print(f"Starting to generate English dataset for {args.role} from {args.world}")
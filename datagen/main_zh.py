@@ -32,7 +32,8 @@ def main():
     generator = DataGenerator(
         world=args.world,
         role=args.role,
-        config_path=args.config
+        config_path=args.config,
+        language='zh'
     )
     
     # 如果命令行提供了API密钥，覆盖配置文件中的设置
@@ -44,9 +45,6 @@ def main():
             config_dict = config_dict[key]
         config_dict[keys[-1]] = args.api_key
     
-    # 设置语言为中文
-    generator.config._config['language'] = 'zh'
-    
     # 执行数据生成流程
     try:
         print(f"开始为 {args.world} 的 {args.role} 生成中文数据集")
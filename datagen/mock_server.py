@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+本地模拟的OpenAI兼容接口
+提供 /v1/chat/completions，按prompt模板识别请求类型并返回格式正确的固定响应，
+可配置延迟分布和429/5xx错误注入，用于离线测试吞吐量和并发策略而不产生API费用
+
+用法：
+    python mock_server.py --port 8000
+    然后将 openai.base_url 设为 http://127.0.0.1:8000/v1
+也可以在配置中设置 mock.enabled: true，由请求引擎在进程内自动启动
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import string
+import sys
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from prompts import PromptManager
+from rate_limiter import estimate_text_tokens
+from structured import ARRAY_FIELD
+
+
+# 评估脚本的打分prompt标记 -> 打分格式
+JUDGE_MARKERS = (
+    ('分数：[你的分数]', 'judge_zh'),
+    ('Score: [Your score]', 'judge_en'),
+    ('repeat just the selected score again by itself on a new line', 'judge_characterllm')
+)
+
+
+class PromptMatcher:
+    """按prompt模板识别请求类型并提取模板参数"""
+
+    def __init__(self):
+        self.patterns = []
+        for language in ('zh', 'en'):
+            manager = PromptManager(language)
+            for prompt_type, template in manager.prompts.items():
+                pattern, literal_size = self._compile(template)
+                self.patterns.append((prompt_type, language, pattern, literal_size))
+        # 模板中固定文本越多越具体，优先匹配
+        self.patterns.sort(key=lambda entry: -entry[3])
+
+    @staticmethod
+    def _compile(template: str) -> Tuple["re.Pattern", int]:
+        """将format模板转换为正则：固定文本原样匹配，字段匹配任意文本（同名字段必须一致）"""
+        parts = []
+        seen = set()
+        literal_size = 0
+        for literal, field, _, _ in string.Formatter().parse(template):
+            parts.append(re.escape(literal))
+            literal_size += len(literal)
+            if field is None:
+                continue
+            if field in seen:
+                parts.append(f"(?P={field})")
+            else:
+                seen.add(field)
+                parts.append(f"(?P<{field}>.*?)")
+        return re.compile("".join(parts), re.DOTALL), literal_size
+
+    def match(self, prompt: str) -> Tuple[str, str, Dict[str, str]]:
+        """
+        识别prompt
+
+        Returns:
+            (prompt类型, 语言, 模板参数)，无法识别时类型为 unknown
+        """
+        for marker, kind in JUDGE_MARKERS:
+            if marker in prompt:
+                return kind, 'en' if kind != 'judge_zh' else 'zh', {}
+        for prompt_type, language, pattern, _ in self.patterns:
+            found = pattern.fullmatch(prompt)
+            if found:
+                return prompt_type, language, found.groupdict()
+        return 'unknown', 'zh', {}
+
+
+class ResponseFactory:
+    """
+    按请求类型生成格式正确的固定响应（同一prompt总是得到相同的响应）
+
+    响应格式以处理器的解析逻辑为准（如 wiki2anti/anti2qa 的英文模板与处理器不一致时，仍按处理器的格式返回）
+    """
+
+    def __init__(self, statements_per_passage: int = None, keywords_per_anti: int = None, topics: int = 10):
+        """
+        初始化响应生成器
+
+        Args:
+            statements_per_passage: 每个段落生成的陈述数，为空时随机3~6条
+            keywords_per_anti: 每个反例的关键词数，为空时随机5~7个
+            topics: 聊天主题数
+        """
+        self.statements_per_passage = statements_per_passage
+        self.keywords_per_anti = keywords_per_anti
+        self.topics = topics
+
+    def build(self, prompt_type: str, language: str, fields: Dict[str, str], prompt: str) -> str:
+        """生成响应文本"""
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+        zh = language == 'zh'
+        role = fields.get('character') or fields.get('role') or ('角色' if zh else 'the character')
+        source = self._snippet(fields)
+        builder = getattr(self, f"_build_{prompt_type}", None)
+        if builder is None:
+            return "好的。" if zh else "OK."
+        return builder(rng=rng, zh=zh, role=role, source=source, fields=fields)
+
+    @staticmethod
+    def _snippet(fields: Dict[str, str], size: int = 24) -> str:
+        """取源文本的一小段，用于让响应内容随输入变化"""
+        for name in ('passage', 'statement', 'summary', 'summaries', 'content', 'topic', 'keyword', 'question', 'chosen', 'general'):
+            text = (fields.get(name) or '').strip()
+            if text:
+                return " ".join(text.split())[:size]
+        return ""
+
+    @staticmethod
+    def _dumps(data) -> str:
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def _qa(self, rng, zh, role, source, index=1) -> Dict:
+        if zh:
+            return {"question": f"你还记得{source}这件事吗？（{index}）", "answer": f"当然记得，{source}，那时候我可开心了。"}
+        return {"question": f"Do you remember {source}? ({index})", "answer": f"Of course, {source}. I remember it well."}
+
+    def _build_wiki2statement(self, rng, zh, role, source, fields):
+        count = self.statements_per_passage or rng.randint(3, 6)
+        if zh:
+            return "\n".join(f"- {role}的第{i}条陈述：{source}" for i in range(1, count + 1))
+        return "\n".join(f"- {role} statement {i}: {source}" for i in range(1, count + 1))
+
+    def _build_statement2qa(self, rng, zh, role, source, fields):
+        return self._dumps([self._qa(rng, zh, role, source, i) for i in range(1, rng.randint(1, 3) + 1)])
+
+    def _build_chat2qa(self, rng, zh, role, source, fields):
+        return self._dumps([self._qa(rng, zh, role, source, i) for i in range(1, 4)])
+
+    def _build_summary2qa(self, rng, zh, role, source, fields):
+        return self._dumps(self._qa(rng, zh, role, source))
+
+    _build_conv2qa = _build_summary2qa
+
+    def _packed(self, fields, value):
+        try:
+            count = int(fields.get('count') or 1)
+        except ValueError:
+            count = 1
+        slots = dict(re.findall(r'【(\d+)】\n(.*?)(?=\n\n【\d+】|\Z)', fields.get('items', ''), re.DOTALL))
+        return self._dumps({str(i): value(" ".join(slots.get(str(i), "").split())[:24]) for i in range(1, count + 1)})
+
+    def _build_statement2qa_packed(self, rng, zh, role, source, fields):
+        return self._packed(fields, lambda text: [self._qa(rng, zh, role, text, i) for i in range(1, rng.randint(1, 3) + 1)])
+
+    def _build_summary2qa_packed(self, rng, zh, role, source, fields):
+        return self._packed(fields, lambda text: self._qa(rng, zh, role, text))
+
+    _build_conv2qa_packed = _build_summary2qa_packed
+
+    def _build_conv2summary(self, rng, zh, role, source, fields):
+        if zh:
+            return self._dumps({"summary": f"场景中{source}。", "role_highlight": f"{role}在场景中积极参与。"})
+        return self._dumps({"summary": f"In this scene, {source}.", "role_highlight": f"{role} takes an active part."})
+
+    _build_conv2summary_reduce = _build_conv2summary
+
+    def _build_conv2summary_chunk(self, rng, zh, role, source, fields):
+        return f"这一部分中{source}。" if zh else f"In this part, {source}."
+
+    def _build_chat2qa_topics(self, rng, zh, role, source, fields):
+        return self._dumps([f"话题{i}" if zh else f"Topic {i}" for i in range(1, self.topics + 1)])
+
+    def _build_wiki2anti(self, rng, zh, role, source, fields):
+        keywords = lambda: range(1, (self.keywords_per_anti or rng.randint(5, 7)) + 1)
+        if zh:
+            types = ["能力越界幻觉"] * 5 + ["能力不足幻觉"] * 2 + ["诱导性幻觉"] * 2
+            make = lambda i, t: {"type": t, "description": f"第{i}类幻觉：{source}",
+                                 "example_keywords": [f"关键词{i}-{k}" for k in keywords()]}
+        else:
+            types = ["Overreach hallucination"] * 5 + ["Insufficiency hallucination"] * 2 + ["Induced hallucination"] * 2
+            make = lambda i, t: {"type": t, "description": f"Hallucination {i}: {source}",
+                                 "example_keywords": [f"keyword {i}-{k}" for k in keywords()]}
+        return self._dumps([make(i, t) for i, t in enumerate(types, 1)])
+
+    def _build_anti2qa(self, rng, zh, role, source, fields):
+        if zh:
+            return self._dumps([{"query": f"你了解{source}吗？", "answer": "那是什么？我没听说过。"},
+                                {"query": f"你用过{source}吗？", "answer": "我不太明白你在说什么。"}])
+        return self._dumps([{"query": f"Do you know about {source}?", "answer": "What is that? I've never heard of it."},
+                            {"query": f"Have you used {source}?", "answer": "I'm not sure what you mean."}])
+
+    def _build_conv2style(self, rng, zh, role, source, fields):
+        return f"- rejected: {fields.get('broken_style', 'plain')} {source}"
+
+    def _build_conv2style_packed(self, rng, zh, role, source, fields):
+        return self._packed(fields, lambda text: f"- rejected: {text}")
+
+    def _build_judge_zh(self, rng, zh, role, source, fields):
+        return f"分数：{rng.randint(5, 9)}\n解释：回答基本符合角色设定。\n建议：可以增加更多细节。"
+
+    def _build_judge_en(self, rng, zh, role, source, fields):
+        return (f"Score: {rng.randint(5, 9)}\nExplanation: The response mostly fits the character.\n"
+                "Suggestion: Add more detail.")
+
+    def _build_judge_characterllm(self, rng, zh, role, source, fields):
+        score = rng.randint(3, 7)
+        return f"Step 1: The response is mostly consistent with the profile.\n{score}\n{score}"
+
+
+class MockBehavior:
+    """延迟分布和错误注入（线程安全）"""
+
+    def __init__(self, latency_distribution: str = 'lognormal', latency_mean: float = 0.5,
+                 latency_std: float = 0.3, latency_min: float = 0.0, per_output_token: float = 0.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, requests_per_minute: float = None,
+                 retry_after: float = 1.0, seed: int = None, malformed_rate: float = 0.0):
+        """
+        初始化模拟行为
+
+        Args:
+            latency_distribution: 延迟分布（fixed/uniform/normal/lognormal）
+            latency_mean: 平均延迟秒数
+            latency_std: 延迟标准差（uniform时为半宽）
+            latency_min: 最小延迟秒数
+            per_output_token: 每个输出token额外增加的秒数
+            error_rate: 随机返回500错误的比例
+            rate_limit_rate: 随机返回429错误的比例
+            requests_per_minute: 每分钟请求数上限，超出时返回429，为空时不限制
+            retry_after: 429响应的Retry-After秒数
+            seed: 随机种子
+            malformed_rate: 随机返回截断的（无法解析的）响应的比例
+        """
+        self.latency_distribution = latency_distribution
+        self.latency_mean = latency_mean
+        self.latency_std = latency_std
+        self.latency_min = latency_min
+        self.per_output_token = per_output_token
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.malformed_rate = malformed_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+
+    def sample_latency(self, output_tokens: int = 0) -> float:
+        """按配置的分布采样一次延迟"""
+        mean, std = self.latency_mean, self.latency_std
+        with self._lock:
+            if self.latency_distribution == 'fixed' or mean <= 0:
+                latency = mean
+            elif self.latency_distribution == 'uniform':
+                latency = self._random.uniform(mean - std, mean + std)
+            elif self.latency_distribution == 'normal':
+                latency = self._random.gauss(mean, std)
+            else:
+                # 对数正态：按给定的均值和标准差换算参数，长尾更接近真实API
+                sigma2 = math.log(1 + (std / mean) ** 2)
+                latency = self._random.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+        return max(self.latency_min, latency) + output_tokens * self.per_output_token
+
+    def inject_error(self) -> Optional[int]:
+        """决定本次请求是否返回错误，返回HTTP状态码或None"""
+        with self._lock:
+            if self.requests_per_minute:
+                now = time.monotonic()
+                while self._recent and now - self._recent[0] > 60:
+                    self._recent.popleft()
+                if len(self._recent) >= self.requests_per_minute:
+                    return 429
+                self._recent.append(now)
+            roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def inject_malformed(self) -> bool:
+        """决定本次成功的响应是否截断为无法解析的内容"""
+        if not self.malformed_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.malformed_rate
+
+
+class MockServer:
+    """本地模拟的chat completions服务"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, behavior: MockBehavior = None,
+                 factory: ResponseFactory = None):
+        """
+        初始化模拟服务
+
+        Args:
+            host: 监听地址
+            port: 监听端口，为0时自动分配
+            behavior: 延迟和错误注入行为
+            factory: 响应生成器（控制每条响应产出的陈述、关键词等数量）
+        """
+        self.host = host
+        self.port = port
+        self.behavior = behavior or MockBehavior()
+        self.matcher = PromptMatcher()
+        self.factory = factory or ResponseFactory()
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config) -> Optional["MockServer"]:
+        """根据配置中的 mock 段创建模拟服务，未启用时返回None"""
+        if not config.get('mock.enabled', False):
+            return None
+        return cls(
+            host=config.get('mock.host', "127.0.0.1"),
+            port=config.get('mock.port', 0),
+            behavior=MockBehavior(
+                latency_distribution=config.get('mock.latency.distribution', 'lognormal'),
+                latency_mean=config.get('mock.latency.mean', 0.5),
+                latency_std=config.get('mock.latency.std', 0.3),
+                latency_min=config.get('mock.latency.min', 0.0),
+                per_output_token=config.get('mock.latency.per_output_token', 0.0),
+                error_rate=config.get('mock.error_rate', 0.0),
+                rate_limit_rate=config.get('mock.rate_limit_rate', 0.0),
+                requests_per_minute=config.get('mock.requests_per_minute'),
+                retry_after=config.get('mock.retry_after', 1.0),
+                seed=config.get('mock.seed'),
+                malformed_rate=config.get('mock.malformed_rate', 0.0)
+            ),
+            factory=ResponseFactory(
+                statements_per_passage=config.get('mock.responses.statements_per_passage'),
+                keywords_per_anti=config.get('mock.responses.keywords_per_anti'),
+                topics=config.get('mock.responses.topics', 10)
+            )
+        )
+
+    @property
+    def base_url(self) -> str:
+        """供 openai.base_url 使用的地址"""
+        return f"http://{self.host}:{self.port}/v1"
+
+    def count(self, key: str):
+        """累加统计计数"""
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def get_stats(self) -> Dict:
+        """获取请求统计（总数、错误数、各prompt类型的请求数）"""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def complete(self, body: Dict) -> Tuple[int, Dict, Dict]:
+        """
+        处理一次chat completions请求
+
+        Returns:
+            (HTTP状态码, 响应体, 额外响应头)
+        """
+        self.count('requests')
+        status = self.behavior.inject_error()
+        if status is not None:
+            self.count(f'status_{status}')
+            time.sleep(self.behavior.sample_latency() / 10)
+            headers = {'retry-after': str(self.behavior.retry_after)} if status == 429 else {}
+            message = "Rate limit exceeded" if status == 429 else "Internal server error"
+            return status, {"error": {"message": message, "type": "mock_error", "code": status}}, headers
+
+        messages = body.get("messages") or []
+        prompt = "\n".join(str(message.get("content") or "") for message in messages)
+        # 按第一条用户消息识别请求类型（结构化输出的系统提示和修复请求追加的消息不参与识别）
+        user_messages = [message for message in messages if message.get("role") == "user"] or messages
+        prompt_type, language, fields = self.matcher.match(user_messages[0].get("content", "") if messages else "")
+        self.count(f'type_{prompt_type}')
+        content = self.factory.build(prompt_type, language, fields, prompt)
+        if body.get("response_format"):
+            content = self._wrap_structured(content)
+        if self.behavior.inject_malformed():
+            self.count('malformed')
+            content = content[:len(content) // 2]
+
+        prompt_tokens = estimate_text_tokens(prompt) + 4 * len(messages)
+        completion_tokens = estimate_text_tokens(content)
+        time.sleep(self.behavior.sample_latency(completion_tokens))
+        return 200, {
+            "id": f"chatcmpl-mock-{hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or "mock",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }, {}
+
+    @staticmethod
+    def _wrap_structured(content: str) -> str:
+        """结构化输出请求要求顶层为对象，数组响应包装在 items 字段中"""
+        try:
+            value = json.loads(content)
+        except ValueError:
+            return content
+        if isinstance(value, list):
+            return json.dumps({ARRAY_FIELD: value}, ensure_ascii=False)
+        return content
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, payload: Dict, headers: Dict = None):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/models'):
+                    self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+                elif self.path.rstrip('/').endswith('/stats'):
+                    self._send(200, server.get_stats())
+                else:
+                    self._send(404, {"error": {"message": f"Not found: {self.path}"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError as e:
+                    self._send(400, {"error": {"message": f"Invalid JSON: {e}"}})
+                    return
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send(404, {"error": {"message": f"Not found: {self.path}"}})
+                    return
+                self._send(*server.complete(body))
+
+            def log_message(self, format, *args):
+                # 不逐条输出访问日志
+                pass
+
+        return Handler
+
+    def start(self) -> str:
+        """在后台线程中启动服务，返回 base_url"""
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        """停止服务"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容接口")
+    parser.add_argument("--config", "-c", help="配置文件路径（读取其中的 mock 段）")
+    parser.add_argument("--host", default=None, help="监听地址")
+    parser.add_argument("--port", "-p", type=int, default=None, help="监听端口")
+    parser.add_argument("--latency", choices=["fixed", "uniform", "normal", "lognormal"], help="延迟分布")
+    parser.add_argument("--latency-mean", type=float, help="平均延迟秒数")
+    parser.add_argument("--latency-std", type=float, help="延迟标准差")
+    parser.add_argument("--error-rate", type=float, help="返回500错误的比例")
+    parser.add_argument("--rate-limit-rate", type=float, help="返回429错误的比例")
+    parser.add_argument("--malformed-rate", type=float, help="返回截断响应的比例")
+    parser.add_argument("--rpm", type=float, help="每分钟请求数上限，超出时返回429")
+    parser.add_argument("--seed", type=int, help="随机种子")
+    args = parser.parse_args()
+
+    settings = {}
+    if args.config:
+        from utils import Config
+        settings = Config(args.config).get('mock') or {}
+    latency = settings.get('latency') or {}
+    responses = settings.get('responses') or {}
+
+    def pick(value, default):
+        return default if value is None else value
+
+    server = MockServer(
+        host=pick(args.host, settings.get('host', "127.0.0.1")),
+        port=pick(args.port, settings.get('port') or 8000),
+        behavior=MockBehavior(
+            latency_distribution=pick(args.latency, latency.get('distribution', 'lognormal')),
+            latency_mean=pick(args.latency_mean, latency.get('mean', 0.5)),
+            latency_std=pick(args.latency_std, latency.get('std', 0.3)),
+            latency_min=latency.get('min', 0.0),
+            per_output_token=latency.get('per_output_token', 0.0),
+            error_rate=pick(args.error_rate, settings.get('error_rate', 0.0)),
+            rate_limit_rate=pick(args.rate_limit_rate, settings.get('rate_limit_rate', 0.0)),
+            requests_per_minute=pick(args.rpm, settings.get('requests_per_minute')),
+            retry_after=settings.get('retry_after', 1.0),
+            seed=pick(args.seed, settings.get('seed')),
+            malformed_rate=pick(args.malformed_rate, settings.get('malformed_rate', 0.0))
+        ),
+        factory=ResponseFactory(
+            statements_per_passage=responses.get('statements_per_passage'),
+            keywords_per_anti=responses.get('keywords_per_anti'),
+            topics=responses.get('topics', 10)
+        )
+    )
+    print(f"模拟服务已启动: {server.start()}")
+    print("将 openai.base_url（或评估脚本中的 BASE_URL）设为该地址即可，按 Ctrl+C 停止")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
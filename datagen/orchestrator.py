@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+多角色编排入口
+按 config.yaml 中的 worlds 配置，在同一进程内并发为多个世界/角色生成数据，
+所有角色共享同一个API请求引擎（连接池、速率控制和响应缓存）
+"""
+
+import os
+import sys
+import time
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+# 添加项目根目录到路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from api_engine import AsyncAPIEngine
+from generator import DataGenerator
+from utils import Config, save_json
+
+
+class Orchestrator:
+    """多角色数据生成编排器"""
+
+    def __init__(self, config_path: str = "config.yaml", worlds: List[str] = None, roles: List[str] = None,
+                 language: str = None, max_parallel_roles: int = None):
+        """
+        初始化编排器
+
+        Args:
+            config_path: 配置文件路径
+            worlds: 只处理这些世界，为空时处理全部
+            roles: 只处理这些角色，为空时处理全部
+            language: 语言类型，为空时按 orchestrator.languages 配置或默认中文
+            max_parallel_roles: 同时运行的角色数
+        """
+        self.config_path = config_path
+        self.config = Config(config_path)
+        self.language = language
+        self.max_parallel_roles = max_parallel_roles or self.config.get('orchestrator.max_parallel_roles', 4)
+        self.tasks = self._select_tasks(worlds, roles)
+
+        # 所有角色共享的请求引擎
+        self.engine = AsyncAPIEngine.from_config(self.config)
+        self.results = []
+
+    def _select_tasks(self, worlds: Optional[List[str]], roles: Optional[List[str]]) -> List[Tuple[str, str]]:
+        """根据过滤条件选出需要处理的 (世界, 角色) 列表"""
+        tasks = []
+        for world, world_roles in (self.config.get('worlds') or {}).items():
+            if worlds and world not in worlds:
+                continue
+            for role in world_roles or []:
+                if roles and role not in roles:
+                    continue
+                tasks.append((world, role))
+        return tasks
+
+    def get_language(self, world: str) -> str:
+        """获取世界对应的语言"""
+        if self.language:
+            return self.language
+        languages = self.config.get('orchestrator.languages') or {}
+        return languages.get(world, self.config.get('language', 'zh'))
+
+    def run_role(self, world: str, role: str) -> Dict:
+        """运行单个角色的完整流程，返回该角色的执行报告"""
+        report = {
+            "world": world,
+            "role": role,
+            "language": self.get_language(world),
+            "status": "running",
+            "stages": {},
+            "seconds": None,
+            "error": None
+        }
+        start_time = time.time()
+        try:
+            generator = DataGenerator(world, role, self.config_path, engine=self.engine, language=report["language"])
+            report["stages"] = generator.stage_status
+            generator.run()
+            failed = [name for name, stage in generator.stage_status.items() if stage['status'] in ('failed', 'skipped')]
+            report["status"] = "partial" if failed else "success"
+        except Exception as e:
+            report["status"] = "failed"
+            report["error"] = f"{type(e).__name__}: {e}"
+            report["traceback"] = traceback.format_exc()
+        finally:
+            report["seconds"] = round(time.time() - start_time, 2)
+        return report
+
+    def run(self) -> List[Dict]:
+        """并发运行所有选中的角色"""
+        total = len(self.tasks)
+        print(f"共 {total} 个角色待处理，最大并发角色数: {self.max_parallel_roles}")
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_parallel_roles) as executor:
+            futures = {executor.submit(self.run_role, world, role): (world, role) for world, role in self.tasks}
+            for finished, future in enumerate(as_completed(futures), 1):
+                report = future.result()
+                self.results.append(report)
+                print(f"[{finished}/{total}] {report['world']}/{report['role']}: {report['status']} "
+                      f"({report['seconds']}s)" + (f" - {report['error']}" if report['error'] else ""))
+        self.elapsed = round(time.time() - start_time, 2)
+
+        # 按配置中的顺序输出报告
+        order = {task: index for index, task in enumerate(self.tasks)}
+        self.results.sort(key=lambda r: order[(r['world'], r['role'])])
+        return self.results
+
+    def build_report(self) -> Dict:
+        """汇总整体执行报告"""
+        statuses = [r['status'] for r in self.results]
+        report = {
+            "summary": {
+                "total_roles": len(self.results),
+                "success": statuses.count("success"),
+                "partial": statuses.count("partial"),
+                "failed": statuses.count("failed"),
+                "seconds": getattr(self, 'elapsed', None)
+            },
+            "rate_limit": dict(self.engine.rate_controller.stats),
+            "usage": self.engine.usage_tracker.summary(),
+            "profile": self.engine.profiler.summary(),
+            "roles": self.results
+        }
+        if self.engine.response_cache:
+            report["cache"] = self.engine.response_cache.get_stats()
+        return report
+
+    def save_report(self, report: Dict, path: str = None) -> str:
+        """保存执行报告"""
+        if path is None:
+            path = os.path.join(self.config.get('paths.output_base', 'output'), "reports", "orchestrator_report.json")
+        save_json(report, path)
+        if self.engine.profiler.enabled:
+            with open(f"{path.rsplit('.', 1)[0]}.prom", 'w', encoding='utf-8') as f:
+                f.write(self.engine.profiler.to_prometheus())
+        return path
+
+    def close(self):
+        """释放共享资源"""
+        self.engine.close()
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="多角色数据生成编排器")
+    parser.add_argument("--config", "-c", default="config.yaml", help="配置文件路径")
+    parser.add_argument("--worlds", "-w", nargs="*", help="只处理指定的世界（默认全部）")
+    parser.add_argument("--roles", "-r", nargs="*", help="只处理指定的角色（默认全部）")
+    parser.add_argument("--language", "-l", choices=["zh", "en"], help="语言类型（默认按 orchestrator.languages 配置）")
+    parser.add_argument("--max-parallel-roles", "-p", type=int, help="同时运行的角色数")
+    parser.add_argument("--report", help="执行报告输出路径")
+
+    args = parser.parse_args()
+
+    orchestrator = Orchestrator(
+        config_path=args.config,
+        worlds=args.worlds,
+        roles=args.roles,
+        language=args.language,
+        max_parallel_roles=args.max_parallel_roles
+    )
+
+    if not orchestrator.tasks:
+        print("没有匹配的世界/角色，请检查 worlds 配置和过滤条件")
+        sys.exit(1)
+
+    try:
+        orchestrator.run()
+    except KeyboardInterrupt:
+        print("用户中断了数据生成过程")
+        sys.exit(1)
+    finally:
+        report = orchestrator.build_report()
+        report_path = orchestrator.save_report(report, args.report)
+        orchestrator.close()
+
+    summary = report["summary"]
+    print(f"\n全部完成: 成功 {summary['success']}, 部分完成 {summary['partial']}, 失败 {summary['failed']}")
+    print(f"执行报告: {report_path}")
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
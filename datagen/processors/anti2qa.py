@@ -4,14 +4,12 @@
 """
 
 import os
-import json
-import random
-import time
-from tqdm import tqdm
-import re
+import logging
 
 from .base_processor import BaseProcessor
-from utils import load_json, save_json, format_filename, get_file_count
+from json_extract import extract_json_objects
+from keywords import KeywordClusterer
+from utils import load_json
 
 
 
@@ -29,76 +27,95 @@ class Anti2QAProcessor(BaseProcessor):
         output_path = self.path_manager.get_output_path("qa", "qa_anti", f"{self.world}_{self.role}_qa_anti.json")
         
         # 检查输出文件是否已存在
-        if os.path.exists(output_path):
-            self.log(f"输出文件已存在，跳过处理: {output_path}")
+        if self.should_skip(output_path):
             return True
         
-        # 检查输入文件是否存在
-        if not os.path.exists(anti_path):
-            self.log(f"输入文件不存在，跳过处理: {anti_path}")
-            return True
-        
-        # 读取反例数据
-        self.log(f"读取反例数据: {anti_path}")
-        anti_data = load_json(anti_path)
-        
-        if not anti_data:
-            self.log("反例数据为空，跳过处理")
-            return True
+        # 流式传递时边接收上游反例边处理，否则读取上游写出的文件
+        stream = self.get_stream("anti")
+        if stream is None:
+            # 检查输入文件是否存在
+            if not os.path.exists(anti_path):
+                self.log(f"输入文件不存在，跳过处理: {anti_path}")
+                return True
+            
+            # 读取反例数据
+            self.log(f"读取反例数据: {anti_path}")
+            anti_data = load_json(anti_path)
+            
+            if not anti_data:
+                self.log("反例数据为空，跳过处理")
+                return True
         
         # 读取通用背景信息
-        general_path = self.path_manager.get_local_input_path("general", f"general_{self.role}.txt")
-        if not os.path.exists(general_path):
-            self.log(f"通用背景信息文件不存在: {general_path}")
+        general_info = self.load_general()
+        if general_info is None:
             return False
         
-        with open(general_path, 'r', encoding='utf-8') as f:
-            general_info = f.read().strip()
-        
         # 用于存储生成的问答对
         all_qa_pairs = []
         
         # 从反例生成问答对
-        self.log(f"开始生成问答对，共 {len(anti_data)} 个反例...")
+        if stream is None:
+            self.log(f"开始生成问答对，共 {len(anti_data)} 个反例...")
+        else:
+            self.log("流式模式：边接收反例边生成问答对...")
+            anti_data = stream
         
         # 在示例模式下限制反例数量
         anti_data = self.limit_data_for_demo(anti_data)
         
-        for anti_index, anti_item in enumerate(tqdm(anti_data, desc=f"处理 {self.role} 的反例")):
-            question_type = anti_item.get("type", "")
-            description = anti_item.get("description", "")
-            example_keywords = anti_item.get("example_keywords", [])
+        # 展开关键词并按幻觉类型聚类，重复或近似重复的关键词并入已有的簇，每个簇只请求一次
+        clusterer = KeywordClusterer.from_config(self.config)
+        
+        def expand_clusters():
+            for anti_item in anti_data:
+                for keyword in anti_item.get("example_keywords", []):
+                    cluster = clusterer.add(anti_item, keyword)
+                    if cluster is not None:
+                        yield cluster
+        
+        requests = expand_clusters()
+        if stream is None:
+            requests = list(requests)
+        
+        def build_messages(cluster):
+            anti_item = cluster.anti_item
+            # 使用完整的prompt模板
+            prompt = self.get_prompt("anti2qa", world=self.world, role=self.role, question_type=anti_item.get("type", ""), description=anti_item.get("description", ""), keyword=cluster.keyword, general=general_info)
+            # 将prompt转换为messages格式
+            return [{"role": "user", "content": prompt}]
+        
+        # 并发调用API生成问答对，结果按反例顺序返回
+        for cluster, response in self.map_api(requests, build_messages, temperature=0.8,
+                                              desc=f"处理 {self.role} 的反例",
+                                              validate=self._parse_anti_qa_response):
+            anti_item = cluster.anti_item
+            if isinstance(response, Exception):
+                self.log(f"生成反例问答对时出错: {response}", logging.WARNING)
+                continue
             
-            for keyword in example_keywords:
-                # 使用完整的prompt模板
-                prompt = self.get_prompt("anti2qa", world=self.world, role=self.role, question_type=question_type, description=description, keyword=keyword, general=general_info)
-                
-                # 调用API生成问答对
-                try:
-                    # 将prompt转换为messages格式
-                    messages = [{"role": "user", "content": prompt}]
-                    response = self.call_api(messages, temperature=0.8)
-                    qa_pairs = self._parse_anti_qa_response(response)
-                    
-                    # 处理每个问答对
-                    for qa_pair in qa_pairs:
-                        if "query" in qa_pair and "answer" in qa_pair:
-                            qa_item = {
-                                "question": qa_pair["query"],
-                                "answer": qa_pair["answer"],
-                                "retrieve": "",
-                                "hallucination": question_type
-                            }
-                            all_qa_pairs.append(qa_item)
-                    
-                except Exception as e:
-                    self.log(f"生成反例问答对时出错: {e}")
-                    continue
+            qa_pairs = self._parse_anti_qa_response(response)
+            
+            # 处理每个问答对
+            for qa_pair in qa_pairs:
+                if isinstance(qa_pair, dict) and "query" in qa_pair and "answer" in qa_pair:
+                    qa_item = {
+                        "question": qa_pair["query"],
+                        "answer": qa_pair["answer"],
+                        "retrieve": "",
+                        "hallucination": anti_item.get("type", ""),
+                        # 簇内全部关键词的来源（反例的 source_id 和原始关键词）
+                        "sources": cluster.sources
+                    }
+                    all_qa_pairs.append(qa_item)
+        
+        if clusterer.keywords:
+            self.log(f"关键词去重：{clusterer.keywords} 个关键词归并为 {len(clusterer.clusters)} 个请求")
         
         # 保存问答对数据
         if all_qa_pairs:
             self.log(f"保存反例问答对数据: {output_path}")
-            save_json(all_qa_pairs, output_path)
+            self.save_output(all_qa_pairs, output_path)
             self.log(f"反例问答对生成完成，共生成 {len(all_qa_pairs)} 条数据")
         else:
             self.log("未生成任何反例问答对")
@@ -107,25 +124,10 @@ class Anti2QAProcessor(BaseProcessor):
     
     def _parse_anti_qa_response(self, response: str) -> list:
         """解析API响应中的反例问答对"""
-        try:
-            # 直接输出API响应用于调试
-            self.log(f"API响应内容: {response}")
-            
-            # 尝试提取JSON部分
-            json_content = response
-            if not json_content.startswith('['):
-                json_match = re.search(r'\[\s*{.*}\s*\]', json_content, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(0)
-            
-            qa_pairs = json.loads(json_content)
-            if isinstance(qa_pairs, list):
-                return qa_pairs
-            else:
-                return []
-        except Exception as e:
-            self.log(f"解析反例问答对响应失败: {e}")
-            self.log(f"原始响应: {response}")
+        qa_pairs = extract_json_objects(response)
+        if qa_pairs is None:
+            self.log("解析反例问答对响应失败: 未找到JSON对象数组", logging.WARNING)
             return []
+        return qa_pairs
     
  
\ No newline at end of file
@@ -3,8 +3,22 @@
 定义统一的处理器接口
 """
 
+import os
+import json
+import logging
+import re
+import time
 from abc import ABC, abstractmethod
-from typing import Any
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from tqdm import tqdm
+
+from journal import Journal
+from json_extract import extract_json
+from logger import LOGGER_NAME
+from structured import ValidationReport, build_response_format, unwrap_response
+from token_counter import PromptTooLongError, get_context_window
+from utils import save_json
 
 
 class BaseProcessor(ABC):
@@ -22,6 +36,21 @@ class BaseProcessor(ABC):
         self.role = generator.role
         self.config = generator.config
         self.path_manager = generator.path_manager
+        self.context = generator.context
+        
+        # 日志带上处理器、世界、角色和阶段，经由队列由后台线程输出
+        self.logger = logging.getLogger(f"{LOGGER_NAME}.{self.get_stage()}")
+        self._log_context = {'processor': self.get_name(), 'world': self.world, 'role': self.role,
+                             'stage': self.get_stage()}
+        
+        # 检查点日志，首次调用API时打开
+        self._journal = None
+        
+        # 响应校验与修复统计
+        self.validation = ValidationReport(self.config.get('repair.max_requests', 0))
+        
+        # 为 _parse_* 方法计时
+        self._instrument_parsers()
         
         # 初始化prompt管理器
         try:
@@ -32,9 +61,9 @@ class BaseProcessor(ABC):
             if project_root not in sys.path:
                 sys.path.insert(0, project_root)
             
-            from prompts import PromptManager
+            from prompts import get_prompt_manager
             language = self.config.get('language', 'zh')
-            self.prompt_manager = PromptManager(language)
+            self.prompt_manager = get_prompt_manager(language)
         except ImportError as e:
             print(f"Warning: Failed to import PromptManager: {e}")
             self.prompt_manager = None
@@ -53,28 +82,606 @@ class BaseProcessor(ABC):
         """获取处理器名称"""
         return self.__class__.__name__
     
-    def log(self, message: str):
-        """记录日志"""
-        print(f"    [{self.get_name()}] {message}")
+    def get_stage(self) -> str:
+        """获取阶段名称（如 Statement2QAProcessor -> statement2qa）"""
+        name = self.get_name()
+        if name.endswith('Processor'):
+            name = name[:-len('Processor')]
+        return name.lower()
+    
+    def log(self, message: str, level: int = logging.INFO):
+        """记录日志（只入队，由后台线程输出，不阻塞请求循环）"""
+        self.logger.log(level, message, extra=self._log_context)
+    
+    def record_response(self, response: str, status: str = 'ok', **fields):
+        """
+        记录一条原始响应：完整内容写入响应记录文件（已配置时），
+        正常的响应按本阶段的采样比例输出到日志，未通过校验的响应以WARNING级别输出截断后的内容
+        """
+        response_log = self.generator.engine.response_log
+        response_log.write(self.world, self.role, self.get_stage(), response, status, **fields)
+        if status != 'ok':
+            self.log(f"原始响应（{status}）: {response_log.preview(response)}", logging.WARNING)
+        elif response_log.sample(self.get_stage()):
+            self.log(f"API响应内容: {response_log.preview(response)}")
+    
+    def _instrument_parsers(self):
+        """将本处理器的 _parse_* 方法包装为计时版本，解析耗时和解析失败（返回空结果）计入性能报告"""
+        profiler = self.generator.engine.profiler
+        if not profiler.enabled:
+            return
+        for name in dir(type(self)):
+            if not name.startswith('_parse_'):
+                continue
+            method = getattr(self, name)
+            
+            def timed(*args, _method=method, **kwargs):
+                start = time.perf_counter()
+                result = _method(*args, **kwargs)
+                profiler.observe(self.world, self.role, self.get_stage(), 'parse', time.perf_counter() - start,
+                                 error=not result)
+                return result
+            
+            setattr(self, name, timed)
+    
+    def call_api(self, messages, model=None, temperature=0.8, validate: Callable = None, prompt_type: str = None):
+        """
+        调用OpenAI API（未指定模型时使用本阶段的模型）
+        
+        给出 validate 时，未通过校验的响应在级联模式下升级到高级模型重试，并按修复配置发起修复请求
+        """
+        request = self.build_request(messages, model or self.get_model(), temperature, prompt_type)
+        return self.generator.engine.run(self._acall(request, validate))
+    
+    def build_request(self, messages: List[Dict], model=None, temperature=0.8, prompt_type: str = None) -> dict:
+        """构造 acall_openai_api 的参数字典，启用结构化输出时附带 response_format"""
+        request = {"messages": messages, "model": model, "temperature": temperature, "stage": self.get_stage()}
+        response_format = self.get_response_format(prompt_type)
+        if response_format is not None:
+            hint = {"role": "system", "content": self.get_template("structured_output")}
+            request["messages"] = [hint] + list(messages)
+            request["response_format"] = response_format
+        return request
+    
+    def get_response_format(self, prompt_type: str = None) -> Optional[Dict]:
+        """获取prompt类型（默认与阶段同名）的结构化输出参数，未启用或没有schema时返回None"""
+        if not self.config.get('structured_output.enabled', False):
+            return None
+        prompt_type = prompt_type or self.get_stage()
+        prompt_types = self.config.get('structured_output.prompt_types')
+        if prompt_types and prompt_type not in prompt_types:
+            return None
+        return build_response_format(prompt_type, self.config.get('structured_output.mode', 'json_schema'))
+    
+    def _resolve_model(self, name: Optional[str]) -> Optional[str]:
+        """将 base/adv 别名解析为 models.base_model / models.adv_model"""
+        if name in ('base', 'adv'):
+            return self.config.get(f'models.{name}_model')
+        return name
+    
+    def get_model(self) -> Optional[str]:
+        """获取本阶段使用的模型（models.stages 中未指定时返回None，即使用 base_model）"""
+        return self._resolve_model((self.config.get('models.stages') or {}).get(self.get_stage()))
+    
+    def get_context_window(self, model: str = None) -> int:
+        """获取模型的上下文窗口大小（token数），models.context_windows 中未列出时使用 models.default_context_window"""
+        return get_context_window(self.config, model or self.get_model() or self.config.get('models.base_model'))
+    
+    def get_escalation_model(self) -> Optional[str]:
+        """获取级联模式下响应未通过校验时升级使用的模型，本阶段未启用级联时返回None"""
+        if not self.config.get('models.cascade.enabled', False):
+            return None
+        stages = self.config.get('models.cascade.stages')
+        if stages and self.get_stage() not in stages:
+            return None
+        escalation = self._resolve_model(self.config.get('models.cascade.model', 'adv'))
+        if escalation == (self.get_model() or self.config.get('models.base_model')):
+            return None
+        return escalation
+    
+    def _passes(self, validate: Callable, response: str) -> bool:
+        """检查响应能否通过本阶段的解析/校验"""
+        try:
+            return bool(validate(response))
+        except Exception:
+            return False
+    
+    async def _request(self, request: dict) -> str:
+        """发起一次请求，结构化输出的响应还原为非结构化模式下的格式"""
+        response = await self.generator.acall_openai_api(**request)
+        self.record_response(response, model=request.get("model"))
+        return unwrap_response(response) if "response_format" in request else response
+    
+    async def _acall(self, request: dict, validate: Callable = None, item: Any = None) -> str:
+        """
+        发起一次请求并校验响应
+        
+        Args:
+            request: acall_openai_api 的参数字典
+            validate: 检查响应能否被本阶段解析的函数，为空时不校验
+            item: 对应的输入项，写入失败明细
+        """
+        response, _ = await self._acall_checked(request, validate, item)
+        return response
+    
+    async def _acall_checked(self, request: dict, validate: Callable = None, item: Any = None) -> Tuple[str, bool]:
+        """发起一次请求并校验响应，返回 (响应, 是否通过校验)；不校验时视为通过"""
+        response = await self._request(request)
+        if validate is None:
+            return response, True
+        return await self._check(request, response, validate, item)
+    
+    async def _check(self, request: dict, response: str, validate: Callable, item: Any = None) -> Tuple[str, bool]:
+        """
+        校验响应：未通过时先升级模型（级联模式），仍未通过时在修复预算内发起修复请求，
+        并记录该项的最终结果
+        
+        Returns:
+            (最终响应, 是否通过校验)
+        """
+        def passes(request, response):
+            passed = self._passes(validate, response)
+            if not passed:
+                # 未通过校验的响应不保留在响应缓存中，重跑或修复时不会再取回同一个无效响应
+                self.generator.discard_cached_response(**request)
+            return passed
+        
+        tracker = self.generator.engine.usage_tracker
+        passed = passes(request, response)
+        outcome = 'passed'
+        
+        escalation = self.get_escalation_model()
+        if escalation is not None:
+            tracker.record_tier(self.world, self.role, self.get_stage(), 'base', passed)
+            if not passed:
+                request = {**request, "model": escalation}
+                response = await self._request(request)
+                passed = passes(request, response)
+                tracker.record_tier(self.world, self.role, self.get_stage(), 'escalated', passed)
+                outcome = 'escalated'
+        
+        attempts = 0
+        max_attempts = self.config.get('repair.max_attempts', 0)
+        while not passed and attempts < max_attempts and self.validation.take_repair():
+            attempts += 1
+            repair_request = self._build_repair_request(request, response)
+            response = await self._request(repair_request)
+            passed = passes(repair_request, response)
+            outcome = 'repaired'
+        
+        if item is None:
+            item = request["messages"][-1]["content"]
+        if not passed:
+            self.record_response(response, 'invalid', model=request.get("model"), repair_attempts=attempts)
+        self.validation.record(outcome if passed else 'failed', item, response, attempts)
+        return response, passed
+    
+    def _build_repair_request(self, request: dict, response: str) -> dict:
+        """修复请求：在原对话后附上未通过校验的响应，要求模型按原格式重新输出"""
+        messages = list(request["messages"]) + [
+            {"role": "assistant", "content": response},
+            {"role": "user", "content": self.get_template("repair")}
+        ]
+        return {**request, "messages": messages}
+    
+    def save_validation_report(self) -> Optional[str]:
+        """保存本阶段的响应校验报告（包含未通过校验的响应时才写出）"""
+        report = self.validation.summary()
+        if report['passed'] == report['validated']:
+            return None
+        path = os.path.join(self.config.get('paths.output_base', 'output'), "reports",
+                            f"{self.world}_{self.role}_{self.get_stage()}_validation.json")
+        self.validation.save(path)
+        self.log(f"响应校验: {report['validated']} 条中 {report['escalated']} 条升级模型后通过, "
+                 f"{report['repaired']} 条修复后通过, {report['failed']} 条失败（修复请求 {report['repair_requests']} 次）")
+        self.log(f"校验报告: {path}")
+        return path
+    
+    def _get_journal_path(self) -> str:
+        """获取本阶段检查点日志的路径"""
+        journal_dir = self.config.get('checkpoint.dir')
+        if not journal_dir:
+            journal_dir = os.path.join(self.config.get('paths.output_base', 'output'), "journal")
+        return os.path.join(journal_dir, f"{self.world}_{self.role}", f"{self.get_stage()}.jsonl")
+    
+    def get_journal(self) -> Optional[Journal]:
+        """获取本阶段的检查点日志，未启用检查点时返回None"""
+        if not self.config.get('checkpoint.enabled', False):
+            return None
+        if self._journal is None:
+            self._journal = Journal(self._get_journal_path())
+            if self._journal.recovered:
+                self.log(f"从检查点恢复 {self._journal.recovered} 条已完成的请求")
+        return self._journal
+    
+    def is_incremental(self) -> bool:
+        """是否启用增量模式（检查点日志在阶段完成后保留为内容哈希清单）"""
+        return self.config.get('checkpoint.enabled', False) and self.config.get('checkpoint.incremental', False)
     
-    def call_api(self, messages, model=None, temperature=0.8):
-        """调用OpenAI API"""
-        return self.generator.call_openai_api(messages, model, temperature)
+    def should_skip(self, output_path: str) -> bool:
+        """
+        判断输出文件已存在时是否跳过本阶段
+        
+        增量模式下不跳过：重新核对全部输入，未变化的条目直接使用清单中的响应
+        """
+        if not os.path.exists(output_path):
+            return False
+        if self.is_incremental():
+            self.log(f"增量模式：输出文件已存在，仅为变化的条目重新生成: {output_path}")
+            return False
+        self.log(f"输出文件已存在，跳过处理: {output_path}")
+        return True
+    
+    def complete_journal(self):
+        """阶段完成（最终输出已写出）后删除检查点日志；增量模式下只清理已失效的条目"""
+        if self.is_incremental():
+            if self._journal is not None:
+                stale = self._journal.compact()
+                self.log(f"增量清单: 复用 {self._journal.hits} 条, 新生成 {self._journal.writes} 条, 丢弃失效 {stale} 条")
+                self._journal = None
+            return
+        if self._journal is not None:
+            self._journal.remove()
+            self._journal = None
+        elif os.path.exists(self._get_journal_path()):
+            os.remove(self._get_journal_path())
+    
+    def map_api(self, items: Iterable, build_messages: Callable, model=None, temperature=0.8,
+                desc: str = None, key: Callable = None, validate: Callable = None,
+                prompt_type: str = None) -> Iterator[Tuple[Any, Any]]:
+        """
+        并发调用OpenAI API，按输入顺序产出结果
+        
+        启用检查点时，每条通过校验的响应立即写入检查点日志，重跑时日志中已有的输入项不再请求
+        
+        Args:
+            items: 输入项列表
+            build_messages: 将输入项转换为messages的函数
+            model: 模型名称
+            temperature: 温度参数
+            desc: 进度条描述，为空时不显示进度条
+            key: 计算输入项检查点键的函数，默认按完整请求（输入内容+渲染后的prompt）计算
+            validate: 检查响应能否被本阶段解析的函数，未通过的项按级联和修复配置重新请求
+            prompt_type: 决定结构化输出schema的prompt类型，默认与阶段同名
+        
+        Returns:
+            (item, response) 迭代器，构造prompt或调用API失败时 response 为异常对象
+        """
+        model = model or self.get_model()
+        
+        def build_request(item):
+            return self.build_request(build_messages(item), model, temperature, prompt_type)
+        
+        async def _call(item):
+            return await self._acall(build_request(item), validate, item)
+        
+        journal = self.get_journal()
+        batch_runner = self.generator.batch_runner
+        if batch_runner.is_enabled(self.get_stage()):
+            results = self._map_api_batch(items, build_request, journal, key, validate)
+        elif journal is not None:
+            results = self._map_api_journaled(items, build_request, journal, key, validate)
+        else:
+            results = self.generator.engine.imap(_call, items)
+        if desc:
+            total = len(items) if hasattr(items, '__len__') else None
+            results = tqdm(results, desc=desc, total=total)
+        return results
+    
+    def get_pack_size(self) -> int:
+        """获取本阶段的打包大小，未启用打包时返回1"""
+        if not self.config.get('packing.enabled', False):
+            return 1
+        if self.get_stage() not in (self.config.get('packing.stages') or []):
+            return 1
+        return max(1, int(self.config.get('packing.size', 5)))
+    
+    @staticmethod
+    def format_slots(texts: Iterable[str]) -> str:
+        """将多个输入项格式化为带编号的prompt片段"""
+        return "\n\n".join(f"【{index}】\n{text}" for index, text in enumerate(texts, 1))
+    
+    @staticmethod
+    def split_packed_response(response: str, count: int) -> Dict[int, Any]:
+        """
+        将打包请求的响应按编号拆分
+        
+        Args:
+            response: 形如 {"1": ..., "2": ...} 的JSON响应（也接受按顺序排列的JSON数组）
+            count: 该请求包含的输入项数
+        
+        Returns:
+            编号(从1开始) -> 该项的解析结果，缺失或无法解析的编号不出现在结果中
+        """
+        data = extract_json(response)
+        if isinstance(data, list) and len(data) == count:
+            return {index: value for index, value in enumerate(data, 1)}
+        if not isinstance(data, dict):
+            return {}
+        slots = {}
+        for key, value in data.items():
+            number = re.sub(r'\D', '', str(key))
+            if number and 1 <= int(number) <= count:
+                slots[int(number)] = value
+        return slots
+    
+    def map_api_packed(self, items: Iterable, build_messages: Callable, build_packed_messages: Callable,
+                       validate: Callable = None, model=None, temperature=0.8,
+                       desc: str = None, validate_response: Callable = None,
+                       key: Callable = None) -> Iterator[Tuple[Any, Any]]:
+        """
+        打包模式：每 packing.size 个输入项合并为一个带编号的请求，响应按编号拆回各项
+        
+        编号缺失或未通过校验的项回退为单独请求；本阶段未启用打包时等同于 map_api
+        
+        Args:
+            items: 输入项列表
+            build_messages: 将单个输入项转换为messages的函数
+            build_packed_messages: 将一组输入项转换为messages的函数（prompt中按1..K编号）
+            validate: 检查单项解析结果是否可用的函数
+            model: 模型名称
+            temperature: 温度参数
+            desc: 进度条描述，为空时不显示进度条
+            validate_response: 检查单独请求的响应能否被解析的函数（用于级联升级）
+            key: 计算单个输入项检查点键的函数，一组的键由组内各项的键组合而成；默认按完整请求计算
+        
+        Returns:
+            (item, response) 迭代器；response 为与单独请求格式一致的JSON文本（单项的值为字符串时即该字符串），
+            失败时为异常对象
+        """
+        pack_size = self.get_pack_size()
+        if pack_size <= 1:
+            return self.map_api(items, build_messages, model=model, temperature=temperature, desc=desc,
+                                key=key, validate=validate_response)
+        
+        results = self._iter_packed(items, build_messages, build_packed_messages, validate, pack_size,
+                                    model, temperature, validate_response, key)
+        if desc:
+            total = len(items) if hasattr(items, '__len__') else None
+            results = tqdm(results, desc=desc, total=total)
+        return results
+    
+    def _iter_packed(self, items: Iterable, build_messages: Callable, build_packed_messages: Callable,
+                     validate: Optional[Callable], pack_size: int, model, temperature,
+                     validate_response: Callable = None, key: Callable = None) -> Iterator[Tuple[Any, Any]]:
+        """按组发起打包请求，拆分响应并对失败项回退为单独请求（单独请求可级联升级）"""
+        def chunked():
+            chunk = []
+            for item in items:
+                chunk.append(item)
+                if len(chunk) == pack_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        
+        # 一组的检查点键由打包模板和组内各项的键组成
+        packed_template = self.get_template(f"{self.get_stage()}_packed")
+        chunk_key = (lambda chunk: Journal.make_key([packed_template] + [key(item) for item in chunk])) if key else None
+        for chunk, response in self.map_api(chunked(), build_packed_messages, model=model, temperature=temperature,
+                                            key=chunk_key, prompt_type=f"{self.get_stage()}_packed"):
+            slots = {} if isinstance(response, Exception) else self.split_packed_response(response, len(chunk))
+            results: List[Any] = []
+            for number in range(1, len(chunk) + 1):
+                value = slots.get(number)
+                if value is None or (validate is not None and not validate(value)):
+                    results.append(None)
+                elif isinstance(value, str):
+                    results.append(value)
+                else:
+                    results.append(json.dumps(value, ensure_ascii=False))
+            
+            failed = [item for item, result in zip(chunk, results) if result is None]
+            if failed:
+                self.log(f"打包响应中 {len(failed)}/{len(chunk)} 项未能解析，回退为单独请求")
+                fallback = iter(self.map_api(failed, build_messages, model=model, temperature=temperature,
+                                             key=key, validate=validate_response))
+                results = [next(fallback)[1] if result is None else result for result in results]
+            
+            yield from zip(chunk, results)
+    
+    @staticmethod
+    def _make_item_key(item: Any, request: dict, key: Callable = None) -> str:
+        """计算输入项的检查点键"""
+        return key(item) if key else Journal.make_key(request)
+    
+    def _map_api_journaled(self, items: Iterable, build_request: Callable, journal: Journal,
+                           key: Callable = None, validate: Callable = None) -> Iterator[Tuple[Any, Any]]:
+        """检查点模式：已记录的输入项直接返回日志中的响应，其余并发请求后写入日志"""
+        async def _call(item):
+            request = build_request(item)
+            item_key = self._make_item_key(item, request, key)
+            response = journal.get(item_key)
+            if response is None:
+                response, passed = await self._acall_checked(request, validate, item)
+                # 未通过校验的响应不写入日志，恢复时重新请求
+                if passed:
+                    journal.record(item_key, response)
+            return response
+        
+        return self.generator.engine.imap(_call, items)
+    
+    def _map_api_batch(self, items: Iterable, build_request: Callable, journal: Optional[Journal] = None,
+                       key: Callable = None, validate: Callable = None) -> Iterator[Tuple[Any, Any]]:
+        """批处理模式：一次性渲染全部请求提交给批处理器，再按输入顺序产出结果"""
+        items = list(items)
+        results = [None] * len(items)
+        requests = []
+        indices = []
+        item_keys = {}
+        for index, item in enumerate(items):
+            try:
+                request = build_request(item)
+            except Exception as e:
+                results[index] = e
+                continue
+            if journal is not None:
+                item_keys[index] = self._make_item_key(item, request, key)
+                recorded = journal.get(item_keys[index])
+                if recorded is not None:
+                    results[index] = recorded
+                    continue
+            requests.append(request)
+            indices.append(index)
+        
+        self.log(f"批处理模式：共 {len(requests)} 条请求")
+        batch_results = self.generator.batch_runner.run(self.get_stage(), requests)
+        
+        for request, result in zip(requests, batch_results):
+            if not isinstance(result, Exception):
+                self.record_response(result, model=request.get("model"), batch=True)
+        batch_results = [result if isinstance(result, Exception) or "response_format" not in request
+                         else unwrap_response(result) for request, result in zip(requests, batch_results)]
+        
+        # 未通过校验的项以实时请求升级模型或修复，最终仍未通过的项不写入检查点日志
+        passed = [True] * len(requests)
+        if validate is not None:
+            pending = [(position, request) for position, (request, result) in enumerate(zip(requests, batch_results))
+                       if not isinstance(result, Exception)]
+            
+            async def _check(entry):
+                position, request = entry
+                return await self._check(request, batch_results[position], validate, items[indices[position]])
+            
+            for (position, _), result in self.generator.engine.imap(_check, pending):
+                if isinstance(result, Exception):
+                    passed[position] = False
+                else:
+                    batch_results[position], passed[position] = result
+        
+        for index, result, item_passed in zip(indices, batch_results, passed):
+            results[index] = result
+            if journal is not None and item_passed and not isinstance(result, Exception):
+                journal.record(item_keys[index], result)
+        
+        return iter(zip(items, results))
+    
+    def get_stream(self, name: str) -> Optional[Iterable]:
+        """获取上游阶段的流式数据，未启用流式传递时返回None"""
+        return self.generator.streams.get(name)
+    
+    def emit(self, name: str, item: Any):
+        """流式传递时将一条产出交给下游阶段（下游处理不过来时阻塞）"""
+        stream = self.generator.streams.get(name)
+        if stream is not None:
+            stream.put(item)
     
     def get_prompt(self, prompt_type: str, **kwargs):
-        """获取prompt模板"""
+        """
+        获取prompt模板
+        
+        渲染后离线计算token数并检查是否超出本阶段模型的上下文窗口（预留输出token），
+        超长时按 tokens.oversize 截断最长的参数或抛出 PromptTooLongError；打包prompt总是抛出异常，
+        由打包逻辑回退为单独请求
+        """
         if self.prompt_manager:
-            return self.prompt_manager.get_prompt(prompt_type, **kwargs)
+            prompt = self.prompt_manager.get_prompt(prompt_type, **kwargs)
+            prompt = self._preflight(prompt_type, prompt, kwargs)
+            self._record_prompt_parts(prompt_type, kwargs)
+            return prompt
         else:
             # 如果没有prompt管理器，返回简单的提示
             return f"请为{self.role}生成{prompt_type}类型的数据"
     
-    def limit_data_for_demo(self, data_list: list) -> list:
+    def get_prompt_budget(self) -> int:
+        """单个prompt的token上限：本阶段模型的上下文窗口减去为输出预留的token数"""
+        return self.get_context_window() - self.config.get('tokens.reserve_output_tokens', 1024)
+    
+    def _preflight(self, prompt_type: str, prompt: str, kwargs: dict) -> str:
+        """检查渲染后的prompt长度，必要时截断最长的参数后重新渲染（kwargs 就地更新）"""
+        counter = self.generator.engine.token_counter
+        usage_tracker = self.generator.engine.usage_tracker
+        tokens = counter.count(prompt)
+        budget = self.get_prompt_budget()
+        if tokens > budget:
+            fields = [name for name, value in kwargs.items() if isinstance(value, str) and value]
+            if prompt_type.endswith('_packed') or self.config.get('tokens.oversize', 'truncate') != 'truncate' or not fields:
+                usage_tracker.record_oversize(self.world, self.role, self.get_stage(), 'rejected')
+                raise PromptTooLongError(f"{prompt_type} prompt共 {tokens} tokens，超出上限 {budget}")
+            field = max(fields, key=lambda name: len(kwargs[name]))
+            # 多截掉几个token，抵消截断处前后合并方式的变化
+            keep = counter.count(kwargs[field]) - (tokens - budget) - 8
+            truncated = counter.truncate(kwargs[field], keep) if keep > 0 else ""
+            truncated_prompt = self.prompt_manager.get_prompt(prompt_type, **{**kwargs, field: truncated})
+            truncated_tokens = counter.count(truncated_prompt)
+            if not truncated or truncated_tokens > budget:
+                usage_tracker.record_oversize(self.world, self.role, self.get_stage(), 'rejected')
+                raise PromptTooLongError(f"{prompt_type} prompt共 {tokens} tokens，截断 {field} 后仍超出上限 {budget}")
+            self.log(f"{prompt_type} prompt共 {tokens} tokens，超出上限 {budget}，已截断 {field}", logging.WARNING)
+            usage_tracker.record_oversize(self.world, self.role, self.get_stage(), 'truncated')
+            kwargs[field] = truncated
+            prompt, tokens = truncated_prompt, truncated_tokens
+        usage_tracker.record_prompt_tokens(self.world, self.role, self.get_stage(), prompt_type, tokens)
+        return prompt
+    
+    def _record_prompt_parts(self, prompt_type: str, kwargs: dict):
+        """估计prompt中背景信息、源文本和指令各占的token数，用于用量报告"""
+        counter = self.generator.engine.token_counter
+        general = counter.count(str(kwargs.get('general', '')))
+        source = sum(counter.count(value) for name, value in kwargs.items()
+                     if name != 'general' and isinstance(value, str))
+        instructions = counter.count(self.prompt_manager.get_template(prompt_type))
+        self.generator.engine.usage_tracker.record_prompt_parts(
+            self.world, self.role, self.get_stage(),
+            {'general': general, 'source': source, 'instructions': instructions}
+        )
+    
+    def save_output(self, data: list, output_path: str):
+        """保存阶段输出并记录产出条数"""
+        save_json(data, output_path)
+        self.generator.engine.usage_tracker.record_outputs(self.world, self.role, self.get_stage(), len(data))
+        self.generator.engine.profiler.record_items(self.world, self.role, self.get_stage(), len(data))
+    
+    def get_template(self, prompt_type: str) -> str:
+        """获取未格式化的prompt模板"""
+        if self.prompt_manager:
+            return self.prompt_manager.get_template(prompt_type)
+        return prompt_type
+    
+    def load_wiki_passages(self) -> Iterable:
+        """
+        获取角色的Wiki段落（各处理器共用一份；超大文件为流式读取的迭代器）
+        
+        Returns:
+            Passage 列表或迭代器，读取失败时返回空列表
+        """
+        try:
+            return self.context.passages()
+        except OSError as e:
+            self.log(f"加载Wiki数据失败: {e}", logging.WARNING)
+            return []
+    
+    @staticmethod
+    def describe_count(items: Iterable) -> str:
+        """输入项数量，用于日志（流式读取时数量未知）"""
+        return str(len(items)) if hasattr(items, '__len__') else "未知数量（流式读取）"
+    
+    def load_general(self) -> Optional[str]:
+        """获取角色的通用背景信息（各处理器共用一份），文件不存在时记录日志并返回None"""
+        general = self.context.general
+        if general is None:
+            self.log(f"通用背景信息文件不存在: {self.context.general_path}")
+        return general
+    
+    def load_scenes(self):
+        """
+        获取角色的对话场景（由生成器解析一次后各处理器共用）
+        
+        Returns:
+            SceneStore，读取失败时返回None
+        """
+        try:
+            return self.generator.get_scene_store()
+        except Exception as e:
+            self.log(f"加载对话数据失败: {e}", logging.WARNING)
+            return None
+    
+    def limit_data_for_demo(self, data_list: Iterable) -> Iterable:
         """
         在示例模式下限制数据量
         
         Args:
-            data_list: 原始数据列表
+            data_list: 原始数据列表（流式传递时为迭代器）
             
         Returns:
             限制后的数据列表
@@ -83,6 +690,9 @@ class BaseProcessor(ABC):
             return data_list
         
         max_items = self.config.get('demo_mode.max_items_per_api_call', 2)
+        if not isinstance(data_list, list):
+            # 迭代器只取前 max_items 条，不再继续向上游读取
+            return islice(data_list, max_items)
         limited_data = data_list[:max_items]
         
         if len(data_list) > max_items:
@@ -3,15 +3,11 @@
 从角色背景信息生成聊天问答对
 """
 
-import os
-import json
-import random
-import time
-from tqdm import tqdm
-import re
+import logging
 
 from .base_processor import BaseProcessor
-from utils import load_json, save_json, format_filename, get_file_count
+from json_extract import extract_json, extract_json_objects
+from journal import Journal
 
 
 
@@ -28,19 +24,14 @@ class Chat2QAProcessor(BaseProcessor):
         output_path = self.path_manager.get_output_path("qa", "qa_chat", f"{self.world}_{self.role}_qa_chat.json")
         
         # 检查输出文件是否已存在
-        if os.path.exists(output_path):
-            self.log(f"输出文件已存在，跳过处理: {output_path}")
+        if self.should_skip(output_path):
             return True
         
         # 读取通用背景信息
-        general_path = self.path_manager.get_local_input_path("general", f"general_{self.role}.txt")
-        if not os.path.exists(general_path):
-            self.log(f"通用背景信息文件不存在: {general_path}")
+        general = self.load_general()
+        if general is None:
             return False
         
-        with open(general_path, 'r', encoding='utf-8') as f:
-            general = f.read().strip()
-        
         # 用于存储生成的问答对
         all_qa_pairs = []
         
@@ -51,8 +42,18 @@ class Chat2QAProcessor(BaseProcessor):
         try:
             # 将prompt转换为messages格式
             topics_messages = [{"role": "user", "content": topics_prompt}]
-            topics_response = self.call_api(topics_messages, temperature=0.8)
+            # 主题是随机生成的，记入检查点，重跑时沿用同一批主题（背景信息或模板变化时重新生成）
+            journal = self.get_journal()
+            topics_key = Journal.make_key(topics_messages)
+            recorded = journal.get(topics_key) if journal is not None else None
+            topics_response = recorded
+            if topics_response is None:
+                topics_response = self.call_api(topics_messages, temperature=0.8,
+                                                validate=self._parse_topics_response, prompt_type="chat2qa_topics")
             topics = self._parse_topics_response(topics_response)
+            # 未能解析出主题的响应不记入检查点，重跑时重新生成
+            if journal is not None and recorded is None and topics:
+                journal.record(topics_key, topics_response)
             
             if not topics:
                 self.log("未能生成聊天主题，跳过处理")
@@ -64,40 +65,42 @@ class Chat2QAProcessor(BaseProcessor):
             self.log(f"生成了 {len(topics)} 个聊天主题")
             
         except Exception as e:
-            self.log(f"生成聊天主题时出错: {e}")
+            self.log(f"生成聊天主题时出错: {e}", logging.WARNING)
             return False
         
         # Step 2: 基于每个主题生成问答对
         self.log("基于主题生成问答对...")
         
-        for topic_index, topic in enumerate(tqdm(topics, desc=f"处理 {self.role} 的聊天主题")):
+        def build_messages(topic):
             # 使用完整的prompt模板
             qa_prompt = self.get_prompt("chat2qa", character=self.role, general=general, topic=topic)
-            
-            try:
-                # 将prompt转换为messages格式
-                qa_messages = [{"role": "user", "content": qa_prompt}]
-                qa_response = self.call_api(qa_messages, temperature=0.8)
-                qa_pairs = self._parse_qa_response(qa_response)
-                
-                # 处理每个问答对
-                for qa_pair in qa_pairs:
-                    if "question" in qa_pair and "answer" in qa_pair:
-                        qa_item = {
-                            "question": qa_pair["question"],
-                            "answer": qa_pair["answer"],
-                            "retrieve": ""
-                        }
-                        all_qa_pairs.append(qa_item)
-                
-            except Exception as e:
-                self.log(f"生成问答对时出错: {e}")
+            # 将prompt转换为messages格式
+            return [{"role": "user", "content": qa_prompt}]
+        
+        # 并发调用API生成问答对，结果按主题顺序返回
+        for topic, qa_response in self.map_api(topics, build_messages, temperature=0.8,
+                                               desc=f"处理 {self.role} 的聊天主题",
+                                               validate=self._parse_qa_response):
+            if isinstance(qa_response, Exception):
+                self.log(f"生成问答对时出错: {qa_response}", logging.WARNING)
                 continue
+            
+            qa_pairs = self._parse_qa_response(qa_response)
+            
+            # 处理每个问答对
+            for qa_pair in qa_pairs:
+                if isinstance(qa_pair, dict) and "question" in qa_pair and "answer" in qa_pair:
+                    qa_item = {
+                        "question": qa_pair["question"],
+                        "answer": qa_pair["answer"],
+                        "retrieve": ""
+                    }
+                    all_qa_pairs.append(qa_item)
         
         # 保存问答对数据
         if all_qa_pairs:
             self.log(f"保存聊天问答对数据: {output_path}")
-            save_json(all_qa_pairs, output_path)
+            self.save_output(all_qa_pairs, output_path)
             self.log(f"聊天问答对生成完成，共生成 {len(all_qa_pairs)} 条数据")
         else:
             self.log("未生成任何聊天问答对")
@@ -106,40 +109,18 @@ class Chat2QAProcessor(BaseProcessor):
     
     def _parse_topics_response(self, response: str) -> list:
         """解析API响应中的主题列表"""
-        try:
-            # 尝试提取JSON部分
-            json_content = response
-            if not json_content.startswith('['):
-                json_match = re.search(r'\[\s*".*"\s*\]', json_content, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(0)
-            
-            topics = json.loads(json_content)
-            if isinstance(topics, list):
-                return topics
-            else:
-                return []
-        except Exception as e:
-            self.log(f"解析主题响应失败: {e}")
+        topics = extract_json(response, list)
+        if topics is None:
+            self.log("解析主题响应失败: 未找到JSON数组", logging.WARNING)
             return []
+        return topics
     
     def _parse_qa_response(self, response: str) -> list:
         """解析API响应中的问答对"""
-        try:
-            # 尝试提取JSON部分
-            json_content = response
-            if not json_content.startswith('['):
-                json_match = re.search(r'\[\s*{.*}\s*\]', json_content, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(0)
-            
-            qa_pairs = json.loads(json_content)
-            if isinstance(qa_pairs, list):
-                return qa_pairs
-            else:
-                return []
-        except Exception as e:
-            self.log(f"解析问答对响应失败: {e}")
+        qa_pairs = extract_json_objects(response)
+        if qa_pairs is None:
+            self.log("解析问答对响应失败: 未找到JSON对象数组", logging.WARNING)
             return []
+        return qa_pairs
     
  
\ No newline at end of file
@@ -4,15 +4,10 @@
 """
 
 import os
-import json
-import random
-import time
-from tqdm import tqdm
-import re
-from collections import defaultdict
+import logging
 
 from .base_processor import BaseProcessor
-from utils import load_json, save_json, format_filename, get_file_count
+from json_extract import extract_json
 
 
 
@@ -30,8 +25,7 @@ class Conv2QAProcessor(BaseProcessor):
         output_path = self.path_manager.get_output_path("qa", "qa_conv", f"{self.world}_{self.role}_qa_conv.json")
         
         # 检查输出文件是否已存在
-        if os.path.exists(output_path):
-            self.log(f"输出文件已存在，跳过处理: {output_path}")
+        if self.should_skip(output_path):
             return True
         
         # 检查输入文件是否存在
@@ -41,7 +35,8 @@ class Conv2QAProcessor(BaseProcessor):
         
         # 读取对话数据
         self.log(f"读取对话数据: {conversation_path}")
-        conversation_data = self._load_conversation_data(conversation_path)
+        scene_store = self.load_scenes()
+        conversation_data = scene_store.conversations() if scene_store else []
         
         if not conversation_data:
             self.log("对话数据为空，跳过处理")
@@ -56,101 +51,55 @@ class Conv2QAProcessor(BaseProcessor):
         # 在示例模式下限制对话场景数量
         conversation_data = self.limit_data_for_demo(conversation_data)
         
-        for scene_id, conversation in enumerate(tqdm(conversation_data, desc=f"处理 {self.role} 的对话")):
-            if not conversation:
-                continue
-            
+        # 保留原始场景编号，过滤空对话
+        scenes = [(scene_id, conversation) for scene_id, conversation in enumerate(conversation_data) if conversation]
+        
+        def build_messages(scene):
+            scene_id, conversation = scene
             # 使用完整的prompt模板
             prompt = self.get_prompt("conv2qa", role=self.role, scene_id=scene_id, roles=", ".join([self.role]), content=conversation)
-            
-            # 调用API生成问答对
-            try:
-                # 将prompt转换为messages格式
-                messages = [{"role": "user", "content": prompt}]
-                response = self.call_api(messages, temperature=0.8)
-                qa_pair = self._parse_qa_response(response)
-                
-                # 处理问答对
-                if qa_pair and "question" in qa_pair and "answer" in qa_pair:
-                    qa_item = {
-                        "question": qa_pair["question"],
-                        "answer": qa_pair["answer"]
-                    }
-                    all_qa_pairs.append(qa_item)
-                
-            except Exception as e:
-                self.log(f"生成问答对时出错: {e}")
+            # 将prompt转换为messages格式
+            return [{"role": "user", "content": prompt}]
+        
+        def build_packed_messages(scenes):
+            # 多个场景按编号合并为一个请求
+            conversations = [conversation for _, conversation in scenes]
+            prompt = self.get_prompt("conv2qa_packed", role=self.role, count=len(scenes), items=self.format_slots(conversations))
+            return [{"role": "user", "content": prompt}]
+        
+        # 并发调用API生成问答对，结果按场景顺序返回（启用打包时每个请求包含多个场景）
+        for scene, response in self.map_api_packed(scenes, build_messages, build_packed_messages,
+                                                    validate=lambda value: isinstance(value, dict) and "question" in value and "answer" in value,
+                                                    temperature=0.8, desc=f"处理 {self.role} 的对话",
+                                                    validate_response=self._parse_qa_response):
+            if isinstance(response, Exception):
+                self.log(f"生成问答对时出错: {response}", logging.WARNING)
                 continue
+            
+            qa_pair = self._parse_qa_response(response)
+            
+            # 处理问答对
+            if qa_pair and "question" in qa_pair and "answer" in qa_pair:
+                qa_item = {
+                    "question": qa_pair["question"],
+                    "answer": qa_pair["answer"]
+                }
+                all_qa_pairs.append(qa_item)
         
         # 保存问答对数据
         if all_qa_pairs:
             self.log(f"保存对话问答对数据: {output_path}")
-            save_json(all_qa_pairs, output_path)
+            self.save_output(all_qa_pairs, output_path)
             self.log(f"对话问答对生成完成，共生成 {len(all_qa_pairs)} 条数据")
         else:
             self.log("未生成任何对话问答对")
         
         return True
     
-    def _load_conversation_data(self, file_path: str) -> list:
-        """加载对话数据并按场景重组"""
-        # 按scene_id分组对话
-        scene_conversations = defaultdict(list)
-        
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        data = json.loads(line)
-                        scene_id = data.get('scene_id', 0)
-                        role = data.get('role', '')
-                        content = data.get('content', '')
-                        
-                        if content:
-                            scene_conversations[scene_id].append({
-                                'role': role,
-                                'content': content
-                            })
-        except Exception as e:
-            self.log(f"加载对话数据失败: {e}")
-            return []
-        
-        # 将每个场景的对话组合成完整对话文本
-        conversations = []
-        for scene_id in sorted(scene_conversations.keys()):
-            scene_data = scene_conversations[scene_id]
-            
-            # 组合对话内容
-            conversation_text = ""
-            for item in scene_data:
-                role = item['role']
-                content = item['content']
-                conversation_text += f"{role}: {content}\n"
-            
-            if conversation_text.strip():
-                conversations.append(conversation_text.strip())
-        
-        return conversations
-    
     def _parse_qa_response(self, response: str) -> dict:
-        """解析API响应中的问答对"""
-        try:
-            # 直接输出API响应用于调试
-            self.log(f"API响应内容: {response}")
-            
-            # 尝试提取JSON部分
-            json_content = response
-            if not json_content.startswith('{'):
-                json_match = re.search(r'\{.*\}', json_content, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(0)
-            
-            qa_pair = json.loads(json_content)
-            if isinstance(qa_pair, dict):
-                return qa_pair
-            else:
-                return {}
-        except Exception as e:
-            self.log(f"解析问答对响应失败: {e}")
-            self.log(f"原始响应: {response}")
-            return {} 
\ No newline at end of file
+        """解析API响应中的问答对，无法解析时返回None"""
+        qa_pair = extract_json(response, dict)
+        if qa_pair is None:
+            self.log("解析问答对响应失败: 未找到JSON对象", logging.WARNING)
+            return None
+        return qa_pair 
\ No newline at end of file
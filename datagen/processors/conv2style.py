@@ -4,13 +4,11 @@
 """
 
 import os
-import json
+import logging
 import random
-from tqdm import tqdm
-from collections import defaultdict
 
 from .base_processor import BaseProcessor
-from utils import load_json, save_json, format_filename, get_file_count
+from journal import Journal
 
 
 
@@ -28,8 +26,7 @@ class Conv2StyleProcessor(BaseProcessor):
         output_path = self.path_manager.get_style_path(self.world, self.role)
         
         # 检查输出文件是否已存在
-        if os.path.exists(output_path):
-            self.log(f"输出文件已存在，跳过处理: {output_path}")
+        if self.should_skip(output_path):
             return True
         
         # 检查输入文件是否存在
@@ -39,9 +36,9 @@ class Conv2StyleProcessor(BaseProcessor):
         
         # 读取对话数据
         self.log(f"读取对话数据: {conversation_path}")
-        conversation_data = self._load_conversation_data(conversation_path)
+        scene_store = self.load_scenes()
         
-        if not conversation_data:
+        if not scene_store or not scene_store.scene_ids:
             self.log("对话数据为空，跳过处理")
             return True
         
@@ -49,115 +46,72 @@ class Conv2StyleProcessor(BaseProcessor):
         style_transfer_data = []
         
         # 从对话中生成风格迁移数据
-        self.log(f"开始生成风格迁移数据，共 {len(conversation_data)} 个对话场景...")
+        self.log(f"开始生成风格迁移数据，共 {len(scene_store.scene_ids)} 个对话场景...")
         
         # 在示例模式下限制对话场景数量
-        conversation_data = self.limit_data_for_demo(conversation_data)
-        
-        for scene_id, conversation in enumerate(tqdm(conversation_data, desc=f"处理 {self.role} 的对话")):
-            if not conversation:
+        scene_ids = self.limit_data_for_demo(scene_store.scene_ids)
+        
+        # 按说话人索引提取该角色在对话中的回答，并为每条回答选定错误风格
+        broken_styles = ["书面语", "翻译腔", "去情绪化"]
+        requests = [(response.strip(), random.choice(broken_styles))
+                    for response in scene_store.utterances(self._is_target_role, scene_ids) if response.strip()]
+        
+        def build_messages(request):
+            response, broken_style = request
+            # 使用完整的prompt模板
+            prompt = self.get_prompt("conv2style", role=self.role, input_data="", chosen=response, broken_style=broken_style)
+            # 将prompt转换为messages格式
+            return [{"role": "user", "content": prompt}]
+        
+        def build_packed_messages(requests):
+            # 多条回答连同各自的错误风格按编号合并为一个请求
+            items = [f"错误风格：{broken_style}\n原句：{response}" if self.config.get('language', 'zh') == 'zh'
+                     else f"Broken style: {broken_style}\nOriginal: {response}" for response, broken_style in requests]
+            prompt = self.get_prompt("conv2style_packed", role=self.role, count=len(requests), items=self.format_slots(items))
+            return [{"role": "user", "content": prompt}]
+        
+        # 并发调用API生成错误风格的回答，结果按回答顺序返回（启用打包时每个请求包含多条回答，
+        # 编号对不上的回答回退为单独请求）
+        # 错误风格是随机选取的，检查点只按原回答和prompt模板识别
+        template = self.get_template("conv2style")
+        for (response, broken_style), rejected_response in self.map_api_packed(requests, build_messages, build_packed_messages,
+                                                                               validate=lambda value: isinstance(value, str) and bool(value.strip()),
+                                                                               temperature=0.8, desc=f"处理 {self.role} 的对话",
+                                                                               validate_response=str.strip,
+                                                                               key=lambda request: Journal.make_key([template, request[0]])):
+            if isinstance(rejected_response, Exception):
+                self.log(f"生成风格迁移数据时出错: {rejected_response}", logging.WARNING)
                 continue
             
-            # 提取该角色在对话中的回答
-            role_responses = self._extract_role_responses(conversation)
+            # 清理响应，移除"- rejected:"前缀
+            rejected_response = rejected_response.strip()
+            if rejected_response.startswith('- rejected:'):
+                rejected_response = rejected_response[len('- rejected:'):].strip()
+            if rejected_response.startswith('"'):
+                rejected_response = rejected_response[1:]
+            if rejected_response.endswith('"'):
+                rejected_response = rejected_response[:-1]
             
-            for response in role_responses:
-                # 生成错误的风格回答
-                try:
-                    # 使用完整的prompt模板
-                    broken_styles = ["书面语", "翻译腔", "去情绪化"]
-                    broken_style = random.choice(broken_styles)
-                    prompt = self.get_prompt("conv2style", role=self.role, input_data="", chosen=response, broken_style=broken_style)
-                    
-                    # 将prompt转换为messages格式
-                    messages = [{"role": "user", "content": prompt}]
-                    rejected_response = self.call_api(messages, temperature=0.8)
-                    
-                    # 清理响应，移除"- rejected:"前缀
-                    rejected_response = rejected_response.strip()
-                    if rejected_response.startswith('- rejected:'):
-                        rejected_response = rejected_response[len('- rejected:'):].strip()
-                    if rejected_response.startswith('"'):
-                        rejected_response = rejected_response[1:]
-                    if rejected_response.endswith('"'):
-                        rejected_response = rejected_response[:-1]
-                    
-                    # 构造风格迁移数据
-                    style_item = {
-                        "system": "你是一个语言改写助手，将这段语句转换为扮演人物的说话语气",
-                        "instruction": f"你正在扮演{self.role}，你需要将下面的句子转写成{self.role}的口吻",
-                        "input": rejected_response,
-                        "output": response
-                    }
-                    style_transfer_data.append(style_item)
-                    
-                except Exception as e:
-                    self.log(f"生成风格迁移数据时出错: {e}")
-                    continue
+            # 构造风格迁移数据
+            style_item = {
+                "system": "你是一个语言改写助手，将这段语句转换为扮演人物的说话语气",
+                "instruction": f"你正在扮演{self.role}，你需要将下面的句子转写成{self.role}的口吻",
+                "input": rejected_response,
+                "output": response
+            }
+            style_transfer_data.append(style_item)
         
         # 保存风格迁移数据
         if style_transfer_data:
             self.log(f"保存风格迁移数据: {output_path}")
-            save_json(style_transfer_data, output_path)
+            self.save_output(style_transfer_data, output_path)
             self.log(f"风格迁移数据生成完成，共生成 {len(style_transfer_data)} 条数据")
         else:
             self.log("未生成任何风格迁移数据")
         
         return True
     
-    def _load_conversation_data(self, file_path: str) -> list:
-        """加载对话数据并按场景重组"""
-        # 按scene_id分组对话
-        scene_conversations = defaultdict(list)
-        
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        data = json.loads(line)
-                        scene_id = data.get('scene_id', 0)
-                        role = data.get('role', '')
-                        content = data.get('content', '')
-                        
-                        if content:
-                            scene_conversations[scene_id].append({
-                                'role': role,
-                                'content': content
-                            })
-        except Exception as e:
-            self.log(f"加载对话数据失败: {e}")
-            return []
-        
-        # 将每个场景的对话组合成完整对话文本
-        conversations = []
-        for scene_id in sorted(scene_conversations.keys()):
-            scene_data = scene_conversations[scene_id]
-            
-            # 组合对话内容
-            conversation_text = ""
-            for item in scene_data:
-                role = item['role']
-                content = item['content']
-                conversation_text += f"{role}: {content}\n"
-            
-            if conversation_text.strip():
-                conversations.append(conversation_text.strip())
-        
-        return conversations
-    
-    def _extract_role_responses(self, conversation: str) -> list:
-        """从对话中提取指定角色的回答"""
-        responses = []
-        lines = conversation.split('\n')
-        
-        for line in lines:
-            if line.strip() and ':' in line:
-                role_part, content_part = line.split(':', 1)
-                role = role_part.strip()
-                content = content_part.strip()
-                
-                # 检查是否是目标角色（支持角色名称包含目标角色名的情况）
-                if self.role in role or role in self.role:
-                    responses.append(content)
-        
-        return responses 
\ No newline at end of file
+    def _is_target_role(self, speaker: str) -> bool:
+        """检查说话人是否是目标角色（支持角色名称包含目标角色名的情况）"""
+        speaker = speaker.strip()
+        return self.role in speaker or speaker in self.role
@@ -4,14 +4,11 @@
 """
 
 import os
-import json
-import random
-import time
-from tqdm import tqdm
-import re
+import logging
+from collections import Counter, defaultdict
+from typing import List, Optional
 
 from .base_processor import BaseProcessor
-from utils import load_json, save_json, format_filename, get_file_count
 
 
 
@@ -29,8 +26,7 @@ class Conv2SummaryProcessor(BaseProcessor):
         output_path = self.path_manager.get_output_path("process", "summary", f"{self.world}_{self.role}_summary.json")
         
         # 检查输出文件是否已存在
-        if os.path.exists(output_path):
-            self.log(f"输出文件已存在，跳过处理: {output_path}")
+        if self.should_skip(output_path):
             return True
         
         # 检查输入文件是否存在
@@ -40,64 +36,165 @@ class Conv2SummaryProcessor(BaseProcessor):
         
         # 读取对话数据
         self.log(f"读取对话数据: {conversation_path}")
-        conversation_data = self._load_conversation_data(conversation_path)
+        scene_store = self.load_scenes()
+        conversation_data = scene_store.records if scene_store else []
         
         if not conversation_data:
             self.log("对话数据为空，跳过处理")
             return True
         
-        # 用于存储生成的摘要
-        all_summaries = []
-        
         # 从对话中生成摘要
         self.log(f"开始生成摘要，共 {len(conversation_data)} 个对话场景...")
         
         # 在示例模式下限制对话场景数量
         conversation_data = self.limit_data_for_demo(conversation_data)
         
-        for scene_id, conversation in enumerate(tqdm(conversation_data, desc=f"处理 {self.role} 的对话")):
-            if not conversation:
+        # 保留原始场景编号，过滤空对话
+        scenes = [(scene_id, conversation) for scene_id, conversation in enumerate(conversation_data) if conversation]
+        
+        # 超过token预算的长场景分块并发摘要后再合并，其余场景整体请求
+        chunk_tokens = self.get_chunk_tokens()
+        requests = []
+        for index, (scene_id, conversation) in enumerate(scenes):
+            chunks = self._split_scene(conversation, chunk_tokens)
+            if chunks is None:
+                requests.append((index, None, None))
+            else:
+                requests.extend((index, part, chunk) for part, chunk in enumerate(chunks, 1))
+        chunk_counts = Counter(index for index, part, _ in requests if part is not None)
+        if chunk_counts:
+            self.log(f"{len(chunk_counts)} 个场景超过 {chunk_tokens} token，分为 {sum(chunk_counts.values())} 块摘要后合并")
+        
+        def build_messages(request):
+            index, part, chunk = request
+            scene_id, conversation = scenes[index]
+            roles = ", ".join([self.role])
+            if part is None:
+                # 使用完整的prompt模板
+                prompt = self.get_prompt("conv2summary", role=self.role, scene_id=scene_id, roles=roles, content=conversation)
+            else:
+                prompt = self.get_prompt("conv2summary_chunk", scene_id=scene_id, roles=roles, part=part,
+                                         total=chunk_counts[index], content=chunk)
+            # 将prompt转换为messages格式
+            return [{"role": "user", "content": prompt}]
+        
+        # 场景索引 -> 摘要数据，长场景为各块的概括
+        results = {}
+        partials = defaultdict(dict)
+        
+        def add_summary(index, summary):
+            summary_item = {
+                "conversation": scenes[index][1],
+                "summary": summary
+            }
+            results[index] = summary_item
+            self.emit("summary", summary_item)
+        
+        # 并发调用API生成摘要（含长场景各块的概括），结果按请求顺序返回
+        for (index, part, _), response in self.map_api(requests, build_messages, temperature=0.8,
+                                                       desc=f"处理 {self.role} 的对话",
+                                                       validate=str.strip):
+            if isinstance(response, Exception):
+                self.log(f"生成摘要时出错: {response}", logging.WARNING)
                 continue
             
-            # 使用完整的prompt模板
-            prompt = self.get_prompt("conv2summary", role=self.role, scene_id=scene_id, roles=", ".join([self.role]), content=conversation)
+            summary = response.strip()
             
-            # 调用API生成摘要
-            try:
-                # 将prompt转换为messages格式
-                messages = [{"role": "user", "content": prompt}]
-                response = self.call_api(messages, temperature=0.8)
-                summary = response.strip()
-                
-                if summary:
-                    summary_item = {
-                        "conversation": conversation,
-                        "summary": summary
-                    }
-                    all_summaries.append(summary_item)
-                
-            except Exception as e:
-                self.log(f"生成摘要时出错: {e}")
-                continue
+            if summary and part is None:
+                add_summary(index, summary)
+            elif summary:
+                partials[index][part] = summary
+        
+        # 合并长场景各块的概括（有块失败的场景跳过）
+        merges = [index for index in sorted(partials) if len(partials[index]) == chunk_counts[index]]
+        if len(merges) < len(partials):
+            self.log(f"{len(partials) - len(merges)} 个长场景有分块摘要失败，跳过合并", logging.WARNING)
+        
+        def build_merge_messages(index):
+            parts = partials[index]
+            prompt = self.get_prompt("conv2summary_reduce", role=self.role, scene_id=scenes[index][0],
+                                     roles=", ".join([self.role]), count=len(parts),
+                                     summaries=self.format_slots(parts[part] for part in sorted(parts)))
+            return [{"role": "user", "content": prompt}]
+        
+        if merges:
+            for index, response in self.map_api(merges, build_merge_messages, temperature=0.8,
+                                                desc=f"合并 {self.role} 的长场景摘要",
+                                                validate=str.strip, prompt_type="conv2summary_reduce"):
+                if isinstance(response, Exception):
+                    self.log(f"合并摘要时出错: {response}", logging.WARNING)
+                    continue
+                if response.strip():
+                    add_summary(index, response.strip())
+        
+        # 用于存储生成的摘要（按场景顺序）
+        all_summaries = [results[index] for index in sorted(results)]
         
         # 保存摘要数据
         if all_summaries:
             self.log(f"保存摘要数据: {output_path}")
-            save_json(all_summaries, output_path)
+            self.save_output(all_summaries, output_path)
             self.log(f"摘要生成完成，共生成 {len(all_summaries)} 个摘要")
         else:
             self.log("未生成任何摘要")
         
         return True
     
-    def _load_conversation_data(self, file_path: str) -> list:
-        """加载对话数据"""
-        data = []
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        data.append(json.loads(line))
-        except Exception as e:
-            self.log(f"加载对话数据失败: {e}")
-        return data 
\ No newline at end of file
+    def get_chunk_tokens(self) -> int:
+        """
+        长场景分块的token预算：不超过本阶段模型上下文窗口的 context_ratio（扣除prompt模板），
+        也不超过 max_chunk_tokens；未启用分块时返回0
+        """
+        if not self.config.get('summary_chunking.enabled', False):
+            return 0
+        budget = int(self.get_context_window() * self.config.get('summary_chunking.context_ratio', 0.5))
+        budget -= self.generator.engine.token_counter.count(self.get_template("conv2summary"))
+        return max(1, min(budget, self.config.get('summary_chunking.max_chunk_tokens', 3000)))
+    
+    def _split_scene(self, conversation, max_tokens: int) -> Optional[List[str]]:
+        """
+        按token预算将场景切分为相邻部分有重叠的若干块，场景未超过预算时返回None
+        
+        按行（发言）切分，单行超过预算时再按字符切分；每块以上一块末尾不超过 overlap_tokens 的行开头
+        """
+        if not max_tokens:
+            return None
+        count = self.generator.engine.token_counter.count
+        # 判断是否超出预算与切分使用同一份 "说话人: 内容" 文本
+        if isinstance(conversation, dict):
+            text = f"{conversation.get('role', '')}: {conversation.get('content', '')}"
+        else:
+            text = str(conversation)
+        if count(text) <= max_tokens:
+            return None
+        overlap_tokens = min(self.config.get('summary_chunking.overlap_tokens', 200), max_tokens // 2)
+        
+        pieces = []
+        for line in text.split('\n'):
+            # 每行多计1个token（换行符）
+            tokens = count(line) + 1
+            if tokens <= max_tokens:
+                pieces.append((line, tokens))
+                continue
+            step = max(1, len(line) * max_tokens // tokens)
+            for start in range(0, len(line), step):
+                piece = line[start:start + step]
+                pieces.append((piece, count(piece) + 1))
+        
+        chunks = []
+        current, size = [], 0
+        for piece, tokens in pieces:
+            if current and size + tokens > max_tokens:
+                chunks.append("\n".join(line for line, _ in current))
+                overlap, overlap_size = [], 0
+                for line, line_tokens in reversed(current):
+                    if overlap_size + line_tokens > overlap_tokens or overlap_size + line_tokens + tokens > max_tokens:
+                        break
+                    overlap.insert(0, (line, line_tokens))
+                    overlap_size += line_tokens
+                current, size = overlap, overlap_size
+            current.append((piece, tokens))
+            size += tokens
+        if current:
+            chunks.append("\n".join(line for line, _ in current))
+        return chunks
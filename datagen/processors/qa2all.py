@@ -0,0 +1,145 @@
+"""
+问答合并处理器
+流式读取角色的全部问答数据（qa/qa_*/ 下的 .json/.jsonl），标注 source_type 并校验字段后
+按k路归并写入 {world}_{role}_qa_{count}.json，供训练/测试集切分使用
+"""
+
+import glob
+import heapq
+import logging
+import os
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .base_processor import BaseProcessor
+from utils import JsonArrayWriter, format_filename, iter_json_items
+
+
+class QA2AllProcessor(BaseProcessor):
+    """问答合并处理器"""
+
+    # 各来源在合并结果中的顺序，未列出的来源按名称排在后面
+    SOURCE_ORDER = ["qa_statement", "qa_summary", "qa_chat", "qa_anti", "qa_conv"]
+
+    # 反例问答按幻觉大类细分 source_type（匹配 hallucination 字段中的关键词，中英文均可）
+    ANTI_SUBTYPES = [
+        ("qa_anti_overreach", ("越界", "overreach")),
+        ("qa_anti_underreach", ("不足", "underreach", "insufficien")),
+        ("qa_anti_induction", ("诱导", "induc")),
+    ]
+
+    def process(self):
+        """合并所有问答数据"""
+        self.log("开始合并问答数据...")
+
+        sources = self._find_sources()
+        if not sources:
+            self.log("未找到任何问答数据，跳过合并", logging.WARNING)
+            return False
+
+        # 输出文件名包含条数，写完后才能确定；已有合并文件且不早于各输入文件时跳过
+        output_dir = self.config.get('paths.all_dir') or self.path_manager.get_output_path("all")
+        existing = self._find_existing(output_dir)
+        if existing and not self.is_incremental():
+            newest_input = max(os.path.getmtime(path) for _, path in sources)
+            if all(os.path.getmtime(path) >= newest_input for path in existing):
+                self.log(f"输出文件已存在，跳过处理: {existing[0]}")
+                return True
+
+        self.log(f"合并 {len(sources)} 个问答文件: {', '.join(source for source, _ in sources)}")
+
+        counts: Counter = Counter()
+        invalid: Counter = Counter()
+        # 写入过程中使用不会被切分阶段匹配到的文件名
+        temp_path = os.path.join(output_dir, f".{self.world}_{self.role}_qa_merging.json")
+        with JsonArrayWriter(temp_path) as writer:
+            for item in self._merge(sources, invalid):
+                writer.write(item)
+                counts[item["source_type"]] += 1
+
+        if invalid:
+            self.log(f"跳过字段不完整的数据: {dict(invalid)}", logging.WARNING)
+        if not writer.count:
+            os.remove(temp_path)
+            self.log("没有可合并的问答数据", logging.WARNING)
+            return False
+
+        # 按条数重命名，并删除旧的合并文件（切分时只读取第一个匹配的文件）
+        output_path = os.path.join(output_dir, format_filename(self.world, self.role, "qa", writer.count))
+        for path in existing:
+            if path != output_path:
+                os.remove(path)
+        os.replace(temp_path, output_path)
+
+        self.generator.engine.usage_tracker.record_outputs(self.world, self.role, self.get_stage(), writer.count)
+        self.generator.engine.profiler.record_items(self.world, self.role, self.get_stage(), writer.count)
+        self.log(f"问答数据合并完成，共 {writer.count} 条: {dict(sorted(counts.items()))}")
+        self.log(f"保存合并数据: {output_path}")
+        return True
+
+    def _find_sources(self) -> List[Tuple[str, str]]:
+        """查找本角色的问答文件，返回按来源排序的 (来源目录名, 文件路径) 列表"""
+        qa_dir = self.path_manager.get_output_path("qa")
+        prefix = glob.escape(f"{self.world}_{self.role}_qa_")
+        paths = glob.glob(os.path.join(glob.escape(qa_dir), "qa_*", f"{prefix}*.json"))
+        paths += glob.glob(os.path.join(glob.escape(qa_dir), "qa_*", f"{prefix}*.jsonl"))
+
+        order = {source: index for index, source in enumerate(self.SOURCE_ORDER)}
+        sources = [(os.path.basename(os.path.dirname(path)), path) for path in paths]
+        return sorted(sources, key=lambda source: (order.get(source[0], len(order)), source[0], source[1]))
+
+    def _find_existing(self, output_dir: str) -> List[str]:
+        """已有的合并文件 {world}_{role}_qa_{count}.json"""
+        pattern = os.path.join(glob.escape(output_dir), glob.escape(f"{self.world}_{self.role}_qa_") + "*.json")
+        return [path for path in glob.glob(pattern)
+                if os.path.basename(path)[len(f"{self.world}_{self.role}_qa_"):-len(".json")].isdigit()]
+
+    def _merge(self, sources: List[Tuple[str, str]], invalid: Counter) -> Iterator[Dict]:
+        """
+        k路归并：各文件按条目序号交替输出（同一序号按来源顺序），
+        每个文件同时只有当前一条在内存中
+        """
+        def numbered(order, source, path):
+            for index, item in enumerate(self._iter_source(source, path, invalid)):
+                yield index, order, item
+        
+        streams = [numbered(order, source, path) for order, (source, path) in enumerate(sources)]
+        for _, _, item in heapq.merge(*streams, key=lambda entry: entry[:2]):
+            yield item
+
+    def _iter_source(self, source: str, path: str, invalid: Counter) -> Iterator[Dict]:
+        """逐条读取一个问答文件，标注 source_type 并校验字段，无效的数据计入 invalid"""
+        try:
+            for item in iter_json_items(path):
+                qa_item = self._normalize(item, source)
+                if qa_item is None:
+                    invalid[source] += 1
+                    continue
+                yield qa_item
+        except (OSError, ValueError) as e:
+            self.log(f"读取问答文件失败，跳过剩余数据: {path} ({e})", logging.WARNING)
+
+    def _normalize(self, item, source: str) -> Optional[Dict]:
+        """转换为 question/answer/retrieve/source_type 格式，问题或回答为空时返回None"""
+        if not isinstance(item, dict):
+            return None
+        question, answer = item.get("question"), item.get("answer")
+        if not isinstance(question, str) or not isinstance(answer, str) or not question.strip() or not answer.strip():
+            return None
+        retrieve = item.get("retrieve") or ""
+        return {
+            "question": question.strip(),
+            "answer": answer.strip(),
+            "retrieve": retrieve if isinstance(retrieve, str) else str(retrieve),
+            "source_type": self._get_source_type(item, source)
+        }
+
+    def _get_source_type(self, item: Dict, source: str) -> str:
+        """来源目录名即 source_type；反例问答按幻觉大类细分，无法识别时为 qa_anti_unknown"""
+        if source != "qa_anti":
+            return source
+        hallucination = str(item.get("hallucination", "")).lower()
+        for source_type, keywords in self.ANTI_SUBTYPES:
+            if any(keyword in hallucination for keyword in keywords):
+                return source_type
+        return "qa_anti_unknown"
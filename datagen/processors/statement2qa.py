@@ -3,14 +3,13 @@
 """
 
 import os
-import json
+import logging
 import random
-import time
-from tqdm import tqdm
-import re
 
 from .base_processor import BaseProcessor
-from utils import load_json, save_json, format_filename, get_file_count
+from journal import Journal
+from json_extract import extract_json_objects
+from utils import load_json
 
 
 
@@ -28,78 +27,92 @@ class Statement2QAProcessor(BaseProcessor):
         output_path = self.path_manager.get_output_path("qa", "qa_statement", f"{self.world}_{self.role}_qa_statement.json")
         
         # 检查输出文件是否已存在
-        if os.path.exists(output_path):
-            self.log(f"输出文件已存在，跳过处理: {output_path}")
+        if self.should_skip(output_path):
             return True
         
-        # 检查输入文件是否存在
-        if not os.path.exists(statement_path):
-            self.log(f"输入文件不存在，跳过处理: {statement_path}")
-            return True
-        
-        # 读取角色陈述数据
-        self.log(f"读取角色陈述数据: {statement_path}")
-        statements_data = load_json(statement_path)
-        
-        if not statements_data:
-            self.log("角色陈述数据为空，跳过处理")
-            return True
+        # 流式传递时边接收上游陈述边处理，否则读取上游写出的文件
+        stream = self.get_stream("statement")
+        if stream is None:
+            # 检查输入文件是否存在
+            if not os.path.exists(statement_path):
+                self.log(f"输入文件不存在，跳过处理: {statement_path}")
+                return True
+            
+            # 读取角色陈述数据
+            self.log(f"读取角色陈述数据: {statement_path}")
+            statements_data = load_json(statement_path)
+            
+            if not statements_data:
+                self.log("角色陈述数据为空，跳过处理")
+                return True
         
         # 读取通用背景信息
-        general_path = self.path_manager.get_local_input_path("general", f"general_{self.role}.txt")
-        if not os.path.exists(general_path):
-            self.log(f"通用背景信息文件不存在: {general_path}")
+        general_info = self.load_general()
+        if general_info is None:
             return False
         
-        with open(general_path, 'r', encoding='utf-8') as f:
-            general_info = f.read().strip()
-        
         # 用于存储生成的问答对
         all_qa_pairs = []
         
-        # 随机打乱陈述顺序以获得多样性
-        all_statements = []
-        for item in statements_data:
-            for statement in item["statements"]:
-                all_statements.append(statement)
-        
-        random.shuffle(all_statements)
-        
-        # 从陈述生成问答对
-        self.log(f"开始生成问答对，共 {len(all_statements)} 个陈述...")
+        if stream is None:
+            # 随机打乱陈述顺序以获得多样性（使用固定种子，重跑时打包分组不变，检查点和响应缓存才能命中）
+            all_statements = []
+            for item in statements_data:
+                for statement in item["statements"]:
+                    all_statements.append(statement)
+            
+            random.Random(self.config.get('generation.random_seed', 42)).shuffle(all_statements)
+            
+            # 从陈述生成问答对
+            self.log(f"开始生成问答对，共 {len(all_statements)} 个陈述...")
+        else:
+            # 流式模式下陈述按到达顺序处理（无法整体打乱）
+            self.log("流式模式：边接收陈述边生成问答对...")
+            all_statements = (statement for item in stream for statement in item["statements"])
         
         # 在示例模式下限制陈述数量
         all_statements = self.limit_data_for_demo(all_statements)
         
-        for statement_index, statement in enumerate(tqdm(all_statements, desc=f"处理 {self.role} 的陈述")):
+        def build_messages(statement):
             # 使用完整的prompt模板
             prompt = self.get_prompt("statement2qa", character=self.role, statement=statement, general=general_info)
-            
-            # 调用API生成问答对
-            try:
-                # 将prompt转换为messages格式
-                messages = [{"role": "user", "content": prompt}]
-                response = self.call_api(messages, temperature=0.8)
-                qa_pairs = self._parse_qa_response(response)
-                
-                # 处理每个问答对
-                for qa_pair in qa_pairs:
-                    if "question" in qa_pair and "answer" in qa_pair:
-                        qa_item = {
-                            "question": qa_pair["question"],
-                            "answer": qa_pair["answer"],
-                            "retrieve": statement
-                        }
-                        all_qa_pairs.append(qa_item)
-                
-            except Exception as e:
-                self.log(f"生成问答对时出错: {e}")
+            # 将prompt转换为messages格式
+            return [{"role": "user", "content": prompt}]
+        
+        def build_packed_messages(statements):
+            # 多条陈述共用一份背景信息，按编号合并为一个请求
+            prompt = self.get_prompt("statement2qa_packed", character=self.role, general=general_info,
+                                     count=len(statements), items=self.format_slots(statements))
+            return [{"role": "user", "content": prompt}]
+        
+        # 并发调用API生成问答对，结果按陈述顺序返回（启用打包时每个请求包含多条陈述）
+        # 检查点按陈述内容识别，打包时一组的键由组内各陈述的键组成
+        template = self.get_template("statement2qa")
+        for statement, response in self.map_api_packed(all_statements, build_messages, build_packed_messages,
+                                                        validate=lambda value: isinstance(value, list) and any(isinstance(qa_pair, dict) for qa_pair in value),
+                                                        temperature=0.8, desc=f"处理 {self.role} 的陈述",
+                                                        validate_response=self._parse_qa_response,
+                                                        key=lambda statement: Journal.make_key([template, general_info, statement])):
+            if isinstance(response, Exception):
+                self.log(f"生成问答对时出错: {response}", logging.WARNING)
                 continue
+            
+            qa_pairs = self._parse_qa_response(response)
+            
+            # 处理每个问答对
+            for qa_pair in qa_pairs:
+                if isinstance(qa_pair, dict) and "question" in qa_pair and "answer" in qa_pair:
+                    qa_item = {
+                        "question": qa_pair["question"],
+                        "answer": qa_pair["answer"],
+                        "retrieve": statement
+                    }
+                    all_qa_pairs.append(qa_item)
         
         # 保存问答对数据
         if all_qa_pairs:
             self.log(f"保存问答对数据: {output_path}")
-            save_json(all_qa_pairs, output_path)
+            self.save_output(all_qa_pairs, output_path)
             self.log(f"问答对生成完成，共生成 {len(all_qa_pairs)} 条数据")
         else:
             self.log("未生成任何问答对")
@@ -108,21 +121,10 @@ class Statement2QAProcessor(BaseProcessor):
     
     def _parse_qa_response(self, response: str) -> list:
         """解析API响应中的问答对"""
-        try:
-            # 尝试提取JSON部分
-            json_content = response
-            if not json_content.startswith('['):
-                json_match = re.search(r'\[\s*{.*}\s*\]', json_content, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(0)
-            
-            qa_pairs = json.loads(json_content)
-            if isinstance(qa_pairs, list):
-                return qa_pairs
-            else:
-                return []
-        except Exception as e:
-            self.log(f"解析问答对响应失败: {e}")
+        qa_pairs = extract_json_objects(response)
+        if qa_pairs is None:
+            self.log("解析问答对响应失败: 未找到JSON对象数组", logging.WARNING)
             return []
+        return qa_pairs
     
  
\ No newline at end of file
@@ -4,14 +4,11 @@
 """
 
 import os
-import json
-import random
-import time
-from tqdm import tqdm
-import re
+import logging
 
 from .base_processor import BaseProcessor
-from utils import load_json, save_json, format_filename, get_file_count
+from json_extract import extract_json
+from utils import load_json
 
 
 
@@ -29,72 +26,84 @@ class Summary2QAProcessor(BaseProcessor):
         output_path = self.path_manager.get_output_path("qa", "qa_summary", f"{self.world}_{self.role}_qa_summary.json")
         
         # 检查输出文件是否已存在
-        if os.path.exists(output_path):
-            self.log(f"输出文件已存在，跳过处理: {output_path}")
+        if self.should_skip(output_path):
             return True
         
-        # 检查输入文件是否存在
-        if not os.path.exists(summary_path):
-            self.log(f"输入文件不存在，跳过处理: {summary_path}")
-            return True
-        
-        # 读取摘要数据
-        self.log(f"读取摘要数据: {summary_path}")
-        summary_data = load_json(summary_path)
-        
-        if not summary_data:
-            self.log("摘要数据为空，跳过处理")
-            return True
+        # 流式传递时边接收上游摘要边处理，否则读取上游写出的文件
+        stream = self.get_stream("summary")
+        if stream is None:
+            # 检查输入文件是否存在
+            if not os.path.exists(summary_path):
+                self.log(f"输入文件不存在，跳过处理: {summary_path}")
+                return True
+            
+            # 读取摘要数据
+            self.log(f"读取摘要数据: {summary_path}")
+            summary_data = load_json(summary_path)
+            
+            if not summary_data:
+                self.log("摘要数据为空，跳过处理")
+                return True
         
         # 读取通用背景信息
-        general_path = self.path_manager.get_local_input_path("general", f"general_{self.role}.txt")
-        if not os.path.exists(general_path):
-            self.log(f"通用背景信息文件不存在: {general_path}")
+        general_info = self.load_general()
+        if general_info is None:
             return False
         
-        with open(general_path, 'r', encoding='utf-8') as f:
-            general_info = f.read().strip()
-        
         # 用于存储生成的问答对
         all_qa_pairs = []
         
         # 从摘要生成问答对
-        self.log(f"开始生成问答对，共 {len(summary_data)} 个摘要...")
+        if stream is None:
+            self.log(f"开始生成问答对，共 {len(summary_data)} 个摘要...")
+        else:
+            self.log("流式模式：边接收摘要边生成问答对...")
+            summary_data = stream
         
         # 在示例模式下限制摘要数量
         summary_data = self.limit_data_for_demo(summary_data)
         
-        for summary_index, summary_item in enumerate(tqdm(summary_data, desc=f"处理 {self.role} 的摘要")):
-            summary = summary_item.get("summary", "")
-            if not summary:
-                continue
-            
+        # 过滤空摘要
+        summaries = (summary_item.get("summary", "") for summary_item in summary_data)
+        summaries = (summary for summary in summaries if summary)
+        if stream is None:
+            summaries = list(summaries)
+        
+        def build_messages(summary):
             # 使用完整的prompt模板
             prompt = self.get_prompt("summary2qa", world=self.world, role=self.role, summary=summary, role_highlight=f"{self.role}在场景中的表现")
-            
-            # 调用API生成问答对
-            try:
-                # 将prompt转换为messages格式
-                messages = [{"role": "user", "content": prompt}]
-                response = self.call_api(messages, temperature=0.8)
-                qa_pair = self._parse_qa_response(response)
-                
-                # 处理问答对
-                if qa_pair and "question" in qa_pair and "answer" in qa_pair:
-                    qa_item = {
-                        "question": qa_pair["question"],
-                        "answer": qa_pair["answer"]
-                    }
-                    all_qa_pairs.append(qa_item)
-                
-            except Exception as e:
-                self.log(f"生成问答对时出错: {e}")
+            # 将prompt转换为messages格式
+            return [{"role": "user", "content": prompt}]
+        
+        def build_packed_messages(summaries):
+            # 多条摘要按编号合并为一个请求
+            prompt = self.get_prompt("summary2qa_packed", world=self.world, role=self.role,
+                                     count=len(summaries), items=self.format_slots(summaries))
+            return [{"role": "user", "content": prompt}]
+        
+        # 并发调用API生成问答对，结果按摘要顺序返回（启用打包时每个请求包含多条摘要）
+        for summary, response in self.map_api_packed(summaries, build_messages, build_packed_messages,
+                                                      validate=lambda value: isinstance(value, dict) and "question" in value and "answer" in value,
+                                                      temperature=0.8, desc=f"处理 {self.role} 的摘要",
+                                                      validate_response=self._parse_qa_response):
+            if isinstance(response, Exception):
+                self.log(f"生成问答对时出错: {response}", logging.WARNING)
                 continue
+            
+            qa_pair = self._parse_qa_response(response)
+            
+            # 处理问答对
+            if qa_pair and "question" in qa_pair and "answer" in qa_pair:
+                qa_item = {
+                    "question": qa_pair["question"],
+                    "answer": qa_pair["answer"]
+                }
+                all_qa_pairs.append(qa_item)
         
         # 保存问答对数据
         if all_qa_pairs:
             self.log(f"保存摘要问答对数据: {output_path}")
-            save_json(all_qa_pairs, output_path)
+            self.save_output(all_qa_pairs, output_path)
             self.log(f"摘要问答对生成完成，共生成 {len(all_qa_pairs)} 条数据")
         else:
             self.log("未生成任何摘要问答对")
@@ -102,21 +111,15 @@ class Summary2QAProcessor(BaseProcessor):
         return True
     
     def _parse_qa_response(self, response: str) -> dict:
-        """解析API响应中的问答对"""
+        """解析API响应中的问答对，无法解析时返回None"""
         try:
-            # 直接输出API响应用于调试
-            self.log(f"API响应内容: {response}")
-            
             # 尝试多种解析方式
             # 首先尝试JSON格式（优先级最高）
-            try:
-                qa_data = json.loads(response)
-                if isinstance(qa_data, dict) and 'question' in qa_data and 'answer' in qa_data:
-                    return qa_data
-                elif isinstance(qa_data, list) and len(qa_data) > 0:
-                    return qa_data[0]
-            except:
-                pass
+            qa_data = extract_json(response)
+            if isinstance(qa_data, dict) and 'question' in qa_data and 'answer' in qa_data:
+                return qa_data
+            elif isinstance(qa_data, list) and len(qa_data) > 0 and isinstance(qa_data[0], dict):
+                return qa_data[0]
             
             # 然后尝试文本格式
             if '问题：' in response and '回答：' in response:
@@ -149,8 +152,7 @@ class Summary2QAProcessor(BaseProcessor):
                 "answer": answer_part
             }
         except Exception as e:
-            self.log(f"解析问答对响应失败: {e}")
-            self.log(f"原始响应: {response}")
-            return {}
+            self.log(f"解析问答对响应失败: {e}", logging.WARNING)
+            return None
     
  
\ No newline at end of file
@@ -3,15 +3,9 @@ Wiki转陈述处理器
 从Wiki段落生成角色陈述
 """
 
-import os
-import json
-import random
-import time
-from tqdm import tqdm
-import re
+import logging
 
 from .base_processor import BaseProcessor
-from utils import load_json, save_json, format_filename, get_file_count
 
 
 
@@ -25,98 +19,76 @@ class Wiki2StatementProcessor(BaseProcessor):
         self.log("开始从Wiki段落生成角色陈述...")
         
         # 输入输出路径
-        wiki_path = self.path_manager.get_local_input_path("wiki", f"wiki_{self.role}.txt")
+        wiki_path = self.context.wiki_path
         output_path = self.path_manager.get_output_path("process", "statement", f"{self.role}_statement.json")
         
         # 检查输出文件是否已存在
-        if os.path.exists(output_path):
-            self.log(f"输出文件已存在，跳过处理: {output_path}")
+        if self.should_skip(output_path):
             return True
         
         # 检查输入文件是否存在
-        if not os.path.exists(wiki_path):
+        if not self.context.has_wiki():
             self.log(f"Wiki文件不存在，跳过处理: {wiki_path}")
             return True
         
-        # 读取Wiki数据
-        wiki_path = self.path_manager.get_local_input_path("wiki", f"wiki_{self.role}.txt")
-        if not os.path.exists(wiki_path):
-            self.log(f"Wiki文件不存在，跳过处理: {wiki_path}")
-            return True
-        
-        with open(wiki_path, 'r', encoding='utf-8') as f:
-            wiki_content = f.read().strip()
+        # 读取Wiki段落（与其他阶段共用）
+        self.log(f"读取Wiki数据: {wiki_path}")
+        wiki_passages = self.load_wiki_passages()
         
-        # 按段落分割Wiki内容
-        wiki_passages = [p.strip() for p in wiki_content.split('\n\n') if p.strip()]
+        if not wiki_passages:
+            self.log("Wiki数据为空，跳过处理")
+            return True
         
         # 在示例模式下限制段落数量
         wiki_passages = self.limit_data_for_demo(wiki_passages)
         
         # 读取通用背景信息
-        general_path = self.path_manager.get_local_input_path("general", f"general_{self.role}.txt")
-        if not os.path.exists(general_path):
-            self.log(f"通用背景信息文件不存在: {general_path}")
+        general_info = self.load_general()
+        if general_info is None:
             return False
         
-        with open(general_path, 'r', encoding='utf-8') as f:
-            general_info = f.read().strip()
-        
         # 用于存储生成的陈述
         all_statements = []
         
         # 从Wiki段落生成陈述
-        self.log(f"开始生成陈述，共 {len(wiki_passages)} 个段落...")
+        self.log(f"开始生成陈述，共 {self.describe_count(wiki_passages)} 个段落...")
+        
+        def build_messages(passage):
+            # 使用完整的prompt模板
+            prompt = self.get_prompt("wiki2statement", character=self.role, passage=passage.text, general=general_info)
+            # 将prompt转换为messages格式
+            return [{"role": "user", "content": prompt}]
         
-        for passage_index, passage in enumerate(tqdm(wiki_passages, desc=f"处理 {self.role} 的Wiki段落")):
-            if not passage.strip():
+        # 并发调用API生成陈述，结果按段落顺序返回
+        for passage, response in self.map_api(wiki_passages, build_messages, temperature=0.8,
+                                               desc=f"处理 {self.role} 的Wiki段落",
+                                               validate=self._parse_statements_response):
+            if isinstance(response, Exception):
+                self.log(f"生成陈述时出错: {str(response)}", logging.WARNING)
+                self.log(f"错误类型: {response.__class__.__name__}", logging.WARNING)
                 continue
             
-            # 使用完整的prompt模板
-            prompt = self.get_prompt("wiki2statement", character=self.role, passage=passage, general=general_info)
+            statements = self._parse_statements_response(response)
             
-            # 调用API生成陈述
-            try:
-                # 将prompt转换为messages格式
-                messages = [{"role": "user", "content": prompt}]
-                response = self.call_api(messages, temperature=0.8)
-                statements = self._parse_statements_response(response)
-                
-                if statements:
-                    statement_item = {
-                        "passage": passage,
-                        "statements": statements
-                    }
-                    all_statements.append(statement_item)
-                
-            except Exception as e:
-                self.log(f"生成陈述时出错: {str(e)}")
-                if hasattr(e, '__class__'):
-                    self.log(f"错误类型: {e.__class__.__name__}")
-                continue
+            if statements:
+                statement_item = {
+                    "passage": passage.text,
+                    "passage_id": passage.id,
+                    "statements": statements
+                }
+                all_statements.append(statement_item)
+                self.emit("statement", statement_item)
         
         # 保存陈述数据
         if all_statements:
             self.log(f"保存陈述数据: {output_path}")
-            save_json(all_statements, output_path)
+            self.save_output(all_statements, output_path)
             self.log(f"陈述生成完成，共生成 {len(all_statements)} 个段落的数据")
         else:
             self.log("未生成任何陈述")
         
         return True
     
-    def _load_wiki_data(self, file_path: str) -> list:
-        """加载Wiki数据"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                # 按段落分割
-                paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
-                return paragraphs
-        except Exception as e:
-            self.log(f"加载Wiki数据失败: {e}")
-            return []
-    
     def _parse_statements_response(self, response: str) -> list:
         """解析API响应中的陈述列表"""
         try:
@@ -131,5 +103,5 @@ class Wiki2StatementProcessor(BaseProcessor):
             
             return statements
         except Exception as e:
-            self.log(f"解析陈述响应失败: {e}")
+            self.log(f"解析陈述响应失败: {e}", logging.WARNING)
             return [] 
\ No newline at end of file
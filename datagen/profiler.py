@@ -0,0 +1,303 @@
+"""
+阶段性能分析模块
+记录各阶段的API延迟、解析耗时、JSON读写耗时的直方图，以及吞吐量、错误数和内存峰值，
+可导出为JSON汇总和Prometheus文本格式，用于对比不同运行之间的性能
+"""
+
+import bisect
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from utils import add_io_observer, remove_io_observer, save_json
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不统计内存峰值
+    resource = None
+
+
+# 延迟直方图的桶上界（秒），与Prometheus默认桶相近并扩展到长耗时的API调用
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """当前进程的内存峰值(MB)，平台不支持时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _escape_label(value) -> str:
+    """转义Prometheus标签值中的反斜杠、引号和换行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """固定桶的耗时直方图"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float, error: bool = False):
+        """记录一次耗时"""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按桶内线性插值估计分位数"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return round(min(lower + (upper - lower) * (rank - seen) / count, self.max), 4)
+            seen += count
+        return round(self.max, 4)
+
+    def to_dict(self) -> Dict:
+        """导出统计信息"""
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'sum_seconds': round(self.sum, 4),
+            'mean': round(self.sum / self.count, 4) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 4)
+        }
+
+
+class Profiler:
+    """线程安全的阶段性能分析器，可在多个角色之间共享"""
+
+    def __init__(self, enabled: bool = True, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        初始化性能分析器
+
+        Args:
+            enabled: 是否启用，未启用时所有记录方法直接返回
+            buckets: 直方图的桶上界（秒）
+        """
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # 当前线程正在运行的 (world, role, stage)，用于归属文件读写耗时
+        self._local = threading.local()
+        # (world, role, stage, metric) -> 直方图
+        self._histograms = defaultdict(lambda: Histogram(self.buckets))
+        # (world, role, stage) -> 阶段运行信息
+        self._stages = {}
+        self._items = defaultdict(int)
+        if enabled:
+            add_io_observer(self.observe_io)
+
+    @classmethod
+    def from_config(cls, config) -> "Profiler":
+        """根据配置创建性能分析器"""
+        return cls(
+            enabled=config.get('profiling.enabled', True),
+            buckets=tuple(config.get('profiling.buckets') or DEFAULT_BUCKETS)
+        )
+
+    def observe(self, world: str, role: str, stage: Optional[str], metric: str, seconds: float,
+                error: bool = False):
+        """
+        记录一次耗时
+
+        Args:
+            world: 世界名称
+            role: 角色名称
+            stage: 阶段名称
+            metric: 耗时类别（api/parse/io_load/io_save）
+            seconds: 耗时秒数
+            error: 该次操作是否失败
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._histograms[(world, role, stage or 'unknown', metric)].observe(seconds, error)
+
+    @contextmanager
+    def timer(self, world: str, role: str, stage: Optional[str], metric: str):
+        """计时上下文，块内抛出异常时记为失败"""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(world, role, stage, metric, time.perf_counter() - start, error)
+
+    def observe_io(self, operation: str, path: str, seconds: float):
+        """文件读写观察者：归属到当前线程正在运行的阶段，阶段之外的读写不记录"""
+        current = getattr(self._local, 'stage', None)
+        if current is not None:
+            self.observe(*current, f"io_{operation}", seconds)
+
+    @contextmanager
+    def track_stage(self, world: str, role: str, stage: str):
+        """
+        跟踪一个阶段的运行：记录耗时和内存峰值，并将块内当前线程的文件读写归属到该阶段
+        """
+        if not self.enabled:
+            yield
+            return
+        previous = getattr(self._local, 'stage', None)
+        self._local.stage = (world, role, stage)
+        rss_before = get_peak_rss_mb()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._local.stage = previous
+            rss_after = get_peak_rss_mb()
+            with self._lock:
+                self._stages[(world, role, stage)] = {
+                    'seconds': round(time.perf_counter() - start, 3),
+                    'peak_rss_mb': rss_after,
+                    'rss_growth_mb': round(rss_after - rss_before, 1) if rss_after is not None else None,
+                    'error': error
+                }
+
+    def record_items(self, world: str, role: str, stage: str, count: int):
+        """记录阶段产出的数据条数，用于计算吞吐量"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._items[(world, role, stage)] += count
+
+    def summary(self, world: str = None, role: str = None) -> Dict:
+        """
+        汇总各阶段的性能数据，可只统计指定世界/角色
+
+        Returns:
+            阶段名 -> {seconds, items, items_per_second, requests_per_second, peak_rss_mb, metrics}
+            多个角色的同名阶段合并统计（耗时取总和，内存峰值取最大值）
+        """
+        def selected(key):
+            return (world is None or key[0] == world) and (role is None or key[1] == role)
+
+        stages = defaultdict(lambda: {'seconds': 0.0, 'items': 0, 'peak_rss_mb': None, 'rss_growth_mb': None,
+                                      'errors': [], 'metrics': {}})
+        with self._lock:
+            merged = defaultdict(lambda: Histogram(self.buckets))
+            for key, histogram in self._histograms.items():
+                if not selected(key):
+                    continue
+                target = merged[(key[2], key[3])]
+                target.counts = [a + b for a, b in zip(target.counts, histogram.counts)]
+                target.count += histogram.count
+                target.errors += histogram.errors
+                target.sum += histogram.sum
+                target.max = max(target.max, histogram.max)
+            for key, info in self._stages.items():
+                if not selected(key):
+                    continue
+                entry = stages[key[2]]
+                entry['seconds'] += info['seconds']
+                for field in ('peak_rss_mb', 'rss_growth_mb'):
+                    if info[field] is not None:
+                        entry[field] = max(entry[field] or 0, info[field])
+                if info['error']:
+                    entry['errors'].append(f"{key[0]}/{key[1]}: {info['error']}")
+            for key, count in self._items.items():
+                if selected(key):
+                    stages[key[2]]['items'] += count
+
+        for (stage, metric), histogram in merged.items():
+            stages[stage]['metrics'][metric] = histogram.to_dict()
+        for entry in stages.values():
+            seconds = entry['seconds']
+            api_calls = entry['metrics'].get('api', {}).get('count', 0)
+            entry['seconds'] = round(seconds, 3)
+            entry['items_per_second'] = round(entry['items'] / seconds, 3) if seconds else None
+            entry['requests_per_second'] = round(api_calls / seconds, 3) if seconds else None
+        return dict(stages)
+
+    def _histogram_snapshot(self, world: str = None, role: str = None) -> List[Tuple[Tuple, Histogram]]:
+        """按键排序取出选中的直方图"""
+        with self._lock:
+            return [
+                (key, histogram) for key, histogram in sorted(self._histograms.items())
+                if (world is None or key[0] == world) and (role is None or key[1] == role)
+            ]
+
+    def to_prometheus(self, world: str = None, role: str = None) -> str:
+        """导出为Prometheus文本格式"""
+        def labels(**values):
+            return ",".join(f'{name}="{_escape_label(value)}"' for name, value in values.items())
+
+        lines = [
+            "# HELP datagen_latency_seconds Latency of API calls, response parsing and JSON I/O per stage.",
+            "# TYPE datagen_latency_seconds histogram"
+        ]
+        errors = []
+        for (key_world, key_role, stage, metric), histogram in self._histogram_snapshot(world, role):
+            base = labels(world=key_world, role=key_role, stage=stage, metric=metric)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(float(bound))
+                lines.append(f'datagen_latency_seconds_bucket{{{base},le="{le}"}} {cumulative}')
+            lines.append(f"datagen_latency_seconds_sum{{{base}}} {histogram.sum:.6f}")
+            lines.append(f"datagen_latency_seconds_count{{{base}}} {histogram.count}")
+            errors.append(f"datagen_errors_total{{{base}}} {histogram.errors}")
+
+        lines += ["# HELP datagen_errors_total Failed operations per stage.", "# TYPE datagen_errors_total counter"]
+        lines += errors
+
+        with self._lock:
+            stage_infos = sorted(self._stages.items())
+            items = dict(self._items)
+        gauges = {'datagen_stage_seconds': [], 'datagen_stage_items_total': [], 'datagen_stage_peak_rss_megabytes': []}
+        for (key_world, key_role, stage), info in stage_infos:
+            if (world is not None and key_world != world) or (role is not None and key_role != role):
+                continue
+            base = labels(world=key_world, role=key_role, stage=stage)
+            gauges['datagen_stage_seconds'].append(f"datagen_stage_seconds{{{base}}} {info['seconds']}")
+            gauges['datagen_stage_items_total'].append(
+                f"datagen_stage_items_total{{{base}}} {items.get((key_world, key_role, stage), 0)}")
+            if info['peak_rss_mb'] is not None:
+                gauges['datagen_stage_peak_rss_megabytes'].append(
+                    f"datagen_stage_peak_rss_megabytes{{{base}}} {info['peak_rss_mb']}")
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+    def save_report(self, path: str, world: str = None, role: str = None) -> Dict:
+        """保存JSON汇总，并在同目录写出同名的 .prom 文件"""
+        report = self.summary(world, role)
+        save_json(report, path)
+        with open(f"{path.rsplit('.', 1)[0]}.prom", 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus(world, role))
+        return report
+
+    def close(self):
+        """停止记录文件读写"""
+        remove_io_observer(self.observe_io)
@@ -2,9 +2,32 @@
 Prompt模板管理器
 """
 
+import threading
+
+
+_shared_managers = {}
+_shared_lock = threading.Lock()
+
+
+def get_prompt_manager(language: str = 'zh') -> "PromptManager":
+    """
+    获取指定语言的共享Prompt管理器（同一进程内每种语言只创建一次）
+    
+    Args:
+        language: 语言类型，'zh'为中文，'en'为英文
+    """
+    with _shared_lock:
+        if language not in _shared_managers:
+            _shared_managers[language] = PromptManager(language)
+        return _shared_managers[language]
+
+
 class PromptManager:
     """Prompt管理器"""
     
+    # prompt模板版本，修改模板或解析逻辑后递增，使旧的响应缓存失效
+    PROMPT_VERSION = "1"
+    
     def __init__(self, language='zh'):
         """
         初始化Prompt管理器
@@ -77,6 +100,40 @@ class PromptManager:
     }}
 ]''',
             
+            'statement2qa_packed': '''已知关于{character}的背景信息：
+
+{general}
+
+下面是{count}条带编号的角色陈述：
+
+{items}
+
+你需要分别针对每条陈述询问一些关于{character}的问题，这些问题需要包含该条陈述中的信息。无需涉及背景信息，只需确保不矛盾。
+
+每条陈述提供1到3个多样且简洁的问题-回答对。这些问题将谈话对象视为{character}，且不包含名字；回答者以{character}的身份回答。
+
+输出一个json对象，键为陈述编号，值为该条陈述对应的问题-回答对数组，必须包含全部{count}个编号。严格遵循示例中的格式，不需要多余分析，避免诸如"以下是答案："之类的陈述。
+
+示例输出格式：
+{{
+    "1": [
+        {{
+            "question": "问题1",
+            "answer": "回答1"
+        }},
+        {{
+            "question": "问题2",
+            "answer": "回答2"
+        }}
+    ],
+    "2": [
+        {{
+            "question": "问题1",
+            "answer": "回答1"
+        }}
+    ]
+}}''',
+            
             'conv2summary': '''请为以下电视剧场景生成简洁摘要，仅保留核心情节和角色互动：
 
 场景编号: {scene_id}
@@ -88,6 +145,30 @@ class PromptManager:
 
 输出格式使用json，包含两个字段：summary和role_highlight，不要有多余输出。
 
+【示例输出】
+{{
+    "summary": "场景摘要",
+    "role_highlight": "{role}在场景中的表现"
+}}''',
+            
+            'conv2summary_chunk': '''下面是电视剧场景{scene_id}按顺序分成{total}部分后的第{part}部分（相邻部分有少量重叠）。请概括这一部分的情节、角色互动和关键信息，之后会与其他部分的概括合并为完整的场景摘要：
+
+参与角色: {roles}
+场景内容（第{part}/{total}部分）:
+{content}
+
+请用50-100字概括，注意重要关键信息、情感变化和角色动机，不要使用代词，直接使用姓名，只输出概括内容。''',
+            
+            'conv2summary_reduce': '''下面是电视剧场景{scene_id}按顺序分成{count}部分后各部分的概括（相邻部分有少量重叠，重复的内容只算一次）：
+
+{summaries}
+
+参与角色: {roles}
+
+请将这些概括合并为此场景的简洁摘要，仅保留核心情节和角色互动。请用50-100字总结此场景的核心情节，注意重要关键信息、情感变化和角色动机，但不要有任何发散，特别不要使用"揭示"、"暗示"、"体现"等词汇。注意不要使用代词，直接使用姓名。
+
+输出格式使用json，包含两个字段：summary和role_highlight，不要有多余输出。
+
 【示例输出】
 {{
     "summary": "场景摘要",
@@ -113,6 +194,31 @@ class PromptManager:
     "answer": "回答"
 }}''',
             
+            'summary2qa_packed': '''你正在扮演电视剧{world}中的"{role}"角色。下面是{count}条带编号的场景摘要，请分别为每条摘要创建一个问题和回答对。
+
+{items}
+
+要求：
+1. 问题应该是对"{role}"角色本人在该场景中行为、感受或想法的提问
+2. 这段对话没有上下文，所以问题需要给出一些提示，让角色能够回想起当前讨论的是哪件事。不能简单地说"在这个场景中"类似的话
+3. 回答应该站在"{role}"的角度，以第一人称语态回答，展现该角色的个性和情感
+4. 回答中应包含场景相关的细节，且表现角色特点，不要虚构内容
+5. 回答长度约30-50字
+
+输出一个json对象，键为摘要编号，值为包含question和answer两个字段的对象，必须包含全部{count}个编号，不要有多余输出。
+
+【示例输出】
+{{
+    "1": {{
+        "question": "问题",
+        "answer": "回答"
+    }},
+    "2": {{
+        "question": "问题",
+        "answer": "回答"
+    }}
+}}''',
+            
             'chat2qa_topics': '''已知关于{character}的背景信息：
 
 {general}
@@ -229,6 +335,26 @@ class PromptManager:
     "answer": ""
 }}''',
             
+            'conv2qa_packed': '''我正在进行角色扮演，你需要帮助我生成数据集。下面是{count}个带编号的电视剧场景，请分别为每个场景生成一个问答对，要求：
+1. 问答对的回答方是{role}，这个回答的具体内容需要尽可能符合{role}的说话语气，可以对场景中{role}的台词进行少量修改作为回答。
+2. 问答对的提问方是用户。提问的问题需要和回答内容相配合。
+3. 输出一个json对象，键为场景的序号，值为包含question和answer两个字段的对象，必须包含全部{count}个序号，不要有多余输出。
+
+【电视剧场景】
+{items}
+
+【示例输出】
+{{
+    "1": {{
+        "question": "",
+        "answer": ""
+    }},
+    "2": {{
+        "question": "",
+        "answer": ""
+    }}
+}}''',
+            
             'conv2style': '''历史对话：{input_data}, correct answer: {chosen}.
 
 Referring to the correct answer, provide another answer (rejected) with a tone obviously different from {role}'s.
@@ -237,7 +363,25 @@ No analysis is needed, avoid statements like "Here's the answer:".
 
 Example output format:
 
-- rejected: answer'''
+- rejected: answer''',
+            
+            'conv2style_packed': '''下面是{count}条带编号的{role}的原句（correct answer），每条注明了要改写成的错误风格。
+
+{items}
+
+请参照每条原句，分别提供另一个回答（rejected）：语气与{role}明显不同，按该条注明的风格改写，但保持与原句相同的意思。不需要分析，不要有"以下是回答："之类的表述。
+
+输出一个json对象，键为原句编号，值为改写后的句子，必须包含全部{count}个编号，不要有多余输出。
+
+【示例输出】
+{{
+    "1": "改写后的句子",
+    "2": "改写后的句子"
+}}''',
+            
+            'structured_output': '''请以JSON对象输出，不要输出JSON以外的内容。若要求的格式是数组，请将数组放在对象的 items 字段中。''',
+            
+            'repair': '''上面的回答无法按要求的格式解析。请严格按照原要求中的示例格式重新输出完整的结果，不要有任何解释或多余文字。'''
         }
     
     def _get_english_prompts(self):
@@ -293,6 +437,36 @@ Example output format:
     "answer": "Answer 3"
 }}]''',
             
+            'statement2qa_packed': '''Given the following background information about {character}:
+
+{general}
+
+Below are {count} numbered character statements:
+
+{items}
+
+For each statement separately, you need to ask some questions about {character} that require responses containing information from that statement. No need to involve background information, just ensure no contradiction.
+
+Provide 1 to 3 diverse and concise question-answer pairs for each statement. These questions treat the conversation partner as {character} without mentioning the name; the responder answers as {character}.
+
+Output a json object whose keys are the statement numbers and whose values are the question-answer pair arrays for that statement, covering all {count} numbers. Strictly follow the example format, no extra analysis needed, avoid statements like "Here are the answers:".
+
+Example output format:
+{{
+    "1": [{{
+        "question": "Question 1",
+        "answer": "Answer 1"
+    }},
+    {{
+        "question": "Question 2",
+        "answer": "Answer 2"
+    }}],
+    "2": [{{
+        "question": "Question 1",
+        "answer": "Answer 1"
+    }}]
+}}''',
+            
             'conv2summary': '''Please generate a concise summary for the following scene, keeping only the core plot and character interactions:
 
 Scene ID: {scene_id}
@@ -304,6 +478,30 @@ Please use 50-100 words to summarize the core plot of this scene, paying attenti
 
 Output format uses json, containing two fields: summary and role_highlight, no extra output.
 
+【Example Output】
+{{
+    "summary": "Scene summary",
+    "role_highlight": "{role}'s performance in the scene"
+}}''',
+            
+            'conv2summary_chunk': '''Below is part {part} of {total} of scene {scene_id}, split in order (adjacent parts overlap slightly). Please summarize the plot, character interactions and key information of this part; it will later be merged with the summaries of the other parts into a complete scene summary:
+
+Participating roles: {roles}
+Scene content (part {part}/{total}):
+{content}
+
+Please use 50-100 words, paying attention to important key information, emotional changes and character motivations. Do not use pronouns, use names directly, and output only the summary.''',
+            
+            'conv2summary_reduce': '''Below are the summaries of the {count} parts of scene {scene_id}, in order (adjacent parts overlap slightly, count repeated content only once):
+
+{summaries}
+
+Participating roles: {roles}
+
+Please merge these summaries into a concise summary of the scene, keeping only the core plot and character interactions. Please use 50-100 words to summarize the core plot of this scene, paying attention to important key information, emotional changes and character motivations, but don't have any divergence, especially don't use words like "reveal", "imply", "embody", etc. Pay attention not to use pronouns, use names directly everywhere.
+
+Output format uses json, containing two fields: summary and role_highlight, no extra output.
+
 【Example Output】
 {{
     "summary": "Scene summary",
@@ -329,6 +527,31 @@ Output format uses json, containing two fields: question and answer, no extra ou
     "answer": "Answer"
 }}''',
             
+            'summary2qa_packed': '''You are playing the role of "{role}" in the {world}. Below are {count} numbered scene summaries. Please create one question and answer pair for each summary.
+
+{items}
+
+Requirements:
+1. The question should be about "{role}"'s behavior, feelings or thoughts in that scene
+2. This dialogue has no context, so the question needs to give some hints to help the character recall what is being discussed. Don't simply say "in this scene" or similar phrases
+3. The answer should be from "{role}"'s perspective, in first person, showing the character's personality and emotions
+4. The answer should include scene-related details and show character traits, don't fabricate content
+5. Answer length should be about 30-50 words
+
+Output a json object whose keys are the summary numbers and whose values are objects containing two fields: question and answer, covering all {count} numbers, no extra output.
+
+【Example Output】
+{{
+    "1": {{
+        "question": "Question",
+        "answer": "Answer"
+    }},
+    "2": {{
+        "question": "Question",
+        "answer": "Answer"
+    }}
+}}''',
+            
             'chat2qa_topics': '''Given the following background information about {character}:
 
 {general}
@@ -426,6 +649,26 @@ Scene content:
     "answer": ""
 }}''',
             
+            'conv2qa_packed': '''I am doing role-playing and you need to help me generate datasets. Below are {count} numbered scenes. Please generate one question-answer pair for each scene, requirements:
+1. The answerer in the Q&A pair is {role}, and the answer content should match {role}'s speaking tone as much as possible, and can slightly modify {role}'s lines in the scene as the answer.
+2. The questioner in the Q&A pair is the user. The question asked should coordinate with the answer content.
+3. Output a json object whose keys are the scene numbers and whose values are objects containing two fields: question and answer, covering all {count} numbers, no extra output.
+
+【Scenes】
+{items}
+
+【Example Output】
+{{
+    "1": {{
+        "question": "",
+        "answer": ""
+    }},
+    "2": {{
+        "question": "",
+        "answer": ""
+    }}
+}}''',
+            
             'conv2style': '''Historical dialogue: {input_data}, correct answer: {chosen}.
 
 Referring to the correct answer, provide another answer (rejected) with a tone obviously different from {role}'s.
@@ -434,7 +677,25 @@ No analysis is needed, avoid statements like "Here's the answer:".
 
 Example output format:
 
-- rejected: answer'''
+- rejected: answer''',
+            
+            'conv2style_packed': '''Below are {count} numbered original sentences (correct answers) spoken by {role}, each marked with the broken style to rewrite it in.
+
+{items}
+
+Referring to each original sentence, provide another answer (rejected) with a tone obviously different from {role}'s, rewritten in the style marked for that sentence, but maintaining the same meaning as the original sentence. No analysis is needed, avoid statements like "Here's the answer:".
+
+Output a json object whose keys are the sentence numbers and whose values are the rewritten sentences, covering all {count} numbers, no extra output.
+
+【Example Output】
+{{
+    "1": "Rewritten sentence",
+    "2": "Rewritten sentence"
+}}''',
+            
+            'structured_output': '''Respond with a JSON object and nothing else. If the requested format is an array, put the array in the "items" field of the object.''',
+            
+            'repair': '''The answer above could not be parsed in the required format. Output the complete result again, strictly following the example format in the original request, without any explanation or extra text.'''
         }
     
     def get_prompt(self, prompt_type: str, **kwargs) -> str:
@@ -448,8 +709,19 @@ Example output format:
         Returns:
             格式化后的prompt字符串
         """
+        return self.get_template(prompt_type).format(**kwargs)
+    
+    def get_template(self, prompt_type: str) -> str:
+        """
+        获取未格式化的prompt模板
+        
+        Args:
+            prompt_type: prompt类型
+        
+        Returns:
+            模板字符串
+        """
         if prompt_type not in self.prompts:
             raise ValueError(f"未知的prompt类型: {prompt_type}")
         
-        template = self.prompts[prompt_type]
-        return template.format(**kwargs) 
\ No newline at end of file
+        return self.prompts[prompt_type] 
\ No newline at end of file
@@ -0,0 +1,298 @@
+"""
+自适应速率控制模块
+按每分钟请求数(RPM)和每分钟token数(TPM)限流，遇到429/5xx时乘性降速、成功时加性恢复(AIMD)
+"""
+
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+# 判定为可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# 判定为可重试的异常类型名（连接错误、超时等，无需依赖openai包即可识别）
+RETRYABLE_ERROR_NAMES = {'APIConnectionError', 'APITimeoutError', 'Timeout', 'TimeoutError', 'ConnectionError'}
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    粗略估计一段文本的token数
+
+    中日韩字符按每字1个token计，其余字符按每4个字符1个token计
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk) // 4
+
+
+def estimate_message_tokens(messages: List[Dict], max_tokens: int = 0) -> int:
+    """
+    粗略估计一次请求消耗的token数
+
+    Args:
+        messages: 消息列表
+        max_tokens: 预留的输出token数
+    """
+    total = 0
+    for message in messages:
+        total += estimate_text_tokens(message.get('content') or '') + 4
+    return total + max_tokens
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """获取异常对应的HTTP状态码"""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """从异常的响应头中读取Retry-After秒数"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """判断异常是否为限流、服务端错误或网络错误"""
+    status = get_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class RateController:
+    """自适应速率控制器（线程安全，同时支持同步和协程调用）"""
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 max_retries: int = 3, backoff_base: float = 1.0, burst_seconds: float = 6.0,
+                 decrease_factor: float = 0.5, increase_step: float = 0.02, min_scale: float = 0.05,
+                 expected_output_tokens: int = 512):
+        """
+        初始化速率控制器
+
+        Args:
+            requests_per_minute: 每分钟请求数上限，为空时不限制
+            tokens_per_minute: 每分钟token数上限，为空时不限制
+            max_retries: 可重试错误的最大重试次数
+            backoff_base: 重试退避的基础等待秒数（按2的幂次增长）
+            burst_seconds: 令牌桶容量，按几秒的额度计算
+            decrease_factor: 遇到限流时速率的乘性缩小系数
+            increase_step: 每次成功后速率的加性恢复步长
+            min_scale: 速率缩放的下限
+            expected_output_tokens: 估计token时为输出预留的数量
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.burst_seconds = burst_seconds
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.min_scale = min_scale
+        self.expected_output_tokens = expected_output_tokens
+
+        # 当前速率缩放比例，1.0表示按配置额度全速运行
+        self.scale = 1.0
+
+        self._lock = threading.Lock()
+        self._last_refill = time.monotonic()
+        self._request_level = self._capacity(requests_per_minute)
+        self._token_level = self._capacity(tokens_per_minute)
+        self._blocked_until = 0.0
+        # 上一次乘性降速的时间，此前发出的请求的失败不再重复降速
+        self._last_decrease = float('-inf')
+
+        # 统计信息
+        self.stats = {'requests': 0, 'successes': 0, 'throttled': 0, 'decreases': 0, 'retries': 0, 'failures': 0,
+                      'wait_seconds': 0.0}
+
+    @classmethod
+    def from_config(cls, config) -> "RateController":
+        """根据配置创建速率控制器"""
+        return cls(
+            requests_per_minute=config.get('rate_limit.requests_per_minute'),
+            tokens_per_minute=config.get('rate_limit.tokens_per_minute'),
+            max_retries=config.get('openai.max_retries', 3),
+            backoff_base=config.get('generation.sleep_interval', 1),
+            decrease_factor=config.get('rate_limit.decrease_factor', 0.5),
+            increase_step=config.get('rate_limit.increase_step', 0.02),
+            min_scale=config.get('rate_limit.min_scale', 0.05)
+        )
+
+    def estimate_tokens(self, messages: List[Dict]) -> int:
+        """估计一次请求的token消耗（含预留的输出token）"""
+        return estimate_message_tokens(messages, self.expected_output_tokens)
+
+    def _capacity(self, per_minute: Optional[float]) -> float:
+        """令牌桶容量"""
+        if not per_minute:
+            return 0.0
+        return max(1.0, per_minute * self.scale / 60.0 * self.burst_seconds)
+
+    def _refill(self, now: float):
+        """按当前速率补充令牌"""
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            rate = self.requests_per_minute * self.scale / 60.0
+            self._request_level = min(self._capacity(self.requests_per_minute), self._request_level + elapsed * rate)
+        if self.tokens_per_minute:
+            rate = self.tokens_per_minute * self.scale / 60.0
+            self._token_level = min(self._capacity(self.tokens_per_minute), self._token_level + elapsed * rate)
+
+    def reserve(self, tokens: int) -> float:
+        """
+        预占一次请求的额度
+
+        额度立即扣除（允许透支），返回调用方在发出请求前需要等待的秒数
+
+        Args:
+            tokens: 估计的token消耗
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+
+            if self.requests_per_minute:
+                rate = self.requests_per_minute * self.scale / 60.0
+                if self._request_level < 1:
+                    wait = max(wait, (1 - self._request_level) / rate)
+                self._request_level -= 1
+
+            if self.tokens_per_minute:
+                rate = self.tokens_per_minute * self.scale / 60.0
+                needed = min(tokens, self._capacity(self.tokens_per_minute))
+                if self._token_level < needed:
+                    wait = max(wait, (needed - self._token_level) / rate)
+                self._token_level -= tokens
+
+            self.stats['requests'] += 1
+            self.stats['wait_seconds'] += wait
+            return wait
+
+    def acquire(self, tokens: int = 0):
+        """阻塞直到可以发出请求"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0):
+        """协程版本的acquire"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self, estimated_tokens: int = 0, actual_tokens: int = None):
+        """
+        请求成功后的反馈：用实际用量修正token额度，并加性恢复速率
+
+        Args:
+            estimated_tokens: 预占时估计的token数
+            actual_tokens: 响应中的实际token数
+        """
+        with self._lock:
+            if self.tokens_per_minute and actual_tokens is not None:
+                self._token_level += estimated_tokens - actual_tokens
+            self.scale = min(1.0, self.scale + self.increase_step)
+            self.stats['successes'] += 1
+
+    def on_error(self, error: Exception, sent_at: float = None) -> bool:
+        """
+        请求失败后的反馈：遇到限流或服务端错误时乘性降速并暂停发送
+
+        每个拥塞窗口只降速一次：在上一次降速之前发出的请求，其失败反映的是降速前的速率，
+        只计入统计不再降速，避免一批并发请求同时收到429时速率被连续减半到下限
+
+        Args:
+            error: 请求抛出的异常
+            sent_at: 请求发出的时间（time.monotonic()），为空时视为刚刚发出
+
+        Returns:
+            该错误是否可重试
+        """
+        if not is_retryable_error(error):
+            return False
+
+        with self._lock:
+            if sent_at is None or sent_at >= self._last_decrease:
+                self.scale = max(self.min_scale, self.scale * self.decrease_factor)
+                self._last_decrease = time.monotonic()
+                self.stats['decreases'] += 1
+            self.stats['throttled'] += 1
+            retry_after = get_retry_after(error)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        return True
+
+    def _count(self, key: str):
+        """累加统计计数"""
+        with self._lock:
+            self.stats[key] += 1
+
+    def backoff(self, attempt: int) -> float:
+        """第attempt次重试前的退避时间（带随机抖动）"""
+        return self.backoff_base * (2 ** attempt) * (0.5 + random.random())
+
+    def call(self, func: Callable[[], Any], tokens: int = 0) -> Any:
+        """
+        在速率控制下同步执行一次请求，可重试错误按退避策略重试
+
+        Args:
+            func: 发出请求的无参函数
+            tokens: 估计的token消耗
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens)
+            sent_at = time.monotonic()
+            try:
+                response = func()
+            except Exception as e:
+                if self.on_error(e, sent_at) and attempt < self.max_retries:
+                    self._count('retries')
+                    time.sleep(self.backoff(attempt))
+                    continue
+                self._count('failures')
+                raise
+            self.on_success(tokens, _total_tokens(response))
+            return response
+
+    async def acall(self, func: Callable[[], Any], tokens: int = 0) -> Any:
+        """
+        协程版本的call
+
+        Args:
+            func: 返回请求协程的无参函数
+            tokens: 估计的token消耗
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire(tokens)
+            sent_at = time.monotonic()
+            try:
+                response = await func()
+            except Exception as e:
+                if self.on_error(e, sent_at) and attempt < self.max_retries:
+                    self._count('retries')
+                    await asyncio.sleep(self.backoff(attempt))
+                    continue
+                self._count('failures')
+                raise
+            self.on_success(tokens, _total_tokens(response))
+            return response
+
+
+def _total_tokens(response: Any) -> Optional[int]:
+    """读取响应中的总token数"""
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', None) if usage is not None else None
@@ -0,0 +1,182 @@
+"""
+LLM响应缓存模块
+以请求内容的哈希为键，将API响应持久化到SQLite，重跑时直接复用已付费的结果
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class ResponseCache:
+    """基于SQLite的内容寻址响应缓存"""
+
+    # 每写入多少条检查一次淘汰
+    EVICT_EVERY = 200
+
+    def __init__(self, path: str, max_entries: int = None, max_size_mb: float = None, max_age_days: float = None):
+        """
+        初始化响应缓存
+
+        Args:
+            path: SQLite数据库文件路径
+            max_entries: 最大缓存条数，为空时不限制
+            max_size_mb: 缓存响应的最大总大小(MB)，为空时不限制
+            max_age_days: 缓存条目的最长保留天数，为空时不过期
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age = max_age_days * 86400 if max_age_days else None
+
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+            "created_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+        self._conn.commit()
+        self.evict()
+
+    @classmethod
+    def from_config(cls, config) -> Optional["ResponseCache"]:
+        """根据配置创建响应缓存，未启用时返回None"""
+        if not config.get('cache.enabled', False):
+            return None
+        path = config.get('cache.path')
+        if not path:
+            path = os.path.join(config.get('paths.output_base', 'output'), "cache", "responses.sqlite")
+        return cls(
+            path,
+            max_entries=config.get('cache.max_entries'),
+            max_size_mb=config.get('cache.max_size_mb'),
+            max_age_days=config.get('cache.max_age_days')
+        )
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict], temperature: float, version: str = "",
+                 response_format: Dict = None) -> str:
+        """
+        计算请求的缓存键
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            temperature: 温度参数
+            version: prompt模板版本
+            response_format: 结构化输出参数（未启用时不参与计算，已有缓存键保持不变）
+        """
+        fields = {'model': model, 'messages': messages, 'temperature': temperature, 'version': version}
+        if response_format is not None:
+            fields['response_format'] = response_format
+        payload = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age and now - row[1] > self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.stats['evictions'] += 1
+                row = None
+
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats['hits'] += 1
+            return row[0]
+
+    def set(self, key: str, model: str, response: str):
+        """写入缓存"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode('utf-8')), now, now)
+            )
+            self._conn.commit()
+            self.stats['writes'] += 1
+            self._writes_since_evict += 1
+            need_evict = self._writes_since_evict >= self.EVICT_EVERY
+
+        if need_evict:
+            self.evict()
+
+    def delete(self, key: str) -> bool:
+        """删除一条缓存，返回是否存在"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def evict(self):
+        """按保留时间、条数和总大小淘汰缓存（超限时优先淘汰最久未访问的条目）"""
+        with self._lock:
+            self._writes_since_evict = 0
+            removed = 0
+
+            if self.max_age:
+                cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,))
+                removed += cursor.rowcount
+
+            if self.max_entries:
+                count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    cursor = self._conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+                    removed += cursor.rowcount
+
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes
+                    keys = []
+                    for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+                        keys.append((key,))
+                        excess -= size
+                        if excess <= 0:
+                            break
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+                    removed += len(keys)
+
+            self._conn.commit()
+            self.stats['evictions'] += removed
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['entries'] = entries
+        stats['size_mb'] = round(size / 1024 / 1024, 2)
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,107 @@
+"""
+角色上下文模块
+角色的Wiki段落和通用背景信息在每个生成器上只读取一次，供各处理器共用；
+超大的Wiki文件按段落流式读取，不会作为一个完整字符串常驻内存
+"""
+
+import hashlib
+import os
+import threading
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+
+class Passage(NamedTuple):
+    """Wiki段落"""
+    id: str  # 段落内容的哈希，同一段落在不同运行和阶段中保持不变
+    text: str
+
+
+def passage_id(text: str) -> str:
+    """计算段落的稳定编号"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def iter_paragraphs(lines: Iterable[str]) -> Iterator[str]:
+    """按空行分割段落（与 content.split('\\n\\n') 的结果一致），去掉首尾空白并跳过空段落"""
+    buffer = []
+    for line in lines:
+        line = line.rstrip('\n')
+        if line:
+            buffer.append(line)
+            continue
+        paragraph = "\n".join(buffer).strip()
+        buffer = []
+        if paragraph:
+            yield paragraph
+    paragraph = "\n".join(buffer).strip()
+    if paragraph:
+        yield paragraph
+
+
+class RoleContext:
+    """单个角色的Wiki段落与通用背景信息（线程安全，首次使用时读取）"""
+
+    def __init__(self, wiki_path: str, general_path: str, stream_threshold_mb: float = 64):
+        """
+        初始化角色上下文
+
+        Args:
+            wiki_path: Wiki文件路径（wiki_{role}.txt）
+            general_path: 通用背景信息文件路径（general_{role}.txt）
+            stream_threshold_mb: Wiki文件超过该大小时不缓存段落，每次使用时流式读取
+        """
+        self.wiki_path = wiki_path
+        self.general_path = general_path
+        self.stream_threshold = stream_threshold_mb * 1024 * 1024 if stream_threshold_mb else None
+        self._lock = threading.Lock()
+        self._passages: Optional[List[Passage]] = None
+        self._general: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, config, path_manager, role: str) -> "RoleContext":
+        """根据配置创建角色上下文"""
+        return cls(
+            wiki_path=path_manager.get_local_input_path("wiki", f"wiki_{role}.txt"),
+            general_path=path_manager.get_local_input_path("general", f"general_{role}.txt"),
+            stream_threshold_mb=config.get('wiki.stream_threshold_mb', 64)
+        )
+
+    def has_wiki(self) -> bool:
+        return os.path.exists(self.wiki_path)
+
+    def has_general(self) -> bool:
+        return os.path.exists(self.general_path)
+
+    def is_streaming(self) -> bool:
+        """Wiki文件是否按流式读取"""
+        return bool(self.stream_threshold) and os.path.getsize(self.wiki_path) > self.stream_threshold
+
+    def passages(self) -> Iterable[Passage]:
+        """
+        Wiki段落：文件不超过流式阈值时读取一次后缓存，返回列表；
+        超过阈值时返回迭代器，每次按段落从文件读取
+
+        Raises:
+            OSError: Wiki文件不存在或无法读取
+        """
+        with self._lock:
+            if self._passages is not None:
+                return self._passages
+            if self.is_streaming():
+                return self._iter_file()
+            self._passages = list(self._iter_file())
+            return self._passages
+
+    def _iter_file(self) -> Iterator[Passage]:
+        with open(self.wiki_path, 'r', encoding='utf-8') as f:
+            for paragraph in iter_paragraphs(f):
+                yield Passage(passage_id(paragraph), paragraph)
+
+    @property
+    def general(self) -> Optional[str]:
+        """通用背景信息（去掉首尾空白），文件不存在时为None"""
+        with self._lock:
+            if self._general is None and self.has_general():
+                with open(self.general_path, 'r', encoding='utf-8') as f:
+                    self._general = f.read().strip()
+            return self._general
@@ -0,0 +1,162 @@
+"""
+场景存储模块
+解析 RoleAgentBench 的 profiles/{role}.jsonl，按场景分组对话、建立说话人索引并预先拼接场景文本，
+每个角色每次运行只解析一次，供 conv2summary、conv2qa、conv2style 等处理器共用；
+解析结果按源文件的修改时间、大小和内容哈希缓存到磁盘，重跑时直接读取
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from logger import LOGGER_NAME
+
+
+logger = logging.getLogger(f"{LOGGER_NAME}.scenes")
+
+
+class SceneStore:
+    """单个角色的对话场景"""
+
+    # 缓存格式版本，解析逻辑变化时递增，旧缓存自动失效
+    CACHE_VERSION = 1
+
+    def __init__(self, records: List[Dict]):
+        """
+        解析对话记录
+
+        Args:
+            records: profile文件中的原始记录（每行一条，按文件顺序）
+        """
+        self.records = records
+
+        # scene_id -> 该场景中内容非空的发言 [{'role', 'content'}]
+        self.scenes: Dict[Any, List[Dict]] = {}
+        for record in records:
+            content = record.get('content', '')
+            if content:
+                self.scenes.setdefault(record.get('scene_id', 0), []).append({
+                    'role': record.get('role', ''),
+                    'content': content
+                })
+        self.scene_ids: List[Any] = sorted(self.scenes)
+
+        # 预先拼接的场景文本（每行 "说话人: 内容"）
+        self.texts: Dict[Any, str] = {
+            scene_id: "\n".join(f"{item['role']}: {item['content']}" for item in self.scenes[scene_id]).strip()
+            for scene_id in self.scene_ids
+        }
+
+        # 说话人 -> [(场景序号, 场景内位置)]，场景序号为 scene_ids 中的下标
+        self.speakers: Dict[str, List[Tuple[int, int]]] = {}
+        for order, scene_id in enumerate(self.scene_ids):
+            for position, item in enumerate(self.scenes[scene_id]):
+                self.speakers.setdefault(item['role'], []).append((order, position))
+
+    def conversations(self) -> List[str]:
+        """按场景顺序返回非空的场景文本"""
+        return [self.texts[scene_id] for scene_id in self.scene_ids if self.texts[scene_id]]
+
+    def utterances(self, match: Callable[[str], bool], scene_ids: Iterable = None) -> List[str]:
+        """
+        按场景顺序返回匹配的说话人的发言内容
+
+        Args:
+            match: 判断说话人是否匹配的函数
+            scene_ids: 只取这些场景中的发言，为空时取全部场景
+        """
+        orders = None
+        if scene_ids is not None:
+            index = {scene_id: order for order, scene_id in enumerate(self.scene_ids)}
+            orders = {index[scene_id] for scene_id in scene_ids if scene_id in index}
+        positions = []
+        for speaker, entries in self.speakers.items():
+            if match(speaker):
+                positions.extend(entry for entry in entries if orders is None or entry[0] in orders)
+        positions.sort()
+        return [self.scenes[self.scene_ids[order]][position]['content'] for order, position in positions]
+
+    @classmethod
+    def parse(cls, file_path: str) -> "SceneStore":
+        """解析profile文件"""
+        records = []
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        return cls(records)
+
+    @classmethod
+    def load(cls, file_path: str, cache_dir: str = None) -> "SceneStore":
+        """
+        加载profile文件的场景，优先读取磁盘缓存
+
+        缓存记录源文件的修改时间、大小和内容哈希：修改时间和大小一致时直接读取；
+        不一致时计算哈希，内容未变（如文件被复制或touch）仍复用缓存，否则重新解析并更新缓存
+
+        Args:
+            file_path: profile文件路径
+            cache_dir: 缓存目录，为空时不使用缓存
+        """
+        if not cache_dir:
+            return cls.parse(file_path)
+
+        stat = os.stat(file_path)
+        name = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f"{name}_{os.path.splitext(os.path.basename(file_path))[0]}.pkl")
+
+        cached = cls._read_cache(cache_path)
+        if cached and (cached['mtime_ns'], cached['size']) == (stat.st_mtime_ns, stat.st_size):
+            return cached['store']
+
+        digest = cls._hash_file(file_path)
+        if cached and cached['sha1'] == digest:
+            store = cached['store']
+        else:
+            store = cls.parse(file_path)
+        cls._write_cache(cache_path, {
+            'version': cls.CACHE_VERSION,
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha1': digest,
+            'store': store
+        })
+        return store
+
+    @classmethod
+    def _read_cache(cls, cache_path: str) -> Optional[Dict]:
+        """读取缓存，不存在、版本不符或损坏时返回None"""
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取场景缓存失败，重新解析: {cache_path} ({e})")
+            return None
+        if not isinstance(cached, dict) or cached.get('version') != cls.CACHE_VERSION:
+            return None
+        return cached
+
+    @staticmethod
+    def _write_cache(cache_path: str, data: Dict):
+        """写入缓存（先写临时文件再替换，并发运行时不会读到写了一半的文件）"""
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"写入场景缓存失败: {cache_path} ({e})")
+
+    @staticmethod
+    def _hash_file(file_path: str) -> str:
+        sha1 = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
@@ -0,0 +1,128 @@
+"""
+阶段调度模块
+按各阶段声明的输入/输出产物构建依赖图，依赖满足后立即启动，互不依赖的阶段并发执行
+"""
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, List
+
+
+class Stage:
+    """处理阶段定义"""
+
+    def __init__(self, name: str, func: Callable, inputs: Iterable[str] = (), outputs: Iterable[str] = ()):
+        """
+        初始化阶段
+
+        Args:
+            name: 阶段名称
+            func: 阶段执行函数
+            inputs: 依赖的产物名称
+            outputs: 产出的产物名称
+        """
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+    def __repr__(self):
+        return f"Stage({self.name}: {list(self.inputs)} -> {list(self.outputs)})"
+
+
+class StageScheduler:
+    """基于产物依赖的DAG调度器"""
+
+    def __init__(self, stages: List[Stage], max_workers: int = 4):
+        """
+        初始化调度器
+
+        Args:
+            stages: 阶段列表，同时就绪的阶段按列表顺序启动
+            max_workers: 同时运行的最大阶段数
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = [stage.name for stage in stages]
+        self.max_workers = max(1, int(max_workers))
+        self.dependencies = self._resolve_dependencies(stages)
+
+        # 运行结果：阶段名 -> done / failed / skipped
+        self.status = {}
+        self.errors = {}
+
+    @staticmethod
+    def _resolve_dependencies(stages: List[Stage]) -> Dict[str, set]:
+        """根据产物找出每个阶段依赖的上游阶段（没有生产者的产物视为外部输入）"""
+        producers = {}
+        for stage in stages:
+            for artifact in stage.outputs:
+                if artifact in producers:
+                    raise ValueError(f"产物 {artifact} 被多个阶段产出: {producers[artifact]}, {stage.name}")
+                producers[artifact] = stage.name
+
+        dependencies = {}
+        for stage in stages:
+            dependencies[stage.name] = {
+                producers[artifact] for artifact in stage.inputs
+                if artifact in producers and producers[artifact] != stage.name
+            }
+        return dependencies
+
+    def critical_path(self) -> List[str]:
+        """返回依赖链最长的阶段序列（按阶段数计）"""
+        longest = {}
+
+        def chain(name):
+            if name not in longest:
+                upstream = [chain(dep) for dep in self.dependencies[name]]
+                longest[name] = max(upstream, key=len, default=[]) + [name]
+            return longest[name]
+
+        return max((chain(name) for name in self.order), key=len, default=[])
+
+    def run(self) -> Dict[str, str]:
+        """
+        执行所有阶段
+
+        上游失败的阶段会被跳过，其余阶段继续执行；全部结束后若有阶段失败则抛出第一个异常
+
+        Returns:
+            各阶段的运行状态
+        """
+        remaining = list(self.order)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as executor:
+            while remaining or running:
+                # 跳过上游已失败的阶段
+                for name in list(remaining):
+                    if any(self.status.get(dep) in ('failed', 'skipped') for dep in self.dependencies[name]):
+                        self.status[name] = 'skipped'
+                        remaining.remove(name)
+
+                # 启动依赖已满足的阶段
+                for name in list(remaining):
+                    if len(running) >= self.max_workers:
+                        break
+                    if all(self.status.get(dep) == 'done' for dep in self.dependencies[name]):
+                        remaining.remove(name)
+                        running[executor.submit(self.stages[name].func)] = name
+
+                if not running:
+                    if remaining:
+                        raise ValueError(f"阶段依赖存在环: {remaining}")
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        self.status[name] = 'done'
+                    except Exception as e:
+                        self.status[name] = 'failed'
+                        self.errors[name] = e
+
+        for name in self.order:
+            if name in self.errors:
+                raise self.errors[name]
+        return self.status
@@ -0,0 +1,80 @@
+"""
+阶段间流式传递模块
+上游阶段每完成一条数据就放入有界队列，下游阶段边接收边处理；队列满时上游阻塞（背压）
+"""
+
+import queue
+import threading
+from typing import Any, Iterator
+
+
+class StreamAborted(Exception):
+    """上游阶段失败，数据流被中止"""
+    pass
+
+
+class ItemStream:
+    """有界的阶段间数据流"""
+
+    _END = object()
+
+    def __init__(self, name: str, maxsize: int = 64):
+        """
+        初始化数据流
+
+        Args:
+            name: 数据流名称（对应的产物名）
+            maxsize: 队列容量，队列满时上游阻塞
+        """
+        self.name = name
+        self.count = 0
+        self._queue = queue.Queue(maxsize=max(1, maxsize))
+        self._cancelled = threading.Event()
+        self._closed = False
+        self._error = None
+
+    def _put(self, item: Any) -> bool:
+        """放入队列，下游已取消时放弃"""
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def put(self, item: Any) -> bool:
+        """
+        上游发送一条数据（队列满时阻塞）
+
+        Returns:
+            是否成功放入；下游已取消时返回False
+        """
+        if self._closed:
+            raise RuntimeError(f"数据流 {self.name} 已关闭")
+        if self._put(item):
+            self.count += 1
+            return True
+        return False
+
+    def close(self, error: Exception = None):
+        """上游结束发送；error 不为空时下游在读取到结尾时抛出 StreamAborted"""
+        if self._closed:
+            return
+        self._closed = True
+        self._error = error
+        self._put(self._END)
+
+    def cancel(self):
+        """下游不再读取，之后上游的发送会直接丢弃"""
+        self._cancelled.set()
+
+    def __iter__(self) -> Iterator[Any]:
+        """下游按到达顺序读取数据，直到上游关闭"""
+        while True:
+            item = self._queue.get()
+            if item is self._END:
+                if self._error is not None:
+                    raise StreamAborted(f"上游阶段失败，数据流 {self.name} 中止: {self._error}")
+                return
+            yield item
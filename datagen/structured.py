@@ -0,0 +1,171 @@
+"""
+结构化输出模块
+为各prompt类型定义响应的JSON Schema，构造结构化输出请求参数，
+并统计各阶段响应的校验、修复与最终失败情况
+"""
+
+import json
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from utils import save_json
+
+
+def _qa_object(question_field: str = "question") -> Dict:
+    """问答对对象的schema"""
+    return {
+        "type": "object",
+        "properties": {question_field: {"type": "string"}, "answer": {"type": "string"}},
+        "required": [question_field, "answer"],
+        "additionalProperties": False
+    }
+
+
+def _array(items: Dict) -> Dict:
+    return {"type": "array", "items": items}
+
+
+# prompt类型 -> 处理器解析的响应值的schema（与非结构化模式下示例输出的格式一致）
+RESPONSE_SCHEMAS = {
+    "statement2qa": _array(_qa_object()),
+    "summary2qa": _qa_object(),
+    "conv2qa": _qa_object(),
+    "chat2qa": _array(_qa_object()),
+    "chat2qa_topics": _array({"type": "string"}),
+    "wiki2anti": _array({
+        "type": "object",
+        "properties": {
+            "type": {"type": "string"},
+            "description": {"type": "string"},
+            "example_keywords": _array({"type": "string"})
+        },
+        "required": ["type", "description", "example_keywords"],
+        "additionalProperties": False
+    }),
+    "anti2qa": _array(_qa_object("query")),
+}
+
+# 结构化输出要求顶层为对象，数组类型的响应包装在该字段中
+ARRAY_FIELD = "items"
+
+
+def build_response_format(prompt_type: str, mode: str = "json_schema") -> Optional[Dict]:
+    """
+    构造 chat.completions 的 response_format 参数
+
+    Args:
+        prompt_type: prompt类型
+        mode: json_schema（按schema严格约束）或 json_object（只保证输出JSON对象）
+
+    Returns:
+        response_format 字典，该prompt类型没有schema时返回None
+    """
+    schema = RESPONSE_SCHEMAS.get(prompt_type)
+    if schema is None:
+        return None
+    if mode == "json_object":
+        return {"type": "json_object"}
+    if schema["type"] == "array":
+        schema = {
+            "type": "object",
+            "properties": {ARRAY_FIELD: schema},
+            "required": [ARRAY_FIELD],
+            "additionalProperties": False
+        }
+    return {"type": "json_schema", "json_schema": {"name": prompt_type, "strict": True, "schema": schema}}
+
+
+def unwrap_response(content: str) -> str:
+    """
+    将结构化输出的响应还原为非结构化模式下的格式：只含一个数组字段的对象还原为该数组，
+    其余响应原样返回，处理器的解析逻辑无需区分两种模式
+    """
+    try:
+        value = json.loads(content)
+    except (TypeError, ValueError):
+        return content
+    if isinstance(value, dict) and len(value) == 1:
+        inner = next(iter(value.values()))
+        if isinstance(inner, list):
+            return json.dumps(inner, ensure_ascii=False)
+    return content
+
+
+class ValidationReport:
+    """单个阶段的响应校验统计：首次通过、升级模型后通过、修复后通过和最终失败的数量"""
+
+    # 失败明细中保留的输入和响应长度
+    PREVIEW_CHARS = 300
+
+    def __init__(self, max_repair_requests: int = 0):
+        """
+        初始化校验统计
+
+        Args:
+            max_repair_requests: 本阶段修复请求总数上限，0表示不限
+        """
+        self.max_repair_requests = max_repair_requests
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.failures: List[Dict] = []
+
+    def take_repair(self) -> bool:
+        """申请一次修复请求，超出本阶段预算时返回False"""
+        with self._lock:
+            if self.max_repair_requests and self.counts['repair_requests'] >= self.max_repair_requests:
+                self.counts['budget_exhausted'] += 1
+                return False
+            self.counts['repair_requests'] += 1
+            return True
+
+    def record(self, outcome: str, item: Any = None, response: str = None, attempts: int = 0):
+        """
+        记录一个输入项的最终结果
+
+        Args:
+            outcome: passed（首次通过）/ escalated（升级模型后通过）/ repaired（修复后通过）/ failed
+            item: 输入项，失败时写入明细
+            response: 最后一次的响应，失败时写入明细
+            attempts: 修复请求次数
+        """
+        with self._lock:
+            self.counts['validated'] += 1
+            self.counts[outcome] += 1
+            if outcome == 'failed':
+                self.failures.append({
+                    "item": self._preview(item),
+                    "repair_attempts": attempts,
+                    "response": self._preview(response)
+                })
+
+    def _preview(self, value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+        return text if len(text) <= self.PREVIEW_CHARS else text[:self.PREVIEW_CHARS] + "..."
+
+    def summary(self) -> Dict:
+        """汇总统计"""
+        with self._lock:
+            counts = dict(self.counts)
+            failures = list(self.failures)
+        validated = counts.get('validated', 0)
+        failed = counts.get('failed', 0)
+        return {
+            "validated": validated,
+            "passed": counts.get('passed', 0),
+            "escalated": counts.get('escalated', 0),
+            "repaired": counts.get('repaired', 0),
+            "failed": failed,
+            "failure_rate": round(failed / validated, 4) if validated else None,
+            "repair_requests": counts.get('repair_requests', 0),
+            "repair_budget_exhausted": counts.get('budget_exhausted', 0),
+            "failures": failures
+        }
+
+    def save(self, path: str) -> Dict:
+        """保存统计报告"""
+        report = self.summary()
+        save_json(report, path)
+        return report
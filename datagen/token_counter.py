@@ -0,0 +1,255 @@
+"""
+离线token计数模块
+使用随包附带的BPE词表（tokenizer_data/cl100k_base.tiktoken.gz，tiktoken格式）在本地计算prompt的token数，
+不依赖网络和tiktoken包；词表不可用时退回到按字符估算。
+
+请求前用它检查渲染后的prompt是否超出模型的上下文窗口，超长的prompt按配置截断或直接报错，
+避免发出注定失败的付费请求；各prompt类型的token数分布写入用量报告，用于设置 max_tokens。
+
+用法（对比估算值与BPE计数）：
+    python token_counter.py [文本文件 ...]
+"""
+
+import argparse
+import base64
+import gzip
+import heapq
+import os
+import re
+import sys
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from logger import LOGGER_NAME
+from rate_limiter import estimate_text_tokens
+
+
+logger = logging.getLogger(f"{LOGGER_NAME}.tokens")
+
+
+DEFAULT_VOCAB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokenizer_data", "cl100k_base.tiktoken.gz")
+
+# cl100k_base 的预分词规则，\p{L}/\p{N} 用标准库 re 的等价写法表示；
+# 原规则中的占有量词（Python 3.11 起才支持）在这些分支中不影响匹配结果，改为普通的贪婪量词
+_PRETOKENIZE = re.compile(
+    r"'(?i:[sdmt]|ll|ve|re)"
+    r"|(?:[^\r\n\w]|_)?[^\W\d_]+"
+    r"|\d{1,3}"
+    r"| ?(?:[^\s\w]|_)+[\r\n]*"
+    r"|\s+\Z"
+    r"|\s*[\r\n]"
+    r"|\s+(?!\S)"
+    r"|\s"
+)
+
+# 每条消息的格式开销（角色名和分隔符）
+MESSAGE_OVERHEAD = 4
+
+
+class PromptTooLongError(ValueError):
+    """prompt超出模型上下文窗口，未发出请求"""
+
+
+def get_context_window(config, model: str) -> int:
+    """获取模型的上下文窗口大小（token数），models.context_windows 中未列出时使用 models.default_context_window"""
+    windows = config.get('models.context_windows') or {}
+    return int(windows.get(model) or config.get('models.default_context_window', 8192))
+
+
+class BPETokenizer:
+    """字节级BPE分词器（与tiktoken的合并规则一致）"""
+
+    # 分词结果缓存的条目数上限
+    CACHE_SIZE = 200000
+
+    # 超过该长度（字节）的片段改用堆合并，避免逐轮扫描的平方复杂度
+    HEAP_MERGE_BYTES = 64
+
+    def __init__(self, ranks: Dict[bytes, int]):
+        self.ranks = ranks
+        self._cache: Dict[bytes, int] = {}
+
+    @classmethod
+    def load(cls, path: str) -> "BPETokenizer":
+        """读取tiktoken格式的词表（每行为 base64编码的token 和 序号，支持gzip压缩）"""
+        opener = gzip.open if path.endswith('.gz') else open
+        ranks = {}
+        with opener(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    token, rank = line.split()
+                    ranks[base64.b64decode(token)] = int(rank)
+        return cls(ranks)
+
+    def _merge(self, piece: bytes) -> int:
+        """对一个预分词片段做BPE合并，返回token数"""
+        if len(piece) > self.HEAP_MERGE_BYTES:
+            return self._merge_heap(piece)
+        parts = [piece[i:i + 1] for i in range(len(piece))]
+        ranks = self.ranks
+        while len(parts) > 1:
+            best, index = None, -1
+            for i in range(len(parts) - 1):
+                rank = ranks.get(parts[i] + parts[i + 1])
+                if rank is not None and (best is None or rank < best):
+                    best, index = rank, i
+            if index < 0:
+                break
+            parts[index:index + 2] = [parts[index] + parts[index + 1]]
+        return len(parts)
+
+    def _merge_heap(self, piece: bytes) -> int:
+        """
+        长片段的BPE合并：用堆维护相邻对的序号，每次合并只更新两侧的相邻对，
+        结果与逐轮扫描相同（序号最小者优先，序号相同时靠左者优先）
+        """
+        ranks = self.ranks
+        parts = {i: piece[i:i + 1] for i in range(len(piece))}
+        following = {i: i + 1 for i in range(len(piece) - 1)}
+        preceding = {i + 1: i for i in range(len(piece) - 1)}
+        heap = []
+        for i in range(len(piece) - 1):
+            rank = ranks.get(parts[i] + parts[i + 1])
+            if rank is not None:
+                heap.append((rank, i, parts[i] + parts[i + 1]))
+        heapq.heapify(heap)
+        count = len(piece)
+        while heap:
+            rank, i, merged = heapq.heappop(heap)
+            right = following.get(i)
+            # 两侧已被其他合并改变的过期条目
+            if right is None or i not in parts or parts[i] + parts[right] != merged:
+                continue
+            parts[i] = merged
+            del parts[right]
+            count -= 1
+            after = following.pop(right, None)
+            preceding.pop(right, None)
+            if after is None:
+                following.pop(i, None)
+            else:
+                following[i] = after
+                preceding[after] = i
+                rank = ranks.get(merged + parts[after])
+                if rank is not None:
+                    heapq.heappush(heap, (rank, i, merged + parts[after]))
+            before = preceding.get(i)
+            if before is not None:
+                rank = ranks.get(parts[before] + merged)
+                if rank is not None:
+                    heapq.heappush(heap, (rank, before, parts[before] + merged))
+        return count
+
+    def count(self, text: str) -> int:
+        """计算文本的token数"""
+        total = 0
+        cache = self._cache
+        for match in _PRETOKENIZE.finditer(text):
+            piece = match.group().encode('utf-8')
+            if piece in self.ranks:
+                total += 1
+                continue
+            count = cache.get(piece)
+            if count is None:
+                count = self._merge(piece)
+                if len(cache) >= self.CACHE_SIZE:
+                    cache.clear()
+                cache[piece] = count
+            total += count
+        return total
+
+
+_tokenizers: Dict[str, Optional[BPETokenizer]] = {}
+_load_lock = threading.Lock()
+
+
+def load_tokenizer(path: str) -> Optional[BPETokenizer]:
+    """加载词表（同一路径在进程内只加载一次），文件不存在或无法解析时返回None"""
+    with _load_lock:
+        if path not in _tokenizers:
+            try:
+                _tokenizers[path] = BPETokenizer.load(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"加载BPE词表失败，改用按字符估算: {path} ({e})")
+                _tokenizers[path] = None
+        return _tokenizers[path]
+
+
+class TokenCounter:
+    """离线token计数器（线程安全，可在多个角色之间共享），词表在首次计数时加载"""
+
+    def __init__(self, vocab_path: str = DEFAULT_VOCAB, enabled: bool = True):
+        """
+        初始化token计数器
+
+        Args:
+            vocab_path: tiktoken格式的BPE词表路径
+            enabled: 为False时不加载词表，按字符估算
+        """
+        self.vocab_path = vocab_path
+        self.enabled = enabled
+        # 同一段文本（如通用背景信息）会在多个prompt中重复出现
+        self._count_text = lru_cache(maxsize=256)(self._count)
+
+    @classmethod
+    def from_config(cls, config) -> "TokenCounter":
+        """根据配置创建token计数器"""
+        return cls(
+            vocab_path=config.get('tokens.vocab_path') or DEFAULT_VOCAB,
+            enabled=config.get('tokens.bpe', True)
+        )
+
+    @property
+    def tokenizer(self) -> Optional[BPETokenizer]:
+        return load_tokenizer(self.vocab_path) if self.enabled else None
+
+    @property
+    def backend(self) -> str:
+        """当前的计数方式：bpe 或 estimate"""
+        return 'bpe' if self.tokenizer else 'estimate'
+
+    def _count(self, text: str) -> int:
+        tokenizer = self.tokenizer
+        return tokenizer.count(text) if tokenizer else estimate_text_tokens(text)
+
+    def count(self, text: str) -> int:
+        """计算文本的token数"""
+        if not text:
+            return 0
+        return self._count_text(text)
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        """计算一次请求中全部消息的token数（含每条消息的格式开销）"""
+        return sum(self.count(message.get('content') or '') + MESSAGE_OVERHEAD for message in messages)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """将文本截断到不超过 max_tokens 个token（按字符二分查找截断位置）"""
+        if self.count(text) <= max_tokens:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._count(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比按字符估算与BPE计数的token数")
+    parser.add_argument("files", nargs="*", help="文本文件，为空时从标准输入读取")
+    parser.add_argument("--vocab", default=DEFAULT_VOCAB, help="BPE词表路径")
+    args = parser.parse_args()
+
+    counter = TokenCounter(args.vocab)
+    sources = [(path, open(path, encoding='utf-8').read()) for path in args.files] or [("<stdin>", sys.stdin.read())]
+    for name, text in sources:
+        print(f"{name}: {len(text)} 字符, 估算 {estimate_text_tokens(text)} tokens, "
+              f"{counter.backend} {counter.count(text)} tokens")
+
+
+if __name__ == "__main__":
+    main()
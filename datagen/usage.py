@@ -0,0 +1,285 @@
+"""
+token用量与成本统计模块
+记录每次API调用的用量（按世界/角色/阶段/模型汇总），估算成本并生成用量报告
+"""
+
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import save_json
+
+
+USAGE_FIELDS = ('calls', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'cost')
+
+
+def token_histogram(values: List[int]) -> Dict:
+    """token数分布：分位数，以及按2的幂分桶的计数（键为桶的上限）"""
+    ordered = sorted(values)
+    count = len(ordered)
+
+    def percentile(p):
+        return ordered[min(count - 1, int(p * count))]
+
+    buckets = Counter()
+    for value in ordered:
+        buckets[1 << max(6, (value - 1).bit_length())] += 1
+    return {
+        'count': count,
+        'mean': round(sum(ordered) / count, 1),
+        'p50': percentile(0.5),
+        'p90': percentile(0.9),
+        'p99': percentile(0.99),
+        'max': ordered[-1],
+        'buckets': {f"<={bound}": buckets[bound] for bound in sorted(buckets)}
+    }
+
+
+def extract_usage(usage: Any) -> Tuple[int, int, int]:
+    """
+    从API响应的usage中提取 (prompt_tokens, completion_tokens, cached_tokens)
+
+    同时支持openai返回的对象和Batch输出中的字典
+    """
+    if usage is None:
+        return 0, 0, 0
+
+    def field(obj, name):
+        if isinstance(obj, dict):
+            return obj.get(name)
+        return getattr(obj, name, None)
+
+    details = field(usage, 'prompt_tokens_details')
+    cached = field(details, 'cached_tokens') if details is not None else None
+    return field(usage, 'prompt_tokens') or 0, field(usage, 'completion_tokens') or 0, cached or 0
+
+
+class UsageTracker:
+    """线程安全的用量统计器，可在多个角色之间共享"""
+
+    def __init__(self, pricing: Dict[str, Dict] = None, batch_discount: float = 0.5):
+        """
+        初始化用量统计器
+
+        Args:
+            pricing: 模型价格表，模型名 -> {input, cached_input, output}（美元/百万token）
+            batch_discount: Batch API 的价格折扣系数
+        """
+        self.pricing = pricing or {}
+        self.batch_discount = batch_discount
+        self._lock = threading.Lock()
+        # (world, role, stage, model) -> 用量
+        self._usage = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        # (world, role, stage) -> 计数
+        self._cache_hits = Counter()
+        self._outputs = Counter()
+        self._composition = defaultdict(Counter)
+        # (world, role, stage, prompt类型) -> 渲染后各prompt的token数
+        self._prompt_tokens = defaultdict(list)
+        # (world, role, stage) -> 各次调用的输出token数
+        self._completion_tokens = defaultdict(list)
+        # (world, role, stage) -> 超出上下文窗口的prompt的处理方式计数（truncated/rejected）
+        self._oversize = defaultdict(Counter)
+        # (world, role, stage) -> 级联各层级的 (调用数, 通过校验数)
+        self._tiers = defaultdict(Counter)
+
+    @classmethod
+    def from_config(cls, config) -> "UsageTracker":
+        """根据配置创建用量统计器"""
+        return cls(
+            pricing=config.get('pricing') or {},
+            batch_discount=config.get('batch.price_discount', 0.5)
+        )
+
+    def estimate_cost(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0,
+                      batch: bool = False) -> Optional[float]:
+        """按价格表估算成本（美元），模型不在价格表中时返回None"""
+        price = self.pricing.get(model)
+        if not price:
+            return None
+        input_price = price.get('input', 0)
+        cached_price = price.get('cached_input', input_price)
+        cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+                + completion_tokens * price.get('output', 0)) / 1_000_000
+        return cost * self.batch_discount if batch else cost
+
+    def record(self, world: str, role: str, stage: Optional[str], model: str, usage: Any, batch: bool = False):
+        """
+        记录一次API调用的用量
+
+        Args:
+            world: 世界名称
+            role: 角色名称
+            stage: 阶段名称
+            model: 模型名称
+            usage: 响应中的usage对象或字典
+            batch: 是否为Batch API调用
+        """
+        prompt_tokens, completion_tokens, cached_tokens = extract_usage(usage)
+        cost = self.estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens, batch) or 0
+        with self._lock:
+            entry = self._usage[(world, role, stage or 'unknown', model)]
+            entry['calls'] += 1
+            entry['prompt_tokens'] += prompt_tokens
+            entry['completion_tokens'] += completion_tokens
+            entry['cached_tokens'] += cached_tokens
+            entry['cost'] += cost
+            if completion_tokens:
+                self._completion_tokens[(world, role, stage or 'unknown')].append(completion_tokens)
+
+    def record_cache_hit(self, world: str, role: str, stage: Optional[str]):
+        """记录一次响应缓存命中（未产生API费用）"""
+        with self._lock:
+            self._cache_hits[(world, role, stage or 'unknown')] += 1
+
+    def record_outputs(self, world: str, role: str, stage: str, count: int):
+        """记录阶段产出的数据条数"""
+        with self._lock:
+            self._outputs[(world, role, stage)] += count
+
+    def record_prompt_parts(self, world: str, role: str, stage: str, parts: Dict[str, int]):
+        """记录prompt的组成（各部分的估计token数）"""
+        with self._lock:
+            self._composition[(world, role, stage)].update(parts)
+
+    def record_prompt_tokens(self, world: str, role: str, stage: str, prompt_type: str, tokens: int):
+        """记录一个渲染后的prompt的token数（离线计数，发出请求之前）"""
+        with self._lock:
+            self._prompt_tokens[(world, role, stage, prompt_type)].append(tokens)
+
+    def record_oversize(self, world: str, role: str, stage: str, action: str):
+        """记录一个超出上下文窗口的prompt（action: truncated 截断后发出 / rejected 未发出）"""
+        with self._lock:
+            self._oversize[(world, role, stage)][action] += 1
+
+    def record_tier(self, world: str, role: str, stage: str, tier: str, passed: bool):
+        """
+        记录级联模式下一次响应的校验结果
+
+        Args:
+            tier: 层级（base: 本阶段的模型，escalated: 升级后的模型）
+            passed: 响应是否通过本阶段的解析/校验
+        """
+        with self._lock:
+            counter = self._tiers[(world, role, stage)]
+            counter[(tier, 'calls')] += 1
+            if passed:
+                counter[(tier, 'passed')] += 1
+
+    @staticmethod
+    def _new_bucket() -> Dict:
+        bucket = dict.fromkeys(USAGE_FIELDS, 0)
+        bucket.update({'cache_hits': 0, 'output_items': 0})
+        return bucket
+
+    @staticmethod
+    def _finish_bucket(bucket: Dict) -> Dict:
+        """补充派生指标"""
+        bucket['cost'] = round(bucket['cost'], 6)
+        tokens = bucket['prompt_tokens'] + bucket['completion_tokens']
+        bucket['total_tokens'] = tokens
+        bucket['tokens_per_output_item'] = round(tokens / bucket['output_items'], 1) if bucket['output_items'] else None
+        return bucket
+
+    def summary(self, world: str = None, role: str = None) -> Dict:
+        """
+        汇总用量，可只统计指定世界/角色
+
+        Returns:
+            totals、stages、roles、models 四个维度的汇总
+        """
+        def selected(key):
+            return (world is None or key[0] == world) and (role is None or key[1] == role)
+
+        totals = self._new_bucket()
+        stages = defaultdict(self._new_bucket)
+        roles = defaultdict(self._new_bucket)
+        models = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+
+        with self._lock:
+            for key, entry in self._usage.items():
+                if not selected(key):
+                    continue
+                key_world, key_role, stage, model = key
+                for field in USAGE_FIELDS:
+                    totals[field] += entry[field]
+                    stages[stage][field] += entry[field]
+                    roles[f"{key_world}/{key_role}"][field] += entry[field]
+                    models[model][field] += entry[field]
+            for counter, field in ((self._cache_hits, 'cache_hits'), (self._outputs, 'output_items')):
+                for key, count in counter.items():
+                    if not selected(key):
+                        continue
+                    totals[field] += count
+                    stages[key[2]][field] += count
+                    roles[f"{key[0]}/{key[1]}"][field] += count
+            composition = defaultdict(Counter)
+            for key, parts in self._composition.items():
+                if selected(key):
+                    composition[key[2]].update(parts)
+            tiers = defaultdict(Counter)
+            for key, counter in self._tiers.items():
+                if selected(key):
+                    tiers[key[2]].update(counter)
+            prompt_tokens = defaultdict(lambda: defaultdict(list))
+            for key, values in self._prompt_tokens.items():
+                if selected(key):
+                    prompt_tokens[key[2]][key[3]].extend(values)
+                    stages[key[2]]  # 只有离线计数、没有发出请求的阶段也列入报告
+            completion_tokens = defaultdict(list)
+            for key, values in self._completion_tokens.items():
+                if selected(key):
+                    completion_tokens[key[2]].extend(values)
+            oversize = defaultdict(Counter)
+            for key, counter in self._oversize.items():
+                if selected(key):
+                    oversize[key[2]].update(counter)
+                    stages[key[2]]
+
+        for stage, bucket in stages.items():
+            parts = composition.get(stage)
+            if parts:
+                total = sum(parts.values())
+                bucket['prompt_composition'] = {part: round(count / total, 3) for part, count in parts.items()}
+            if tiers.get(stage):
+                bucket['tiers'] = self._tier_rates(tiers[stage])
+            if prompt_tokens.get(stage):
+                bucket['prompt_token_histograms'] = {prompt_type: token_histogram(values)
+                                                     for prompt_type, values in sorted(prompt_tokens[stage].items())}
+            if completion_tokens.get(stage):
+                bucket['completion_token_histogram'] = token_histogram(completion_tokens[stage])
+            if oversize.get(stage):
+                bucket['oversize_prompts'] = dict(oversize[stage])
+            self._finish_bucket(bucket)
+        all_tiers = Counter()
+        for counter in tiers.values():
+            all_tiers.update(counter)
+        if all_tiers:
+            totals['tiers'] = self._tier_rates(all_tiers)
+        for bucket in roles.values():
+            self._finish_bucket(bucket)
+        for bucket in models.values():
+            bucket['cost'] = round(bucket['cost'], 6)
+
+        return {
+            'totals': self._finish_bucket(totals),
+            'stages': dict(sorted(stages.items(), key=lambda item: -item[1]['total_tokens'])),
+            'roles': dict(roles),
+            'models': dict(models),
+            'priced': bool(self.pricing)
+        }
+
+    @staticmethod
+    def _tier_rates(counter: Counter) -> Dict:
+        """计算级联各层级的校验通过率"""
+        rates = {}
+        for tier in sorted({tier for tier, _ in counter}):
+            calls, passed = counter[(tier, 'calls')], counter[(tier, 'passed')]
+            rates[tier] = {'calls': calls, 'passed': passed, 'success_rate': round(passed / calls, 4) if calls else None}
+        return rates
+
+    def save_report(self, path: str, world: str = None, role: str = None) -> Dict:
+        """保存用量报告"""
+        report = self.summary(world, role)
+        save_json(report, path)
+        return report
@@ -4,11 +4,12 @@
 """
 
 import os
+import re
 import json
+import time
 import yaml
 import random
-from typing import Dict, List, Any, Optional
-from pathlib import Path
+from typing import Dict, List, Any, Iterator
 
 
 class Config:
@@ -163,17 +164,45 @@ class PathManager:
         os.makedirs(path, exist_ok=True)
 
 
+# 文件读写观察者（如性能分析器），以 (操作, 文件路径, 耗时秒数) 调用
+_io_observers = []
+
+
+def add_io_observer(callback):
+    """注册JSON文件读写的观察者"""
+    _io_observers.append(callback)
+
+
+def remove_io_observer(callback):
+    """移除JSON文件读写的观察者"""
+    if callback in _io_observers:
+        _io_observers.remove(callback)
+
+
+def _notify_io(operation: str, file_path: str, start: float):
+    """通知观察者一次文件读写的耗时"""
+    if _io_observers:
+        seconds = time.perf_counter() - start
+        for callback in list(_io_observers):
+            callback(operation, file_path, seconds)
+
+
 def load_json(file_path: str) -> List[Dict]:
     """加载JSON文件"""
+    start = time.perf_counter()
     with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+        data = json.load(f)
+    _notify_io('load', file_path, start)
+    return data
 
 
 def save_json(data: List[Dict], file_path: str):
     """保存JSON文件"""
+    start = time.perf_counter()
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
     with open(file_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    _notify_io('save', file_path, start)
 
 
 def load_jsonl(file_path: str) -> List[Dict]:
@@ -194,6 +223,92 @@ def save_jsonl(data: List[Dict], file_path: str):
             f.write(json.dumps(item, ensure_ascii=False) + '\n')
 
 
+_JSON_DELIMITER = re.compile(r'\s*[,\]]')
+
+
+def iter_json_items(file_path: str, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """
+    逐条读取JSON数组文件（.json）或JSONL文件（.jsonl）中的元素，不把整个文件读入内存
+
+    JSON数组按块读取，用 raw_decode 逐个解码元素，内存中只保留当前块和正在解码的元素
+    """
+    if file_path.endswith('.jsonl'):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"不是JSON数组文件: {file_path}")
+        position = 1
+        eof = False
+        while True:
+            # 跳过空白和元素之间的逗号
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            if position == len(buffer) and eof:
+                raise ValueError(f"JSON数组未闭合: {file_path}")
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # 元素后面应为逗号或 ]，否则（如数字在块末尾被截断）元素可能还未读完
+                complete = _JSON_DELIMITER.match(buffer, end) is not None
+                if not complete and eof:
+                    raise ValueError(f"JSON数组格式错误: {file_path}")
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # 当前块中的元素不完整，读入下一块后重试
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+            position = end
+            if position > chunk_size:
+                buffer = buffer[position:]
+                position = 0
+
+
+class JsonArrayWriter:
+    """逐条写入JSON数组文件（格式与 save_json 相同），先写临时文件，完成后替换为目标文件"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.temp_path = f"{file_path}.{os.getpid()}.tmp"
+        self.count = 0
+        self._file = None
+
+    def __enter__(self) -> "JsonArrayWriter":
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        self._file = open(self.temp_path, 'w', encoding='utf-8')
+        self._file.write('[')
+        return self
+
+    def write(self, item: Any):
+        """写入一条数据"""
+        text = json.dumps(item, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+        self._file.write(('\n  ' if self.count == 0 else ',\n  ') + text)
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._file.write('\n]' if self.count else ']')
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.temp_path, self.file_path)
+        else:
+            os.remove(self.temp_path)
+        return False
+
+
 def shuffle_data(data: List[Dict], seed: int = 42) -> List[Dict]:
     """打乱数据"""
     random.seed(seed)
@@ -1,19 +1,36 @@
 import os
+import sys
 import time
 import json
 from tqdm import tqdm
 import random
 from openai import OpenAI
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datagen"))
+from rate_limiter import RateController, estimate_message_tokens
+
 # Configuration
 API_KEY = "your_openai_api_key_here"
 BASE_URL = "https://api.openai.com/v1"  # Or other compatible API endpoint
 MODEL_NAME = "gpt-4o"
 
-# Initialize OpenAI client
+# Rate limit configuration (shared limiter logic with datagen)
+REQUESTS_PER_MINUTE = 60
+TOKENS_PER_MINUTE = 100000
+MAX_RETRIES = 3
+
+# Initialize OpenAI client (retries are handled by the rate controller)
 client = OpenAI(
     api_key=API_KEY,
-    base_url=BASE_URL
+    base_url=BASE_URL,
+    max_retries=0
+)
+
+# Initialize rate controller
+rate_controller = RateController(
+    requests_per_minute=REQUESTS_PER_MINUTE,
+    tokens_per_minute=TOKENS_PER_MINUTE,
+    max_retries=MAX_RETRIES
 )
 
 # Data path configuration
@@ -174,11 +191,15 @@ def generate_evaluation_prompt(dimension, agent_name, agent_context, question, r
 def call_openai_api(prompt):
     """Call OpenAI API for evaluation."""
     try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=500,
-            temperature=0.7
+        messages = [{"role": "user", "content": prompt}]
+        response = rate_controller.call(
+            lambda: client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7
+            ),
+            estimate_message_tokens(messages, 500)
         )
         return {
             "choices": [{
@@ -248,8 +269,6 @@ def process_evaluation(item, role_name, profile):
                 "score": None,
                 "content": None
             }
-        
-        time.sleep(1)  # Avoid API rate limits
     
     return results
 
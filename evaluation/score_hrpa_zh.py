@@ -1,18 +1,35 @@
 import os
+import sys
 import time
 import json
 from tqdm import tqdm
 from openai import OpenAI
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datagen"))
+from rate_limiter import RateController, estimate_message_tokens
+
 # 配置信息
 API_KEY = "your_openai_api_key_here"
 BASE_URL = "https://api.openai.com/v1"  # 或其他兼容的API端点
 MODEL_NAME = "gpt-4o"
 
-# 初始化OpenAI客户端
+# 速率控制配置（与datagen共用同一套限流逻辑）
+REQUESTS_PER_MINUTE = 60
+TOKENS_PER_MINUTE = 100000
+MAX_RETRIES = 3
+
+# 初始化OpenAI客户端（重试由速率控制器负责）
 client = OpenAI(
     api_key=API_KEY,
-    base_url=BASE_URL
+    base_url=BASE_URL,
+    max_retries=0
+)
+
+# 初始化速率控制器
+rate_controller = RateController(
+    requests_per_minute=REQUESTS_PER_MINUTE,
+    tokens_per_minute=TOKENS_PER_MINUTE,
+    max_retries=MAX_RETRIES
 )
 
 # 数据路径配置
@@ -202,11 +219,15 @@ def generate_evaluation_prompt(role, profile, question, answer, retrieve, respon
 def call_openai_api(prompt):
     """调用OpenAI API进行评估"""
     try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=500,
-            temperature=0.7
+        messages = [{"role": "user", "content": prompt}]
+        response = rate_controller.call(
+            lambda: client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7
+            ),
+            estimate_message_tokens(messages, 500)
         )
         return {
             "choices": [{
@@ -317,8 +338,6 @@ def main():
         if result['evaluation']['score'] is not None:
             dimension_scores[evaluation_scale]['total'] += result['evaluation']['score']
             dimension_scores[evaluation_scale]['count'] += 1
-        
-        time.sleep(1)  # 避免API限流
     
     # 计算平均分
     dimension_averages = {}